@@ -8,23 +8,28 @@ from sqlalchemy.orm import load_only
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy import exc,literal
 import datetime, json, pytz, random, requests, string, os
-from Circles import constants
+from Circles import authCache, constants, logs
+
+log = logs.getLogger(__name__)
 
 apiBlueprint = Blueprint('apiBlueprint', __name__)
 auth = HTTPBasicAuth()
 
 @auth.verify_password
 def verify_password(username_or_token, password):
-    # first try to authenticate by token
-    user = User.verify_auth_token(username_or_token, os.environ['SECRET_KEY'])
+    # first try to authenticate by token, served from the token cache when possible
+    principal = authCache.verifyToken(username_or_token, os.environ['SECRET_KEY'])
+    if principal:
+        g.user = authCache.AuthenticatedUser(principal)
+        return True
+
+    # try to authenticate with username/password
+    user = User.query.filter_by(phoneNumber=username_or_token).first()
     if not user:
-        # try to authenticate with username/password
-        user = User.query.filter_by(phoneNumber=username_or_token).first()
-        if not user:
-            print('ERROR: No user found for user name.')
-            return False
+        log.error('No user found for user name.')
+        return False
 
-    g.user = user
+    g.user = authCache.AuthenticatedUser(authCache.principalFromUser(user), user)
     return True
 
 
@@ -6,10 +6,9 @@ from Circles.models import AuthCodeVerification, Card, db, FriendRequest, User,
 from firebase_admin import messaging
 from sqlalchemy.orm import load_only
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import exc,literal, desc
-import datetime, json, pytz, random, requests, string, os
-from Circles import constants, utils
-from threading import Thread
+from sqlalchemy import exc,literal, desc, or_
+import datetime, functools, json, pytz, random, requests, string, os
+from Circles import cardCatalog, constants, expiry, friendGraph, jsonCodec, logs, mutualFriends, outbox, replicas, utils
 from twilio.rest import Client
 from virgil_crypto import VirgilCrypto
 from virgil_crypto.access_token_signer import AccessTokenSigner
@@ -17,60 +16,70 @@ from virgil_sdk.jwt import JwtGenerator
 from virgil_sdk.utils import Utils
 from . import apiBlueprint, auth
 
+log = logs.getLogger(__name__)
+
 
 @apiBlueprint.route("/accessRequests/new", methods=["POST"])
 @auth.login_required
 def createNewAccessRequest():
     if "to" not in request.json:
-        print("ERROR: No user id provided to send the access request to")
+        log.error('No user id provided to send the access request to')
         return "", constants.STATUS_BAD_REQUEST
 
     if "amount" not in request.json:
-        print("ERROR: No amount provided to send access request for")
+        log.error('No amount provided to send access request for')
         return "", constants.STATUS_BAD_REQUEST
 
     if "cardId" not in request.json:
-        print("ERROR: No cardId provided to send access request for")
+        log.error('No cardId provided to send access request for')
         return "", constants.STATUS_BAD_REQUEST
 
     amount = request.json["amount"]
     to = request.json["to"]
     cardId = int(request.json["cardId"])
     shortDesc = constants.DATETIME_NOT_AVAILABLE if "shortDesc" not in request.json else request.json["shortDesc"]
-    mutualFriendName = None if "mutualFriendName" not in request.json else request.json["mutualFriendName"]
-    db.create_all()
     recipient = User.query.options(load_only('fcmToken')).get(to)
     if not recipient:
-        print("ERROR: No user found with id: " + str(to) + " to send access request to")
+        log.error('No user found with id: %s to send access request to', to)
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
+    # The mutual friend of a second degree request is the best ranked one. The name the client sent is kept when
+    # the server finds none, as it was before the server computed it.
+    mutualFriendName = None
+    if not friendGraph.isFriend(g.user.id, recipient.id):
+        mutuals = mutualFriends.getMutualFriends(g.user.id, recipient.id)
+        if mutuals:
+            mutualFriendName = mutuals[0].name
+        else:
+            log.warning('No mutual friend of users: %s and %s, keeping the mutualFriendName sent', g.user.id, recipient.id)
+            mutualFriendName = request.json.get("mutualFriendName")
+
     timeNow = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
-    accessRequest = AccessRequest(cardId=cardId, amount=amount, shortDesc=shortDesc, mutualFriendName=mutualFriendName, \
-                                status=constants.ACCESS_REQUEST_UNACCEPTED, createdOn=timeNow)
-    g.user.aRequests_sent.append(accessRequest)
-    recipient.aRequests_rec.append(accessRequest)
+    accessRequest = AccessRequest(fromUserId=g.user.id, toUserId=recipient.id, cardId=cardId, amount=amount, shortDesc=shortDesc, \
+                                mutualFriendName=mutualFriendName, status=constants.ACCESS_REQUEST_UNACCEPTED, createdOn=timeNow)
     db.session.add(accessRequest)
-    db.session.commit()
+    db.session.flush()
 
-    # Send notification in parallel
+    # The notification is committed with the request and delivered by the outbox worker
     notification = createNotificationForAccessRequest(g.user.name, cardId) if not mutualFriendName \
                     else createNotificationForSecondDegreeAccessRequest(g.user.name, mutualFriendName)
-    fcmToken = recipient.fcmToken
     data = {
         "requestId": str(accessRequest.id),
         "type": constants.ACCESS_REQUEST_NOTIFICATION_TYPE,
     }
+    outbox.enqueueNotification(recipient.fcmToken, notification, data)
 
-    db.session.close()
-    t = Thread(target=utils.sendDeviceNotification, args=(fcmToken, notification, data))
-    t.start()
+    if (not commitToDB()):
+        log.error('Problem creating the access request')
+        return "", constants.STATUS_SERVER_ERROR
 
+    outbox.wake()
     return "", constants.STATUS_OK
 
 
 def createNotificationForAccessRequest(name, cardId):
-    cardName = getCardNameFromId(cardId)
+    cardName = cardCatalog.getName(cardId)
     return messaging.Notification(constants.ACCESS_REQUEST_NOTIFICATION_TITLE.format(name), \
                                   constants.ACCESS_REQUEST_NOTIFICATION_BODY.format(name, cardName), os.environ["LOGO_URL"])
 
@@ -84,21 +93,20 @@ def createNotificationForSecondDegreeAccessRequest(name, mutualFriendName):
 @auth.login_required
 def getAccessRequestInfo():
     if "id" not in request.args:
-        print("ERROR: No id of access request provided")
+        log.error('No id of access request provided')
         return "", constants.STATUS_BAD_REQUEST
 
     requestId = request.args["id"]
-    db.create_all()
     accessRequest = AccessRequest.query.get(requestId)
     if not accessRequest:
-        print("ERROR: No access request found for getAccessRequest with id: " + str(requestId))
+        log.error('No access request found for getAccessRequest with id: %s', requestId)
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
     status = getAccessRequestStatus(accessRequest.createdOn, accessRequest.status)
 
     if accessRequest.toUserId != g.user.id and accessRequest.fromUserId != g.user.id:
-        print("ERROR: Cannot get access request info when the user is not involved. User: " + str(g.user.id) + " Req: " + str(requestId))
+        log.error('Cannot get access request info when the user is not involved. User: %s Req: %s', g.user.id, requestId)
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
@@ -115,7 +123,7 @@ def getAccessRequestInfo():
         "recipientImgUrl": accessRequest.recipient.profileImgUrl,
         "amount": accessRequest.amount,
         "cardId": accessRequest.cardId,
-        "cardName": getCardNameFromId(accessRequest.cardId),
+        "cardName": cardCatalog.getName(accessRequest.cardId),
         "status": status,
         "shortDesc": accessRequest.shortDesc,
         "mutualFriendName": accessRequest.mutualFriendName,
@@ -130,23 +138,28 @@ def getAccessRequestInfo():
 @auth.login_required
 def respondToAccessRequest():
     if "requestId" not in request.json:
-        print("ERROR: No access request id provided to respond to")
+        log.error('No access request id provided to respond to')
         return "", constants.STATUS_BAD_REQUEST
 
     if "action" not in request.json:
-        print("ERROR: No status provided to respond to access request with")
+        log.error('No status provided to respond to access request with')
         return "", constants.STATUS_BAD_REQUEST
 
     action = request.json["action"]
     requestId = request.json["requestId"]
-    db.create_all()
     accessRequest = AccessRequest.query.get(requestId)
+    if not accessRequest:
+        log.error('No access request found with id: %s', requestId)
+        db.session.close()
+        return "", constants.STATUS_BAD_REQUEST
+
     if g.user.id != accessRequest.toUserId:
-        print("ERROR: Only the sender can respond to an access request: " + str(g.user.id))
+        log.error('Only the sender can respond to an access request: %s', g.user.id)
+        db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
     if accessRequest.status == action:
-        print("WARNING: Access request status already at the desired state:" + str(action))
+        log.warning('Access request status already at the desired state:%s', action)
         db.session.close()
     else:
         data = {
@@ -163,20 +176,15 @@ def respondToAccessRequest():
         else:
             notification = createNotificationForDeclinedAccessRequest(g.user.name)
             
+        outbox.enqueueNotification(fcmToken, notification, data)
         if (not commitToDB()):
-            print('ERROR: Problem resolving the access request')
+            log.error('Problem resolving the access request')
             return "", constants.STATUS_SERVER_ERROR
 
-        t = Thread(target=utils.sendDeviceNotification, args=(fcmToken, notification, data))
-        t.start()
+        outbox.wake()
 
-        try:
-            if (action == constants.ACCESS_REQUEST_ACCEPTED):
-                smsText = "New request created: " + str(requestId)
-                notifyFounders = Thread(target=utils.sendSMSToFounders, args=(smsText,))
-                notifyFounders.start()
-        except Exception as err:
-            print('ERROR: Could not send sms to founders for request: ' + str(requestId) + ' with error: ' + str(err))
+        if (action == constants.ACCESS_REQUEST_ACCEPTED):
+            utils.queueFounderAlert("New request created: " + str(requestId))
 
     return "", constants.STATUS_OK
 
@@ -193,62 +201,96 @@ def createNotificationForDeclinedAccessRequest(recipient):
 
 @apiBlueprint.route("/accessRequests/received", methods=["GET"])
 @auth.login_required
+@replicas.readOnly
 def getAccessRequestsReceived():
     if not g.user:
-        print('ERROR: There is no user associated for getting access requests received.')
+        log.error('There is no user associated for getting access requests received.')
         return "", constants.STATUS_BAD_REQUEST
 
-    db.create_all()
-    accessRequests = AccessRequest.query.filter_by(toUserId=g.user.id).order_by(desc(AccessRequest.createdOn)).all()
-    if not accessRequests:
-        return jsonify({"count": 0}), constants.STATUS_OK
-    
-    count = len(accessRequests)
-    toReturn = {"count": count, "requests": []}
-    for accessRequest in accessRequests:
-        senderName = accessRequest.sender.name
-        cardName = getCardNameFromId(accessRequest.cardId)
-        toReturn['requests'].append({"requestId": accessRequest.id, "cardId": accessRequest.cardId, "cardName": cardName, \
-            "id": accessRequest.fromUserId, "name": senderName, "createdOn": utils.getDateTimeAsString(accessRequest.createdOn), \
-            "resolvedOn": utils.getDateTimeAsString(accessRequest.resolvedOn), "status": getAccessRequestStatus(accessRequest.createdOn, accessRequest.status), \
-            "shortDesc": accessRequest.shortDesc, "profileImgUrl": accessRequest.sender.profileImgUrl, "amount": accessRequest.amount})
-    db.session.close()
-    return jsonify(toReturn), constants.STATUS_OK
+    return getAccessRequestsPage(received=True)
 
 
 @apiBlueprint.route("/accessRequests/sent", methods=["GET"])
 @auth.login_required
+@replicas.readOnly
 def getAccessRequestsSent():
     if not g.user:
-        print('ERROR: There is no user associated for getting access requests sent.')
+        log.error('There is no user associated for getting access requests sent.')
         return "", constants.STATUS_BAD_REQUEST
 
-    db.create_all()
-    accessRequests = AccessRequest.query.filter_by(fromUserId=g.user.id).order_by(desc(AccessRequest.createdOn)).all()
+    return getAccessRequestsPage(received=False)
+
+
+def getAccessRequestsPage(received):
+    """
+    Builds the received or sent inbox of g.user from a single query joining the other user.
+    Supports the optional status arg, and pages with the optional cursor and limit args.
+    """
+    # Older clients ask for every request at once, only a limit or a cursor pages the list
+    limit = None
+    if "limit" in request.args or "cursor" in request.args:
+        limit = utils.getPageLimit(request.args, constants.REQUESTS_PAGE_SIZE)
+    cursor = None
+    if "cursor" in request.args:
+        cursor = utils.decodeCursor(request.args["cursor"])
+        if not cursor:
+            log.error('Invalid cursor for access requests: %s', request.args["cursor"])
+            return "", constants.STATUS_BAD_REQUEST
+
+    userColumn, otherUserColumn = (AccessRequest.toUserId, AccessRequest.fromUserId) if received \
+                                    else (AccessRequest.fromUserId, AccessRequest.toUserId)
+    requestsQuery = db.session.query(AccessRequest.id, AccessRequest.cardId, otherUserColumn, AccessRequest.createdOn, \
+                        AccessRequest.resolvedOn, AccessRequest.status, AccessRequest.shortDesc, AccessRequest.amount, \
+                        User.name, User.profileImgUrl) \
+                        .join(User, User.id == otherUserColumn) \
+                        .filter(userColumn == g.user.id)
+    if "status" in request.args:
+        requestsQuery = filterByStatus(requestsQuery, request.args.get("status", type=int))
+    requestsQuery = utils.applyCursor(requestsQuery, AccessRequest.createdOn, AccessRequest.id, cursor) \
+                        .order_by(desc(AccessRequest.createdOn), desc(AccessRequest.id))
+    if limit is None:
+        # The whole inbox is streamed from the query, card names are looked up a row at a time
+        accessRequests = jsonCodec.openQuery(requestsQuery)
+        if accessRequests is not None:
+            return jsonCodec.streamResponse("requests", accessRequests, renderStreamedAccessRequest), constants.STATUS_OK
+        accessRequests = []
+    else:
+        accessRequests = requestsQuery.limit(limit).all()
+    db.session.close()
+
     if not accessRequests:
         return jsonify({"count": 0}), constants.STATUS_OK
-    
-    count = len(accessRequests)
-    toReturn = {"count": count, "requests": []}
-    for accessRequest in accessRequests:
-        recipientName = accessRequest.recipient.name
-        cardName = getCardNameFromId(accessRequest.cardId)
-        toReturn['requests'].append({"requestId": accessRequest.id, "cardId": accessRequest.cardId, "cardName": cardName, \
-            "id": accessRequest.toUserId, "name": recipientName, "profileImgUrl": accessRequest.recipient.profileImgUrl, \
-            "createdOn": utils.getDateTimeAsString(accessRequest.createdOn), "resolvedOn": utils.getDateTimeAsString(accessRequest.resolvedOn), \
-            "shortDesc": accessRequest.shortDesc, "status": getAccessRequestStatus(accessRequest.createdOn, accessRequest.status), "amount": accessRequest.amount})
-    db.session.close()
-    return jsonify(toReturn), constants.STATUS_OK
 
+    cardNames = cardCatalog.namesFor(set(accessRequest.cardId for accessRequest in accessRequests))
+    toReturn = {"count": len(accessRequests)}
+    if len(accessRequests) == limit:
+        toReturn["next"] = utils.encodeCursor(accessRequests[-1].createdOn, accessRequests[-1].id)
+
+    render = functools.partial(renderAccessRequest, cardNames)
+    return jsonCodec.listResponse(toReturn, "requests", accessRequests, render), constants.STATUS_OK
+
+
+def renderStreamedAccessRequest(accessRequest):
+    return renderAccessRequest(cardCatalog.namesFor([accessRequest.cardId]), accessRequest)
+
+
+def renderAccessRequest(cardNames, accessRequest):
+    requestId, cardId, otherUserId, createdOn, resolvedOn, status, shortDesc, amount, name, profileImgUrl = accessRequest
+    return {"requestId": requestId, "cardId": cardId, "cardName": cardNames[cardId], \
+        "id": otherUserId, "name": name, "profileImgUrl": profileImgUrl, \
+        "createdOn": utils.getDateTimeAsString(createdOn), "resolvedOn": utils.getDateTimeAsString(resolvedOn), \
+        "shortDesc": shortDesc, "status": getAccessRequestStatus(createdOn, status), "amount": amount}
+
+
+def filterByStatus(query, status):
+    # The sweeper in Circles/expiry.py only materializes the expiry of unaccepted requests; answered requests keep
+    # their status and are reported as expired by age, like getAccessRequestStatus() does
+    cutoff = expiry.getExpiryCutoff()
+    if status == constants.ACCESS_REQUEST_EXPIRED:
+        return query.filter(or_(AccessRequest.status == status, AccessRequest.createdOn < cutoff))
+    return query.filter(AccessRequest.status == status).filter(AccessRequest.createdOn >= cutoff)
 
-def getCardNameFromId(cardId):
-    card = Card.query.options(load_only('name')).get(cardId)
-    if not card:
-        print('ERROR: No card with cardId: ' + cardId)
-        return None
-    return card.name
 
-# make sure to call db.create_all() before this.
 def commitToDB():
     committed = False
     try:
@@ -256,15 +298,18 @@ def commitToDB():
         committed = True
     except Exception as err:
         db.session.rollback()
-        print('ERROR: Exception while committing to database: ' + str(err))
+        log.error('Exception while committing to database: %s', err)
     finally:
         db.session.close()
 
     return committed
 
 
+# Covers rows that expired since the last sweep
 def getAccessRequestStatus(createdOn, currentStatus):
     timeNow = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+    if createdOn.tzinfo is None:
+        createdOn = pytz.timezone(constants.TIMEZONE_KOLKATA).localize(createdOn) # databases without timezone support
     difference = timeNow - createdOn
     if difference.total_seconds() > constants.SECONDS_IN_DAY:
         return constants.ACCESS_REQUEST_EXPIRED
@@ -8,8 +8,7 @@ from sqlalchemy.orm import load_only
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy import exc,literal
 import datetime, json, pytz, random, requests, string, os
-from Circles import constants, utils
-from threading import Thread
+from Circles import authCache, cardOwnership, constants, logs, utils
 from twilio.rest import Client
 from virgil_crypto import VirgilCrypto
 from virgil_crypto.access_token_signer import AccessTokenSigner
@@ -17,17 +16,19 @@ from virgil_sdk.jwt import JwtGenerator
 from virgil_sdk.utils import Utils
 from . import apiBlueprint, auth
 
+log = logs.getLogger(__name__)
+
 
 @apiBlueprint.route("/auth/signup", methods=["POST"])
 def signup():
     if ("name" not in request.json or
        "phoneNumber" not in request.json or "cards" not in request.json or
        "fcmToken" not in request.json):
-        print('ERROR: One of the required fields is missing')
+        log.error('One of the required fields is missing')
         return "", constants.STATUS_BAD_REQUEST
 
     if ("password" not in request.json and "phoneAuth" not in request.json):
-        print('ERROR: No password or phone verification found.')
+        log.error('No password or phone verification found.')
         return "", constants.STATUS_BAD_REQUEST
 
     name = request.json["name"]
@@ -45,8 +46,7 @@ def signup():
         cards.append(selectedCard["id"])
 
     strPhone = str(phoneNumber)
-    print('Adding user: ' + strPhone[-4:])
-    db.create_all()
+    log.info('Adding user: %s', strPhone[-4:])
 
     # Check if IDCode is unique
     idCode = utils.generateIdCode()
@@ -56,7 +56,7 @@ def signup():
     # Check if phone number is unique
     oldUser = User.query.filter_by(phoneNumber=phoneNumber).first()
     if oldUser:
-        print('ERROR: User with phone number already exists')
+        log.error('User with phone number already exists')
         db.session.close()
         return "", constants.STATUS_CONFLICT_ERROR
     
@@ -69,24 +69,18 @@ def signup():
 
     try:
         db.session.flush()
-        for selectedCard in selectedCards:
-            theCard = Card.query.get(selectedCard["id"])
-            if theCard is not None:
-                if theCard.users is None: 
-                    theCard.users = []
-                theCard.users.append(newUser.id)
-                flag_modified(theCard, 'users')
+        cardOwnership.setUserCards(newUser, cards)
         db.session.commit()
         newUserId = newUser.id
         newUserPhone = newUser.phoneNumber
         access_token = newUser.generate_auth_token(expiration=constants.TOKEN_EXPIRATION, key=os.environ['SECRET_KEY']).decode('ascii')
     except exc.IntegrityError as ex:
         db.session.rollback()
-        print('ERROR: For User: ' + str(newUser.phoneNumber) + '. Exception while committing to database: ' + str(ex))
+        log.error('For User: %s. Exception while committing to database: %s', newUser.phoneNumber, ex)
         return "", constants.STATUS_CONFLICT_ERROR        
     except Exception as err:
         db.session.rollback()
-        print('ERROR: For User: ' + str(newUser.phoneNumber) + '. Exception while committing to database: ' + str(err))
+        log.error('For User: %s. Exception while committing to database: %s', newUser.phoneNumber, err)
         return "", constants.STATUS_SERVER_ERROR
     finally:
         db.session.close()
@@ -97,18 +91,17 @@ def signup():
 @apiBlueprint.route("/auth/phoneAuthLogin", methods=["POST"])
 def loginAfterPhoneAuth():
     if ("phoneNumber" not in request.json or "fcmToken" not in request.json):
-        print("ERROR: Required parameters missing in phoneAuthLogin")
+        log.error('Required parameters missing in phoneAuthLogin')
         return "", constants.STATUS_BAD_REQUEST
     phoneNumber = request.json['phoneNumber']
     fcmToken = ""
     if request.json['fcmToken']:
         fcmToken = request.json['fcmToken']
 
-    db.create_all()
     currentUser = User.query.filter_by(phoneNumber=phoneNumber).first()
 
     if not currentUser: 
-        print("ERROR: Failed to fetch user with phone: " + str(phoneNumber))
+        log.error('Failed to fetch user with phone: %s', phoneNumber)
         return "", constants.STATUS_UNAUTHORIZED
 
     currentUser.fcmToken = fcmToken
@@ -118,25 +111,25 @@ def loginAfterPhoneAuth():
         db.session.commit()
     except Exception as err:
         db.session.rollback()
-        print('ERROR: Exception while committing to database for phone: ' + str(phoneNumber) + ' error:' + str(err))
+        log.error('Exception while committing to database for phone: %s error:%s', phoneNumber, err)
         db.session.close()
         return "", constants.STATUS_SERVER_ERROR
     
     userId = currentUser.id
     userPhoneNumber = currentUser.phoneNumber
     db.session.close()
+    authCache.invalidateUser(userId)
     return jsonify({'access_token': access_token, "id": userId, "phoneNumber": userPhoneNumber}), constants.STATUS_OK
 
 
 @apiBlueprint.route("/auth/userExists", methods=["GET"])
 def checkIfUserExists():
     if "idCode" not in request.args:
-        print('ERROR: No idCode provided to check invite code for')
+        log.error('No idCode provided to check invite code for')
         return "", constants.STATUS_BAD_REQUEST
     
     idCode = request.args["idCode"]
     idCode = idCode.upper()
-    db.create_all()
     exists = 0
     invitee = User.query.filter_by(idCode=idCode).first()
     if invitee:
@@ -149,23 +142,22 @@ def checkIfUserExists():
 @apiBlueprint.route("/auth/sendAuthCode", methods=["POST"])
 def sendAuthCode():
     if "phoneNumber" not in request.json:
-        print('ERROR: No phone number found to send code to.')
+        log.error('No phone number found to send code to.')
         return "", constants.STATUS_BAD_REQUEST
 
     mustExist = None if "mustExist" not in request.json else request.json["mustExist"]
     codeLength = constants.AUTH_CODE_LENGTH if "length" not in request.json else request.json["length"]
-    db.create_all()
     phoneNumber = request.json["phoneNumber"]
     hashkey = os.environ["APP_KEY"]
 
     if mustExist is not None:
         currentUser = User.query.filter_by(phoneNumber=phoneNumber).first()
         if mustExist and not currentUser:
-            print('ERROR: Not sending as there is no user to verify with: ' + str(phoneNumber))
+            log.error('Not sending as there is no user to verify with: %s', phoneNumber)
             db.session.close()
             return "", constants.STATUS_PRECONDITION_FAILED
         elif currentUser and not mustExist:
-            print('ERROR: Not sending code as user already exists: ' + str(phoneNumber))
+            log.error('Not sending code as user already exists: %s', phoneNumber)
             db.session.close()
             return "", constants.STATUS_PRECONDITION_FAILED
 
@@ -175,7 +167,7 @@ def sendAuthCode():
     # Is there any existing verification left
     oldVerification = AuthCodeVerification.query.filter_by(phoneNumber=phoneNumber).first()
     if oldVerification: 
-        print('Found an old verification')
+        log.debug('Found an old verification')
         oldVerification.code = code
         oldVerification.expiration = expiration
     else:
@@ -183,12 +175,12 @@ def sendAuthCode():
         db.session.add(verification)
 
     if (not commitToDB()):
-        print('ERROR: Problem creating verification for number: ' + str(phoneNumber))
+        log.error('Problem creating verification for number: %s', phoneNumber)
         return "", constants.STATUS_SERVER_ERROR
 
     smsBody = code + " is your code to log in to Circles. This code will expire in 10 minutes. \n\n" + hashkey
-    if not utils.sendSMS(smsBody, phoneNumber):
-        print('ERROR: Could not send SMS to phone: ' + str(phoneNumber))
+    if not utils.sendSMS(smsBody, phoneNumber, kind="authCode"):
+        log.error('Could not send SMS to phone: %s', phoneNumber)
         return "", constants.STATUS_BAD_REQUEST
 
     return "", constants.STATUS_OK
@@ -197,21 +189,20 @@ def sendAuthCode():
 @apiBlueprint.route("/auth/verifyAuthCode", methods=["POST"])
 def verifyAuthCode():
     if "phoneNumber" not in request.json:
-        print('ERROR: No phone number found to verify code for.')
+        log.error('No phone number found to verify code for.')
         return "", constants.STATUS_BAD_REQUEST
 
     if "code" not in request.json:
-        print('ERROR: No code received for verification')
+        log.error('No code received for verification')
         return "", constants.STATUS_BAD_REQUEST
 
     phoneNumber = request.json["phoneNumber"]
     code = request.json["code"]
-    db.create_all()
 
     # ensure verification is pending
     pendingVerification = AuthCodeVerification.query.filter_by(phoneNumber=phoneNumber).first()
     if not pendingVerification:
-        print('ERROR: No verification pending for this phone number: ' + str(phoneNumber))
+        log.error('No verification pending for this phone number: %s', phoneNumber)
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
@@ -223,15 +214,17 @@ def verifyAuthCode():
     # Check expiry and delete the verification record
     now = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
     status = constants.CODE_VERIFICATION_SUCCEEDED
-    if now > pendingVerification.expiration:
-        print('ERROR: Code has expired for phone: ' + str(phoneNumber))
+    expiration = pendingVerification.expiration
+    if expiration.tzinfo is None:
+        expiration = pytz.timezone(constants.TIMEZONE_KOLKATA).localize(expiration) # databases without timezone support
+    if now > expiration:
+        log.error('Code has expired for phone: %s', phoneNumber)
         status = constants.CODE_VERIFICATION_EXPIRED
     db.session.delete(pendingVerification)
     commitToDB() # ignore failures here, not important to fail the request
     return jsonify({"status": status}), constants.STATUS_OK
 
 
-# make sure to call db.create_all() before this.
 def commitToDB():
     committed = False
     try:
@@ -239,7 +232,7 @@ def commitToDB():
         committed = True
     except Exception as err:
         db.session.rollback()
-        print('ERROR: Exception while committing to database: ' + str(err))
+        log.error('Exception while committing to database: %s', err)
     finally:
         db.session.close()
 
@@ -1,30 +1,38 @@
-from Circles import constants
-from Circles.models import db, Card
+from Circles import cardCatalog, constants, etags, logs
+from Circles.models import db
 from flask import jsonify, request
 from . import apiBlueprint
 
+log = logs.getLogger(__name__)
+
 @apiBlueprint.route("/card/all", methods=['GET'])
 def getAllCards():
-    db.create_all()
-    allCards = Card.query.all()
+    tag = etags.catalogTag()
+    if etags.isNotModified(tag):
+        db.session.close()
+        return etags.notModified(tag)
+
     listCards = {'cards': []}
-    for card in allCards:
+    for card in cardCatalog.allCards():
         listCards['cards'].append({"name": card.name, "id": card.id})
     db.session.close()
-    return jsonify(listCards), constants.STATUS_OK
+    return etags.tagResponse(jsonify(listCards), tag), constants.STATUS_OK
 
 
 @apiBlueprint.route("/card/filter", methods=['GET'])
 def getCards():
     if "type" not in request.args:
-        print("ERROR: Type is a required paramter for this operation.")
+        log.error('Type is a required paramter for this operation.')
         return "", constants.STATUS_BAD_REQUEST
 
     objectType = request.args["type"]
-    db.create_all()
-    allCards = Card.query.filter(Card.objectType == objectType)
+    tag = etags.catalogTag(objectType)
+    if etags.isNotModified(tag):
+        db.session.close()
+        return etags.notModified(tag)
+
     listCards = {'cards': []}
-    for card in allCards:
+    for card in cardCatalog.cardsOfType(objectType):
         listCards['cards'].append({"name": card.name, "id": card.id})
     db.session.close()
-    return jsonify(listCards), constants.STATUS_OK
+    return etags.tagResponse(jsonify(listCards), tag), constants.STATUS_OK
@@ -2,14 +2,13 @@ from flask import Blueprint, Flask, jsonify, g, request, abort
 from flask import current_app as app
 from flask_httpauth import HTTPBasicAuth
 from werkzeug.security import generate_password_hash, check_password_hash
-from Circles.models import AuthCodeVerification, Card, db, FriendRequest, User, Friend, AccessRequest, Post
+from Circles.models import AuthCodeVerification, Card, db, FriendRequest, FriendRemoval, User, Friend, AccessRequest, Post
 from firebase_admin import messaging
 from sqlalchemy.orm import load_only
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import exc,literal, desc
-import datetime, json, pytz, random, requests, string, os
-from Circles import constants, utils
-from threading import Thread
+from sqlalchemy import exc,literal, desc, and_, or_
+import datetime, functools, json, pytz, random, requests, string, os
+from Circles import cardOwnership, constants, friendGraph, jsonCodec, logs, outbox, replicas, utils
 from twilio.rest import Client
 from virgil_crypto import VirgilCrypto
 from virgil_crypto.access_token_signer import AccessTokenSigner
@@ -17,56 +16,68 @@ from virgil_sdk.jwt import JwtGenerator
 from virgil_sdk.utils import Utils
 from . import apiBlueprint, auth
 
+log = logs.getLogger(__name__)
+
 
 @apiBlueprint.route("/friendRequests/new", methods=["POST"])
 @auth.login_required
 def createNewFriendRequest():
     if "to" not in request.json:
-        print("ERROR: There are no recipients for this request")
+        log.error('There are no recipients for this request')
         return "", constants.STATUS_BAD_REQUEST
 
     if not g.user:
-        print('ERROR: There is no user associated for friend request.')
+        log.error('There is no user associated for friend request.')
         return "", constants.STATUS_BAD_REQUEST
 
     if request.json["to"] == g.user.id:
-        print('ERROR: Cannot send friendrequest to the same user id: ' + str(request.json["to"]))
+        log.error('Cannot send friendrequest to the same user id: %s', request.json["to"])
         return "", constants.STATUS_BAD_REQUEST
 
     to = request.json["to"]
     createdOn = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
-    db.create_all()
+    pairKey = FriendRequest.getPairKey(g.user.id, to)
 
-    # Check if friend request already exists
-    if FriendRequest.query.filter_by(fromUserId=g.user.id).filter_by(toUserId=to).first() or \
-        FriendRequest.query.filter_by(fromUserId=to).filter_by(toUserId=g.user.id).first():
-        print("ERROR: Friend request between: " + str(g.user.id) + " and: " + str(to) + " already exists")
+    # Check if friend request already exists in either direction with one probe of the unique pair key
+    if db.session.query(FriendRequest.id).filter(FriendRequest.pairKey == pairKey).first():
+        log.error('Friend request between: %s and: %s already exists', g.user.id, to)
         db.session.close()
         return "", constants.STATUS_CONFLICT_ERROR
 
     # Create new request
-    friendRequest = FriendRequest(createdOn=createdOn, status=constants.FRIEND_REQUEST_ACTIVE)
-    recipient = User.query.get(to)
+    recipient = User.query.options(load_only('fcmToken')).get(to)
     
     if not recipient:
-        print("ERROR: No friend request recipient found with id: " + str(to))
+        log.error('No friend request recipient found with id: %s', to)
+        db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
-    g.user.fRequests_sent.append(friendRequest)
-    recipient.fRequests_rec.append(friendRequest)
-    db.session.add(friendRequest)
-    db.session.commit()
-    
-    notification = createNotificationForNewFriendRequest(g.user.name)
-    data = {
-        "requestId": str(friendRequest.id),
-        "type": constants.FRIEND_REQUEST_NOTIFICATION_TYPE
-    }
-    fcmToken = recipient.fcmToken
+    friendRequest = FriendRequest(fromUserId=g.user.id, toUserId=recipient.id, pairKey=pairKey, createdOn=createdOn, \
+                                  status=constants.FRIEND_REQUEST_ACTIVE)
+    try:
+        db.session.add(friendRequest)
+        db.session.flush()
 
-    db.session.close()
-    t = Thread(target=utils.sendDeviceNotification, args=(fcmToken, notification, data))
-    t.start()
+        notification = createNotificationForNewFriendRequest(g.user.name)
+        data = {
+            "requestId": str(friendRequest.id),
+            "type": constants.FRIEND_REQUEST_NOTIFICATION_TYPE
+        }
+        outbox.enqueueNotification(recipient.fcmToken, notification, data)
+        db.session.commit()
+    except exc.IntegrityError as err:
+        # A concurrent request for the same pair won the race for the unique pair key
+        db.session.rollback()
+        log.error('Friend request between: %s and: %s already exists: %s', g.user.id, to, err)
+        return "", constants.STATUS_CONFLICT_ERROR
+    except Exception as err:
+        db.session.rollback()
+        log.error('Problem creating the friend request: %s', err)
+        return "", constants.STATUS_SERVER_ERROR
+    finally:
+        db.session.close()
+
+    outbox.wake()
     return "", constants.STATUS_OK
 
 
@@ -79,24 +90,28 @@ def createNotificationForNewFriendRequest(sender):
 @auth.login_required
 def cancelFriendRequest():
     if "requestId" not in request.json:
-        print("ERROR: ID of the friend request to cancel is missing")
+        log.error('ID of the friend request to cancel is missing')
         return "", constants.STATUS_BAD_REQUEST
 
     if not g.user:
-        print('ERROR: There is no user associated for friend request cancellation.')
+        log.error('There is no user associated for friend request cancellation.')
         return "", constants.STATUS_BAD_REQUEST
 
     requestId = request.json["requestId"]
-    db.create_all()
     friendRequest = FriendRequest.query.get(requestId)
     if not friendRequest:
-        print("ERROR: No friend request found with id: " + str(requestId))
+        log.error('No friend request found with id: %s', requestId)
+        db.session.close()
+        return "", constants.STATUS_BAD_REQUEST
+
+    if g.user.id not in (friendRequest.fromUserId, friendRequest.toUserId):
+        log.error('Cannot cancel a friend request the user is not involved in. User: %s Req: %s', g.user.id, requestId)
+        db.session.close()
         return "", constants.STATUS_BAD_REQUEST
-    g.user.fRequests_rec.remove(friendRequest)
-    friendRequest.sender.fRequests_sent.remove(friendRequest)
+
     db.session.delete(friendRequest)
     if (not commitToDB()):
-        print('ERROR: Problem cancelling the friend request')
+        log.error('Problem cancelling the friend request')
         return "", constants.STATUS_SERVER_ERROR
     
     return "", constants.STATUS_OK
@@ -104,94 +119,121 @@ def cancelFriendRequest():
 
 @apiBlueprint.route('/friendRequests/sent', methods=["GET"])
 @auth.login_required
+@replicas.readOnly
 def getFriendRequestsSent():
     if not g.user:
-        print('ERROR: There is no user associated for getting friend requests sent.')
+        log.error('There is no user associated for getting friend requests sent.')
         return "", constants.STATUS_BAD_REQUEST
 
-    db.create_all()
-    friendRequests = g.user.fRequests_sent
-    if not friendRequests:
-        return jsonify({"count": 0}), constants.STATUS_OK
-    
-    count = len(friendRequests)
-    toReturn = {"count": count, "requests": []}
-    for friendRequest in friendRequests:
-        recipientName = friendRequest.recipient.name
-        toReturn['requests'].append({"requestId": friendRequest.id,  \
-            "id": friendRequest.toUserId, "name": recipientName, "createdOn": utils.getDateTimeAsString(friendRequest.createdOn), \
-            "profileImgUrl": friendRequest.recipient.profileImgUrl, "resolvedOn": utils.getDateTimeAsString(friendRequest.resolvedOn), "status": friendRequest.status})
-    db.session.close()
-    return jsonify(toReturn), constants.STATUS_OK
+    return getFriendRequestsPage(received=False)
 
 
 @apiBlueprint.route('/friendRequests/received', methods=["GET"])
 @auth.login_required
+@replicas.readOnly
 def getFriendRequestsReceived():
     if not g.user:
-        print('ERROR: There is no user associated for getting friend request received.')
+        log.error('There is no user associated for getting friend request received.')
         return "", constants.STATUS_BAD_REQUEST
 
-    status = request.args["status"] if "status" in request.args else None
-    db.create_all()
-    friendRequests = None
-    if status:
-        friendRequests = FriendRequest.query.filter_by(toUserId=g.user.id).filter_by(status=status).order_by(desc(FriendRequest.createdOn)).all()
-    else: 
-        friendRequests = FriendRequest.query.filter_by(toUserId=g.user.id).order_by(desc(FriendRequest.createdOn)).all()
+    return getFriendRequestsPage(received=True)
+
+
+def getFriendRequestsPage(received):
+    """
+    Builds the received or sent friend requests of g.user from a single query joining the other user.
+    Supports the optional status arg, and pages with the optional cursor and limit args.
+    """
+    # Older clients ask for every request at once, only a limit or a cursor pages the list
+    limit = None
+    if "limit" in request.args or "cursor" in request.args:
+        limit = utils.getPageLimit(request.args, constants.REQUESTS_PAGE_SIZE)
+    cursor = None
+    if "cursor" in request.args:
+        cursor = utils.decodeCursor(request.args["cursor"])
+        if not cursor:
+            log.error('Invalid cursor for friend requests: %s', request.args["cursor"])
+            return "", constants.STATUS_BAD_REQUEST
+
+    userColumn, otherUserColumn = (FriendRequest.toUserId, FriendRequest.fromUserId) if received \
+                                    else (FriendRequest.fromUserId, FriendRequest.toUserId)
+    requestsQuery = db.session.query(FriendRequest.id, otherUserColumn, FriendRequest.createdOn, FriendRequest.resolvedOn, \
+                        FriendRequest.status, User.name, User.phoneNumber, User.profileImgUrl) \
+                        .join(User, User.id == otherUserColumn) \
+                        .filter(userColumn == g.user.id)
+    if request.args.get("status"):
+        requestsQuery = requestsQuery.filter(FriendRequest.status == request.args["status"])
+    requestsQuery = utils.applyCursor(requestsQuery, FriendRequest.createdOn, FriendRequest.id, cursor) \
+                        .order_by(desc(FriendRequest.createdOn), desc(FriendRequest.id))
+    render = functools.partial(renderFriendRequest, received)
+    if limit is None:
+        # Every request is streamed from the query
+        friendRequests = jsonCodec.openQuery(requestsQuery)
+        if friendRequests is not None:
+            return jsonCodec.streamResponse("requests", friendRequests, render), constants.STATUS_OK
+        friendRequests = []
+    else:
+        friendRequests = requestsQuery.limit(limit).all()
+    db.session.close()
+
     if not friendRequests:
         return jsonify({"count": 0}), constants.STATUS_OK
-    
-    count = len(friendRequests)
-    toReturn = {"count": count, "requests": []}
-    for friendRequest in friendRequests:
-        senderName = friendRequest.sender.name
-        toReturn['requests'].append({"requestId": friendRequest.id, "name": senderName, "phoneNumber": friendRequest.sender.phoneNumber, \
-            "id": friendRequest.fromUserId, "createdOn": utils.getDateTimeAsString(friendRequest.createdOn), "profileImgUrl": friendRequest.sender.profileImgUrl, \
-            "resolvedOn": utils.getDateTimeAsString(friendRequest.resolvedOn), "status": friendRequest.status})
-    db.session.close()
-    return jsonify(toReturn), constants.STATUS_OK
+
+    toReturn = {"count": len(friendRequests)}
+    if len(friendRequests) == limit:
+        toReturn["next"] = utils.encodeCursor(friendRequests[-1].createdOn, friendRequests[-1].id)
+
+    return jsonCodec.listResponse(toReturn, "requests", friendRequests, render), constants.STATUS_OK
+
+
+def renderFriendRequest(received, friendRequest):
+    requestId, otherUserId, createdOn, resolvedOn, status, name, phoneNumber, profileImgUrl = friendRequest
+    requestDetails = {"requestId": requestId, "id": otherUserId, "name": name, "createdOn": utils.getDateTimeAsString(createdOn), \
+        "profileImgUrl": profileImgUrl, "resolvedOn": utils.getDateTimeAsString(resolvedOn), "status": status}
+    # Only the recipient of a request sees the sender's phone number
+    if received:
+        requestDetails["phoneNumber"] = phoneNumber
+    return requestDetails
 
 
 @apiBlueprint.route("/friendRequests/respond", methods=["POST"])
 @auth.login_required
 def respondToFriendRequest():
     if "action" not in request.json:
-        print("ERROR: There are no actions specified in the friend request response")
+        log.error('There are no actions specified in the friend request response')
         return "", constants.STATUS_BAD_REQUEST
 
     if "requestId" not in request.json:
-        print("ERROR: ID of the friend request is missing")
+        log.error('ID of the friend request is missing')
         return "", constants.STATUS_BAD_REQUEST
 
     if not g.user:
-        print('ERROR: There is no user associated for friend request response.')
+        log.error('There is no user associated for friend request response.')
         return "", constants.STATUS_BAD_REQUEST
 
     action = request.json["action"]
     requestId = request.json["requestId"]
-    db.create_all()
 
     if "limit" in request.json:
         limit = request.json["limit"]
-        if g.user.friends and len(g.user.friends) >= limit:
-            print('ERROR: User: ' + str(g.user.id) + ' has reached the limit of friend requests')
+        if friendGraph.countFriends(g.user.id) >= limit:
+            log.error('User: %s has reached the limit of friend requests', g.user.id)
             db.session.close()
             return "", constants.STATUS_PRECONDITION_FAILED
 
     friendRequest = FriendRequest.query.get(requestId)
     if not friendRequest:
-        print("ERROR: No friend request found with id: " + str(requestId))
+        log.error('No friend request found with id: %s', requestId)
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
     if g.user.id != friendRequest.toUserId:
-        print("ERROR: Cannot respond to request that is not sent to the user id: " + str(g.user.id))
+        log.error('Cannot respond to request that is not sent to the user id: %s', g.user.id)
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
     if friendRequest.status == action:
-        print("WARNING: Friend request status already at the desired state:" + str(action))
+        log.warning('Friend request status already at the desired state:%s', action)
         db.session.close()
     else:
         data = {
@@ -200,6 +242,7 @@ def respondToFriendRequest():
             "isUserSender": "true" # the notification is sent to the user who sent the request
         }
         fcmToken = friendRequest.sender.fcmToken
+        senderId = friendRequest.fromUserId
 
         notification = createNotificationForDeclinedFriendRequest(g.user.name)
         friendRequest.status = action
@@ -215,12 +258,14 @@ def respondToFriendRequest():
             db.session.add(friendSecondRow)
             notification = createNotificationForAcceptedFriendRequest(g.user.name)
             
+        outbox.enqueueNotification(fcmToken, notification, data)
         if (not commitToDB()):
-            print('ERROR: Problem resolving the friend request')
+            log.error('Problem resolving the friend request')
             return "", constants.STATUS_SERVER_ERROR
 
-    t = Thread(target=utils.sendDeviceNotification, args=(fcmToken, notification, data))
-    t.start()
+        if (action == constants.FRIEND_REQUEST_ACCEPTED):
+            friendGraph.recordAdded([(g.user.id, senderId), (senderId, g.user.id)])
+        outbox.wake()
 
     return "", constants.STATUS_OK
 
@@ -239,50 +284,57 @@ def createNotificationForDeclinedFriendRequest(recipient):
 @auth.login_required
 def removeFriend():
     if "friendId" not in request.json:
-        print('ERROR: No friendID field provided to remove.')
+        log.error('No friendID field provided to remove.')
         return "", constants.STATUS_BAD_REQUEST
 
-    if not g.user.friends or len(g.user.friends): 
-        print("ERROR: Cannot remove friend as user has no friends in db.")
+    try:
+        friendId = int(request.json["friendId"])
+    except (TypeError, ValueError):
+        log.error('Invalid friendID to remove: %s', request.json["friendId"])
         return "", constants.STATUS_BAD_REQUEST
 
-    friendId = request.json["friendId"]
-    db.create_all()
-
-    for friendRow in g.user.friends:
-        if friendId == friendRow.friendId:
-            g.user.friends.remove(friendRow)
-            fRequest = FriendRequest.query.get(friendRow.fRequestId)
-            db.session.delete(friendRow)
-            db.session.delete(fRequest) #TODO: Try to see if it is removed from user's requests
-            if (not commitToDB()):
-                print("ERROR: Something went wrong in deleting the friend ID:" + str(friendId))
-                return "", constants.STATUS_SERVER_ERROR
-            
-            return "", constants.STATUS_OK
-        
-    db.session.close()
-    print("ERROR: User has no friend with friendID: " + str(friendId))
-    return "", constants.STATUS_SERVER_ERROR
+    # Both directions of the friendship go, with the friend request that made it
+    friendRows = Friend.query.filter(or_(and_(Friend.userId == g.user.id, Friend.friendId == friendId), \
+                                         and_(Friend.userId == friendId, Friend.friendId == g.user.id))).all()
+    if not any(friendRow.userId == g.user.id for friendRow in friendRows):
+        log.error('User has no friend with friendID: %s', friendId)
+        db.session.close()
+        return "", constants.STATUS_BAD_REQUEST
+
+    requestIds = set(friendRow.fRequestId for friendRow in friendRows if friendRow.fRequestId is not None)
+    Friend.query.filter(Friend.id.in_([friendRow.id for friendRow in friendRows])).delete(synchronize_session=False)
+    if requestIds:
+        FriendRequest.query.filter(FriendRequest.id.in_(requestIds)).delete(synchronize_session=False)
+
+    # Tombstones for the friend graph of the other hosts, see friendGraph.syncNewFriendships()
+    removed = [(g.user.id, friendId), (friendId, g.user.id)]
+    timeNow = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+    for userId, otherId in removed:
+        db.session.add(FriendRemoval(userId=userId, friendId=otherId, removedOn=timeNow))
+    if (not commitToDB()):
+        log.error('Something went wrong in deleting the friend ID:%s', friendId)
+        return "", constants.STATUS_SERVER_ERROR
+
+    friendGraph.recordRemoved(removed)
+    return "", constants.STATUS_OK
 
 
 @apiBlueprint.route("/friendRequests", methods=["GET"])
 @auth.login_required
 def getFriendRequestInfo():
     if "id" not in request.args:
-        print("ERROR: No id of friend request provided")
+        log.error('No id of friend request provided')
         return "", constants.STATUS_BAD_REQUEST
 
     requestId = request.args["id"]
-    db.create_all()
     friendRequest = FriendRequest.query.get(requestId)
     if not friendRequest:
-        print("ERROR: No friend request found for getFriendRequest with id: " + str(requestId))
+        log.error('No friend request found for getFriendRequest with id: %s', requestId)
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
     if friendRequest.toUserId != g.user.id and friendRequest.fromUserId != g.user.id:
-        print("ERROR: Cannot get Friend request info when the user is not involved. User: " + str(g.user.id) + " Req: " + str(requestId))
+        log.error('Cannot get Friend request info when the user is not involved. User: %s Req: %s', g.user.id, requestId)
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
@@ -291,12 +343,12 @@ def getFriendRequestInfo():
         "senderName": friendRequest.sender.name,
         "senderImgUrl": friendRequest.sender.profileImgUrl,
         "senderPhone": friendRequest.sender.phoneNumber,
-        "numSenderCards": 0 if friendRequest.sender.cards is None else len(friendRequest.sender.cards),
+        "numSenderCards": cardOwnership.countCards(friendRequest.fromUserId),
         "recipientId": friendRequest.toUserId,
         "recipientName": friendRequest.recipient.name,
         "recipientImgUrl": friendRequest.recipient.profileImgUrl,
         "recipientPhone": friendRequest.recipient.phoneNumber,
-        "numRecipientCards": 0 if friendRequest.recipient.cards is None else len(friendRequest.recipient.cards),
+        "numRecipientCards": cardOwnership.countCards(friendRequest.toUserId),
         "createdOn": utils.getDateTimeAsString(friendRequest.createdOn),
         "resolvedOn": utils.getDateTimeAsString(friendRequest.resolvedOn),
         "status": friendRequest.status,
@@ -305,7 +357,6 @@ def getFriendRequestInfo():
     db.session.close()
     return jsonify(toReturn), constants.STATUS_OK
 
-# make sure to call db.create_all() before this.
 def commitToDB():
     committed = False
     try:
@@ -313,7 +364,7 @@ def commitToDB():
         committed = True
     except Exception as err:
         db.session.rollback()
-        print('ERROR: Exception while committing to database: ' + str(err))
+        log.error('Exception while committing to database: %s', err)
     finally:
         db.session.close()
 
@@ -6,10 +6,9 @@ from Circles.models import AuthCodeVerification, Card, db, FriendRequest, User,
 from firebase_admin import messaging
 from sqlalchemy.orm import load_only
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import exc,literal
+from sqlalchemy import exc,literal, desc
 import datetime, json, pytz, random, requests, string, os
-from Circles import constants, utils
-from threading import Thread
+from Circles import constants, etags, jsonCodec, logs, outbox, replicas, utils
 from twilio.rest import Client
 from virgil_crypto import VirgilCrypto
 from virgil_crypto.access_token_signer import AccessTokenSigner
@@ -17,112 +16,140 @@ from virgil_sdk.jwt import JwtGenerator
 from virgil_sdk.utils import Utils
 from . import apiBlueprint, auth
 
+log = logs.getLogger(__name__)
+
 
 @apiBlueprint.route("/posts/new", methods=["POST"])
 @auth.login_required
 def createNewPost():
     if "text" not in request.json: 
-        print("ERROR: No text in the post to be created")
+        log.error('No text in the post to be created')
         return "", constants.STATUS_BAD_REQUEST
 
     text = request.json["text"]
     createdOn = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
-    db.create_all()
-    post = Post(text=text,createdOn=createdOn)
-    g.user.posts.append(post)
+    post = Post(text=text,createdOn=createdOn,creatorId=g.user.id)
     db.session.add(post)
-    db.session.commit()
-
-    friendFcmTokens = []
-    if g.user.friends:
-        for friendRow in g.user.friends:
-            friend = User.query.get(friendRow.friendId)
-            if friend:
-                friendFcmTokens.append(friend.fcmToken)
-    postId = post.id
-    creatorName = g.user.name
-    db.session.close()
-    t = Thread(target=sendPostNotificationsToFriends, args=(friendFcmTokens, creatorName, postId))
-    t.start()
+    db.session.flush()
+
+    # One outbox row per friend, inserted in a single statement and committed with the post. The worker sends them
+    # as FCM multicasts
+    notification = createNotificationForNewPost(g.user.name)
+    data = {
+        "type": constants.POST_NOTIFICATION_TYPE,
+        "id": str(post.id)
+    }
+    outbox.enqueueNotifications(getFriendFcmTokens(g.user.id), notification, data)
 
+    if (not commitToDB()):
+        log.error('Problem creating the post')
+        return "", constants.STATUS_SERVER_ERROR
+
+    outbox.wake()
     return "", constants.STATUS_OK
 
 
+def getFriendFcmTokens(userId):
+    tokensQuery = db.session.query(User.fcmToken).join(Friend, Friend.friendId == User.id).filter(Friend.userId == userId)
+    return [fcmToken for (fcmToken,) in tokensQuery if fcmToken]
+
+
 def createNotificationForNewPost(name):
     return messaging.Notification(constants.POST_NOTIFICATION_TITLE.format(name), \
                                   constants.POST_NOTIFICATION_BODY.format(name), os.environ["LOGO_URL"])
 
 
-def sendPostNotificationsToFriends(fmcTokens, creatorName, postId):
-    data = {
-        "type": constants.POST_NOTIFICATION_TYPE,
-        "id": str(postId)
-    }
-    notification = createNotificationForNewPost(creatorName)
-    
-    if fmcTokens: 
-        for fcmToken in fmcTokens:
-            utils.sendDeviceNotification(fcmToken, notification, data)
-    
-    return True
-
-
 @apiBlueprint.route("/posts/all", methods=["GET"])
 @auth.login_required
+@replicas.readOnly
 def getPosts():
     postType = "sent" if "type" not in request.args else request.args["type"]
-    db.create_all()
-    toReturn = { "count": 0, "posts": [] }
-    if postType == "sent": 
-        if g.user.posts:
-            for post in g.user.posts:
-                toReturn["posts"].append({"id": post.id, "text": post.text, "creatorId": post.creatorId, \
-                   "creatorName": post.creator.name, "createdOn": utils.getDateTimeAsString(post.createdOn), "creatorImgUrl": post.creator.profileImgUrl})
-                toReturn["count"] += 1
+    # Older clients ask for every post at once, only a limit or a cursor pages the list
+    limit = None
+    if "limit" in request.args or "cursor" in request.args:
+        limit = utils.getPageLimit(request.args, constants.POSTS_PAGE_SIZE)
+    cursor = None
+    if "cursor" in request.args:
+        cursor = utils.decodeCursor(request.args["cursor"])
+        if not cursor:
+            log.error('Invalid cursor for posts: %s', request.args["cursor"])
+            return "", constants.STATUS_BAD_REQUEST
+
+    # One query for the list: posts joined with their creator, and with the friend rows for received posts
+    postsQuery = db.session.query(Post.id, Post.text, Post.creatorId, Post.createdOn, User.name, User.profileImgUrl) \
+                    .join(User, User.id == Post.creatorId)
+    if postType == "sent":
+        postsQuery = postsQuery.filter(Post.creatorId == g.user.id)
     else:
-        allPosts = []
-        if g.user.friends:
-            for friendRow in g.user.friends: 
-                friend = User.query.get(friendRow.friendId)
-                if friend and friend.posts and len(friend.posts) > 0:
-                    for post in friend.posts:
-                        allPosts.append(post)
-
-        if allPosts != []:
-            allPosts = sorted(allPosts, key=lambda post: post.createdOn, reverse=True)
-            for post in allPosts:
-                toReturn["posts"].append({"id": post.id, "text": post.text, "creatorId": post.creatorId, \
-                            "createdOn": utils.getDateTimeAsString(post.createdOn), "creatorImgUrl": post.creator.profileImgUrl, \
-                            "creatorName": post.creator.name})
-                toReturn["count"] += 1
-
+        postsQuery = postsQuery.join(Friend, Friend.friendId == Post.creatorId).filter(Friend.userId == g.user.id)
+    postsQuery = utils.applyCursor(postsQuery, Post.createdOn, Post.id, cursor) \
+                    .order_by(desc(Post.createdOn), desc(Post.id))
+    if limit is None:
+        # The whole feed is streamed from the query
+        posts = jsonCodec.openQuery(postsQuery)
+        if posts is not None:
+            return jsonCodec.streamResponse("posts", posts, renderPost), constants.STATUS_OK
+        posts = []
+    else:
+        posts = postsQuery.limit(limit).all()
     db.session.close()
-    return jsonify(toReturn), constants.STATUS_OK
+
+    toReturn = {"count": len(posts)}
+    if len(posts) == limit:
+        toReturn["next"] = utils.encodeCursor(posts[-1].createdOn, posts[-1].id)
+
+    return jsonCodec.listResponse(toReturn, "posts", posts, renderPost), constants.STATUS_OK
+
+
+def renderPost(post):
+    postId, text, creatorId, createdOn, creatorName, creatorImgUrl = post
+    return {"id": postId, "text": text, "creatorId": creatorId, "creatorName": creatorName, \
+            "createdOn": utils.getDateTimeAsString(createdOn), "creatorImgUrl": creatorImgUrl}
 
 
 @apiBlueprint.route("/posts", methods=["GET"])
 @auth.login_required
 def getPostInfo():
     if "id" not in request.args:
-        print("ERROR: No post id provided")
+        log.error('No post id provided')
         return "", constants.STATUS_BAD_REQUEST
 
-    db.create_all()
     postId = request.args["id"]
-    post = Post.query.get(request.args["id"])
-    if not post: 
-        print('ERROR: No post found with given id: ' + str(postId))
+    # The creator is loaded with the post since the ETag depends on both
+    row = db.session.query(Post, User).join(User, Post.creatorId == User.id).filter(Post.id == postId).first()
+    if not row:
+        log.error('No post found with given id: %s', postId)
+        db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
+    post, creator = row
+    tag = etags.postTag(post, creator)
+    if etags.isNotModified(tag):
+        db.session.close()
+        return etags.notModified(tag)
+
     toReturn = {
         "id": post.id,
-        "creatorName": post.creator.name,
-        "creatorImgUrl": post.creator.profileImgUrl,
+        "creatorName": creator.name,
+        "creatorImgUrl": creator.profileImgUrl,
         "creatorId": post.creatorId,
         "text": post.text,
         "createdOn": utils.getDateTimeAsString(post.createdOn),
     }
 
     db.session.close()
-    return jsonify(toReturn), constants.STATUS_OK
+    return etags.tagResponse(jsonify(toReturn), tag), constants.STATUS_OK
+
+
+def commitToDB():
+    committed = False
+    try:
+        db.session.commit()
+        committed = True
+    except Exception as err:
+        db.session.rollback()
+        log.error('Exception while committing to database: %s', err)
+    finally:
+        db.session.close()
 
+    return committed
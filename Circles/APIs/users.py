@@ -6,10 +6,10 @@ from Circles.models import AuthCodeVerification, Card, db, FriendRequest, User,
 from firebase_admin import messaging
 from sqlalchemy.orm import load_only
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy import exc,literal
-import datetime, json, pytz, random, requests, string, os
-from Circles import constants, utils
-from threading import Thread
+from sqlalchemy import exc,literal, func
+import datetime, json, pytz, random, requests, string, os, threading
+from cachetools import TTLCache
+from Circles import authCache, cardCatalog, cardOwnership, constants, etags, friendGraph, jsonCodec, logs, mutualFriends, replicas, search, utils
 from twilio.rest import Client
 from virgil_crypto import VirgilCrypto
 from virgil_crypto.access_token_signer import AccessTokenSigner
@@ -17,30 +17,50 @@ from virgil_sdk.jwt import JwtGenerator
 from virgil_sdk.utils import Utils
 from . import apiBlueprint, auth
 
+log = logs.getLogger(__name__)
+
 
 @apiBlueprint.route('/user/friends', methods=["GET"])
 @auth.login_required
+@replicas.readOnly
 def getFriends():
     if not g.user: 
-        print("ERROR: No user associated with the token to get friends for.")
+        log.error('No user associated with the token to get friends for.')
         return "", constants.STATUS_SERVER_ERROR
 
-    db.create_all()
-    toReturn = { "count": 0, "friends": [] }
-    if g.user.friends:
-        for friendRow in g.user.friends:
-            friend = User.query.get(friendRow.friendId)
-            if friend: 
-                userDetails = {"name": friend.name, "id": friend.id, "numCards": 0, "profileImgUrl": friend.profileImgUrl }
-                if friend.cards:
-                    userDetails["numCards"] = len(friend.cards)
-                toReturn["friends"].append(userDetails)
-                toReturn["count"] += 1
-            else:
-                print("WARNING: No Friend found with ID: " + str(friendRow.friendId))
-    
+    # The whole list unless a page size is asked for
+    afterId = request.args.get("after", type=int)
+    limit = utils.getPageLimit(request.args, constants.MAX_PAGE_SIZE) if "limit" in request.args else None
+
+    # Single projected query over the friend rows instead of one User load per friend
+    numCards = cardOwnership.countCardsColumn()
+    friendsQuery = db.session.query(User.id, User.name, User.profileImgUrl, numCards) \
+                    .join(Friend, Friend.friendId == User.id) \
+                    .filter(Friend.userId == g.user.id) \
+                    .order_by(User.id)
+    if afterId is not None:
+        friendsQuery = friendsQuery.filter(User.id > afterId)
+    if not limit:
+        # The whole list is streamed from the query
+        friends = jsonCodec.openQuery(friendsQuery)
+        if friends is not None:
+            return jsonCodec.streamResponse("friends", friends, renderFriend), constants.STATUS_OK
+        friends = []
+    else:
+        friends = friendsQuery.limit(limit).all()
     db.session.close()
-    return jsonify(toReturn), constants.STATUS_OK
+
+    # Cursor for the next page is the last friend id returned
+    toReturn = {"count": len(friends)}
+    if limit and len(friends) == limit:
+        toReturn["next"] = friends[-1].id
+
+    return jsonCodec.listResponse(toReturn, "friends", friends, renderFriend), constants.STATUS_OK
+
+
+def renderFriend(friend):
+    friendId, name, profileImgUrl, cardCount = friend
+    return {"name": name, "id": friendId, "numCards": cardCount, "profileImgUrl": profileImgUrl}
 
 
 @apiBlueprint.route("/user/getVirgilJWT", methods=["GET"])
@@ -48,49 +68,66 @@ def getFriends():
 def getUserVirgilJWT():
     try:
         if not g.user:
-            print('ERROR: No user to get Virgil JWT for.')
+            log.error('No user to get Virgil JWT for.')
             return "", constants.STATUS_BAD_REQUEST
 
-        crypto = VirgilCrypto()
-        api_id = os.environ['VIRGIL_API_ID'] 
-        api_key_id = os.environ['VIRGIL_API_KEY_ID']
-        api_private_key = os.environ['VIRGIL_API_PRIVATE_KEY_ID']
-
-        token_ttl = 20 # seconds
-        imported_key = crypto.import_private_key(Utils.b64decode(api_private_key)).private_key
-
-        # Instantiate token generator
-        builder = JwtGenerator(
-            api_id,
-            imported_key,
-            api_key_id,
-            token_ttl,
-            AccessTokenSigner()
-        )
-
-        token = builder.generate_token(str(g.user.id)).to_string()
+        token = getVirgilToken(g.user.id)
         return jsonify({"token": token}), constants.STATUS_OK
     except Exception as err:
-        print('Error getting the Virgil JWT: ' + str(err))
+        log.error('Error getting the Virgil JWT: %s', err)
         return "", constants.STATUS_SERVER_ERROR
 
     return "", constants.STATUS_SERVER_ERROR
 
 
+# The key import and the generator are built once per worker. Tokens minted in the last few seconds are handed
+# back as is since they are still valid for most of their lifetime.
+_virgilLock = threading.Lock()
+_virgilGenerator = None
+_virgilTokens = TTLCache(maxsize=constants.VIRGIL_TOKEN_CACHE_SIZE, ttl=constants.VIRGIL_TOKEN_REUSE_SECONDS)
+
+
+def buildVirgilJwtGenerator():
+    crypto = VirgilCrypto()
+    api_id = os.environ['VIRGIL_API_ID'] 
+    api_key_id = os.environ['VIRGIL_API_KEY_ID']
+    api_private_key = os.environ['VIRGIL_API_PRIVATE_KEY_ID']
+    imported_key = crypto.import_private_key(Utils.b64decode(api_private_key)).private_key
+
+    return JwtGenerator(
+        api_id,
+        imported_key,
+        api_key_id,
+        constants.VIRGIL_TOKEN_TTL_SECONDS,
+        AccessTokenSigner()
+    )
+
+
+def getVirgilToken(userId):
+    global _virgilGenerator
+    with _virgilLock:
+        token = _virgilTokens.get(userId)
+        if token is None:
+            if _virgilGenerator is None:
+                _virgilGenerator = buildVirgilJwtGenerator()
+            token = _virgilGenerator.generate_token(str(userId)).to_string()
+            _virgilTokens[userId] = token
+    return token
+
+
 @apiBlueprint.route("/user/searchUser", methods=["GET"])
 @auth.login_required
 def searchUser():
     if "idCode" not in request.args:
-        print("ERROR: Cannot search for users without invite code.")
+        log.error('Cannot search for users without invite code.')
         return "", constants.STATUS_BAD_REQUEST
 
     if g.user.idCode.upper() == request.args["idCode"].upper():
-        print('ERROR: Cannot return the same user when searching idCode')
+        log.error('Cannot return the same user when searching idCode')
         return "", constants.STATUS_BAD_REQUEST
 
     idCode = request.args["idCode"]
     idCode = idCode.upper()
-    db.create_all()
     targetUser = User.query.options(load_only("name", "id", "profileImgUrl")).filter_by(idCode=idCode).first()
     toReturn = {"count": 0 }
     if targetUser: 
@@ -106,103 +143,72 @@ def searchUser():
 @auth.login_required
 def getUserIdCode():
     if not g.user: 
-        print("ERROR: No user associated with the token to get IdCode for.")
+        log.error('No user associated with the token to get IdCode for.')
         return "", constants.STATUS_SERVER_ERROR
 
-    numFriends = 0
-    if g.user.friends:
-        numFriends = len(g.user.friends)
-
+    numFriends = friendGraph.countFriends(g.user.id)
     return jsonify({"idCode": g.user.idCode, "numFriends": numFriends}), constants.STATUS_OK    
 
 @apiBlueprint.route('/user/search/cardholders', methods=["GET"])
 @auth.login_required
+@replicas.readOnly
 def searchCardholders():
     if "cardId" not in request.args:
-        print("ERROR: Cardholders cannot be obtained without cardId")
+        log.error('Cardholders cannot be obtained without cardId')
         return "", constants.STATUS_BAD_REQUEST
 
-    db.create_all()
     cardId = request.args["cardId"]
     toReturn = {"numFirst": 0, "numSecond": 0, "first": [], "second": []}
 
-    theCard = Card.query.get(cardId)
+    theCard = cardCatalog.getCard(cardId)
 
     if not theCard:
-        print("ERROR: There is not card matching the given cardId: " + str(cardId))
+        log.error('There is not card matching the given cardId: %s', cardId)
         return "", constants.STATUS_BAD_REQUEST
 
-    cardIds = []
-    if theCard.objectType == constants.CARD_TYPE_TAG:
-        cardsWithTag = Card.query.filter_by(tagId=theCard.id)
-        for cardWithTag in cardsWithTag: 
-            cardIds.append(int(cardWithTag.id))
-    else:
-        cardIds = [int(cardId)]
+    cardIds = cardCatalog.expandCardIds(theCard)
+    first, second = search.searchCardholders(g.user.id, cardIds)
+    toReturn["first"] = first
+    toReturn["numFirst"] = len(first)
+    toReturn["second"] = second
+    toReturn["numSecond"] = len(second)
 
-    processedIds = []
-    friendIds = []
+    db.session.close()
+    return jsonify(toReturn), constants.STATUS_OK
 
-    # Search first degree friends with card
-    for friendRow in g.user.friends:
-        if str(friendRow.friendId) in processedIds:
-            continue
 
-        friendIds.append(friendRow.friendId)
-        friend = User.query.get(friendRow.friendId)
-        processedIds.append(str(friendRow.friendId))
-        if not friend: 
-            print("WARNING: No friend with id: " + str(friendRow.friendId))
-            continue
-        
-        if not friend.cards:
-            continue
+@apiBlueprint.route("/user/mutualFriends", methods=["GET"])
+@auth.login_required
+@replicas.readOnly
+def getMutualFriends():
+    """All the friends the user has in common with another user, best introduction first."""
+    otherId = request.args.get("id", type=int)
+    if otherId is None:
+        log.error('id is a required parameter for this operation.')
+        return "", constants.STATUS_BAD_REQUEST
 
-        for oneCardId in cardIds:
-            if oneCardId in friend.cards:
-                toReturn["first"].append({"name": friend.name, "id": friend.id, "phoneNumber": friend.phoneNumber, \
-                    "cardId": oneCardId, "cardName": getCardNameFromId(oneCardId)})
-                toReturn["numFirst"] += 1 
+    if otherId == g.user.id:
+        log.error('Mutual friends of a user with themselves requested')
+        return "", constants.STATUS_BAD_REQUEST
 
-    # Search second degree friends with card
-    for friendId in friendIds:
-        friend = User.query.get(friendId)
-        if not friend:
-            continue
+    mutuals = mutualFriends.getMutualFriends(g.user.id, otherId)
+    db.session.close()
+    return jsonCodec.listResponse({"count": len(mutuals)}, "mutualFriends", mutuals, renderMutualFriend), constants.STATUS_OK
 
-        for secondDegreeFriendRow in friend.friends:
-            # Ignore the current user in the list of friends
-            if secondDegreeFriendRow.friendId == g.user.id or str(secondDegreeFriendRow.friendId) in processedIds:
-                continue
-
-            secondDegreeFriend = User.query.get(secondDegreeFriendRow.friendId)
-            processedIds.append(str(secondDegreeFriendRow.friendId))
-            if not secondDegreeFriend: 
-                print("WARNING: No second degree friend with id: " + str(secondDegreeFriendRow.friendId))
-                continue
-            
-            if not secondDegreeFriend.cards:
-                continue
-            
-            for oneCardId in cardIds:
-                if oneCardId in secondDegreeFriend.cards:
-                    toReturn["second"].append({"name": secondDegreeFriend.name, "id": secondDegreeFriend.id, \
-                        "cardId": oneCardId, "cardName": getCardNameFromId(oneCardId), "friendName": friend.name})
-                    toReturn["numSecond"] += 1 
 
-    db.session.close()
-    return jsonify(toReturn), constants.STATUS_OK
+def renderMutualFriend(mutualFriend):
+    return {"name": mutualFriend.name, "id": mutualFriend.id, "profileImgUrl": mutualFriend.profileImgUrl}
 
 
 @apiBlueprint.route("/user/sendChatNotification", methods=["POST"])
 @auth.login_required
 def sendChatNotification():
     if "data" not in request.json:
-        print("ERROR: Data object not found in notification request")
+        log.error('Data object not found in notification request')
         return "", constants.STATUS_BAD_REQUEST
 
     if "to" not in request.json:
-        print("ERROR: No recipient found in notification request")
+        log.error('No recipient found in notification request')
         return "", constants.STATUS_BAD_REQUEST
 
     data = request.json["data"]
@@ -217,7 +223,6 @@ def sendChatNotification():
 @apiBlueprint.route("/user/profile", methods=["GET"])
 @auth.login_required
 def getProfile():
-    db.create_all()
 
     # Check if profile is accessible to user
     accessible = False
@@ -225,27 +230,31 @@ def getProfile():
         if request.args["id"] == g.user.id:
             accessible = True
         else:
-            if g.user.friends:
-                for friendRow in g.user.friends:
-                    if str(friendRow.friendId) == request.args["id"]:
-                        accessible = True
-                        break
+            try:
+                accessible = friendGraph.isFriend(g.user.id, int(request.args["id"]))
+            except ValueError:
+                accessible = False
     else:
         accessible = True
 
     if not accessible:
-        print('ERROR: This user cannot access the profile.')
+        log.error('This user cannot access the profile.')
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
     thisUser = g.user if "id" not in request.args else User.query.get(request.args['id'])
 
     if not thisUser:
-        print('ERROR: There is no user associated to get the profile for.')
+        log.error('There is no user associated to get the profile for.')
         db.session.close()
         return "", constants.STATUS_BAD_REQUEST
 
-    userCardIds = thisUser.cards
+    tag = etags.profileTag(thisUser)
+    if etags.isNotModified(tag):
+        db.session.close()
+        return etags.notModified(tag)
+
+    userCardIds = cardOwnership.getCardIds(thisUser.id)
     responseString = {
         "name": thisUser.name,
         "phoneNumber": thisUser.phoneNumber,
@@ -255,31 +264,90 @@ def getProfile():
     }
 
     if userCardIds:
+        cardNames = cardCatalog.namesFor(userCardIds)
         for cardId in userCardIds:
-            cardName = getCardNameFromId(cardId)
-            responseString["cards"].append({"name": cardName, "id": cardId})
+            responseString["cards"].append({"name": cardNames[cardId], "id": cardId})
 
     db.session.close()
-    return jsonify(responseString), constants.STATUS_OK
+    return etags.tagResponse(jsonify(responseString), tag), constants.STATUS_OK
+
+@apiBlueprint.route("/user/profiles", methods=["GET"])
+@auth.login_required
+@replicas.readOnly
+def getProfiles():
+    """Profiles of up to MAX_PROFILES_PER_REQUEST comma separated ids, in a fixed number of queries."""
+    if not request.args.get("ids"):
+        log.error('ids is a required parameter for this operation.')
+        return "", constants.STATUS_BAD_REQUEST
+
+    requestedIds = []
+    errors = []
+    for value in request.args["ids"].split(","):
+        try:
+            userId = int(value)
+        except ValueError:
+            errors.append({"id": value, "error": constants.PROFILE_INVALID_ID})
+            continue
+        if userId not in requestedIds:
+            requestedIds.append(userId)
+
+    if len(requestedIds) > constants.MAX_PROFILES_PER_REQUEST:
+        log.error('Too many profiles requested: %s', len(requestedIds))
+        return "", constants.STATUS_BAD_REQUEST
+
+    # The user's own profile and those of friends are accessible
+    accessible = friendGraph.getFriendsAmong(g.user.id, requestedIds)
+    if g.user.id in requestedIds:
+        accessible.add(g.user.id)
+
+    users = {}
+    if accessible:
+        rows = db.session.query(User.id, User.name, User.phoneNumber, User.upiID, User.profileImgUrl).filter(User.id.in_(accessible))
+        users = {row.id: row for row in rows}
+    userCardIds = cardOwnership.getCardIdsForUsers(list(users.keys()))
+    cardNames = cardCatalog.namesFor(set(cardId for cardIds in userCardIds.values() for cardId in cardIds))
+
+    toReturn = {"profiles": [], "errors": errors}
+    for userId in requestedIds:
+        if userId not in accessible:
+            toReturn["errors"].append({"id": userId, "error": constants.PROFILE_NOT_ACCESSIBLE})
+        elif userId not in users:
+            toReturn["errors"].append({"id": userId, "error": constants.PROFILE_NOT_FOUND})
+        else:
+            user = users[userId]
+            toReturn["profiles"].append({
+                "id": userId,
+                "name": user.name,
+                "phoneNumber": user.phoneNumber,
+                "cards": [{"name": cardNames[cardId], "id": cardId} for cardId in userCardIds[userId]],
+                "upiID": user.upiID,
+                "profileImgUrl": user.profileImgUrl,
+            })
+
+    db.session.close()
+    return jsonify(toReturn), constants.STATUS_OK
+
 
 @apiBlueprint.route("/user/updateUPI", methods=["POST"])
 @auth.login_required
 def updateUPI():
     if "upiID" not in request.json:
-        print('ERROR: upiID parameter is required for updating UPI ID.')
+        log.error('upiID parameter is required for updating UPI ID.')
         return "", constants.STATUS_BAD_REQUEST
 
     if not g.user:
-        print('ERROR: There is no user associated with the token.')
+        log.error('There is no user associated with the token.')
         return "", constants.STATUS_BAD_REQUEST
 
-    db.create_all()
-    thisUser = g.user
+    thisUser = g.user.getUser()
     thisUser.upiID = request.json["upiID"]
+    thisUser.bumpProfileVersion()
     if (not commitToDB()):
-        print('ERROR: Problem updating UPIID: ' + str(g.user.phoneNumber))
+        log.error('Problem updating UPIID: %s', g.user.phoneNumber)
         return "", constants.STATUS_SERVER_ERROR
 
+    authCache.invalidateUser(g.user.id)
+
     return "", constants.STATUS_OK
 
 
@@ -287,10 +355,9 @@ def updateUPI():
 @auth.login_required
 def updateCards():
     if not g.user:
-        print('ERROR: There is no user associated with the token.')
+        log.error('There is no user associated with the token.')
         return "", constants.STATUS_BAD_REQUEST
-    db.create_all()
-    thisUser = g.user
+    thisUser = g.user.getUser()
     
     # Cards
     selectedCards = json.loads(request.json["cards"])
@@ -299,44 +366,18 @@ def updateCards():
         if selectedCard["id"] not in cards:
             cards.append(selectedCard["id"])
 
-    # remove the userid from existing cards
-    if thisUser.cards is not None:
-        for cardId in thisUser.cards:
-            theCard = Card.query.get(cardId)
-            if theCard is not None and theCard.users is not None:
-                while thisUser.id in theCard.users: 
-                    theCard.users.remove(thisUser.id) # there may be cases when duplicate ids exist so remove all.
-                flag_modified(theCard, 'users')
-    db.session.commit()
-    print('Finished removing cards for user: ' + str(g.user.phoneNumber))
-
-    thisUser.cards = cards
-
-    # add the userid in the new cards
-    for cardId in cards:
-        theCard = Card.query.get(cardId)
-        if theCard is not None:
-            if theCard.users is None:
-                theCard.users = []
-            theCard.users.append(thisUser.id)
-            flag_modified(theCard, 'users')
-    print('Finished adding cards for user: ' + str(g.user.phoneNumber))
-
-    flag_modified(thisUser, 'cards')
+    # Only the cards that changed are inserted or deleted, all in one transaction
+    added, removed = cardOwnership.setUserCards(thisUser, cards)
+    thisUser.bumpProfileVersion()
+    log.debug('Updating cards for user: %s added: %s removed: %s', thisUser.id, added, removed)
     if (not commitToDB()):
-        print('ERROR: Could not update cards for ID: ' + str(thisUser.id))
+        log.error('Could not update cards for ID: %s', thisUser.id)
         return "", constants.STATUS_SERVER_ERROR
 
-    return "", constants.STATUS_OK
+    authCache.invalidateUser(g.user.id)
 
-def getCardNameFromId(cardId):
-    card = Card.query.options(load_only('name')).get(cardId)
-    if not card:
-        print('ERROR: No card with cardId: ' + cardId)
-        return None
-    return card.name
+    return "", constants.STATUS_OK
 
-# make sure to call db.create_all() before this.
 def commitToDB():
     committed = False
     try:
@@ -344,7 +385,7 @@ def commitToDB():
         committed = True
     except Exception as err:
         db.session.rollback()
-        print('ERROR: Exception while committing to database: ' + str(err))
+        log.error('Exception while committing to database: %s', err)
     finally:
         db.session.close()
 
@@ -1,15 +1,68 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
 import os
 
-def create_app():
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+def create_app(databaseUri=None, checkSchema=True, replicaUris=None):
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = "postgres+psycopg2://" + os.environ['RDS_USERNAME'] + ':' + os.environ['RDS_PASSWORD'] \
-                                        +'@' + os.environ['RDS_HOSTNAME']  +  ':' + os.environ['RDS_PORT'] \
-                                        + '/' + os.environ['RDS_DB_NAME']
+    if databaseUri is None:
+        databaseUri = getDatabaseUri(os.environ['RDS_HOSTNAME'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = databaseUri
+
+    # Optional read replicas share the credentials and database name of the primary
+    if replicaUris is None:
+        replicaHosts = os.environ.get('RDS_REPLICA_HOSTNAMES', '')
+        replicaUris = [getDatabaseUri(host.strip()) for host in replicaHosts.split(',') if host.strip()]
+
+    # Schema changes are applied with `flask db upgrade`, never from the request path.
+    from Circles import dbPool, friendGraph, jsonCodec, logs, metrics, replicas
+    from Circles.models import db
+    db.init_app(app)
+    dbPool.init_app(app, db)
+    Migrate(app, db, directory=MIGRATIONS_DIRECTORY)
+    logs.init_app(app)
+    jsonCodec.init_app(app)
+    metrics.init_app(app, db)
+    replicas.init_app(app, replicaUris)
+    friendGraph.init_app(app)
+    if checkSchema:
+        check_schema(app, db)
     return app
 
+def getDatabaseUri(hostname):
+    return "postgres+psycopg2://" + os.environ['RDS_USERNAME'] + ':' + os.environ['RDS_PASSWORD'] \
+            +'@' + hostname  +  ':' + os.environ['RDS_PORT'] \
+            + '/' + os.environ['RDS_DB_NAME']
+
 def create_db(app):
     db = SQLAlchemy(app)
     db.init_app(app)
-    return db
\ No newline at end of file
+    return db
+
+def check_schema(app, db):
+    """Compares the database's migration revision with the latest one shipped with the code."""
+    from alembic.config import Config
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    from Circles import logs
+    log = logs.getLogger(__name__)
+
+    config = Config()
+    config.set_main_option('script_location', MIGRATIONS_DIRECTORY)
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    try:
+        with app.app_context():
+            with db.engine.connect() as connection:
+                current = set(MigrationContext.configure(connection).get_current_heads())
+    except Exception as err:
+        log.error('Could not read the schema revision of the database: %s', err)
+        return False
+
+    if current != heads:
+        log.error('Database schema is at revision %s but the code expects %s. Run `flask db upgrade` (or `flask db stamp head` ' \
+                  'once for a database created before migrations).', sorted(current), sorted(heads))
+        return False
+
+    return True
@@ -0,0 +1,94 @@
+import collections, threading, time
+from cachetools import TTLCache
+from flask import abort
+from itsdangerous import (TimedJSONWebSignatureSerializer as Serializer, SignatureExpired, BadSignature)
+from Circles import constants, logs
+from Circles.models import db, User
+
+log = logs.getLogger(__name__)
+
+# The handful of user fields needed by most handlers. Anything else loads the full ORM User.
+PRINCIPAL_FIELDS = ("id", "name", "idCode", "fcmToken", "suspended")
+Principal = collections.namedtuple("Principal", PRINCIPAL_FIELDS + ("expiresAt",))
+
+_lock = threading.Lock()
+_principals = TTLCache(maxsize=constants.AUTH_CACHE_SIZE, ttl=constants.AUTH_CACHE_TTL_SECONDS)
+_serializers = {}
+
+
+class AuthenticatedUser(object):
+    """
+    Per-request view of the authenticated user set on g.user. Principal fields are answered from the token cache;
+    any other attribute (relationships, cards, upiID, ...) loads the ORM User once and reads it from there.
+    Handlers that modify the user must call getUser() and update the returned ORM object.
+    """
+
+    def __init__(self, principal, ormUser=None):
+        self.principal = principal
+        self.ormUser = ormUser
+
+    def getUser(self):
+        if self.ormUser is None:
+            self.ormUser = User.query.get(self.principal.id)
+        return self.ormUser
+
+    def __getattr__(self, attr):
+        # Only called for attributes not found on the wrapper itself
+        if attr in PRINCIPAL_FIELDS:
+            return getattr(self.__dict__["principal"], attr)
+        return getattr(self.getUser(), attr)
+
+    @property
+    def is_active(self):
+        return not self.principal.suspended
+
+
+def getSerializer(key):
+    serializer = _serializers.get(key)
+    if serializer is None:
+        serializer = Serializer(key)
+        _serializers[key] = serializer
+    return serializer
+
+
+def principalFromUser(user, expiresAt=None):
+    return Principal(user.id, user.name, user.idCode, user.fcmToken, user.suspended, expiresAt)
+
+
+def loadPrincipal(userId, expiresAt):
+    row = db.session.query(User.id, User.name, User.idCode, User.fcmToken, User.suspended).filter(User.id == userId).first()
+    if not row:
+        return None
+    return Principal(*(tuple(row) + (expiresAt,)))
+
+
+def verifyToken(token, key):
+    """Returns the Principal for a valid token, None for an invalid one and aborts with 410 for an expired one."""
+    with _lock:
+        principal = _principals.get(token)
+    if principal is not None and (principal.expiresAt is None or principal.expiresAt > time.time()):
+        return principal
+
+    try:
+        data, header = getSerializer(key).loads(token, return_header=True)
+    except SignatureExpired:
+        log.error('The token has expired.')
+        abort(constants.STATUS_GONE)
+        return None  # valid token, but expired
+    except BadSignature:
+        log.error('The token is invalid')
+        return None  # invalid token
+
+    principal = loadPrincipal(data['id'], header.get('exp'))
+    if principal is not None:
+        with _lock:
+            _principals[token] = principal
+    return principal
+
+
+def invalidateUser(userId):
+    """Drops every cached token of the user so the next request re-reads the principal fields."""
+    with _lock:
+        for token, principal in list(_principals.items()):
+            if principal.id == userId:
+                _principals.pop(token, None)
@@ -0,0 +1,98 @@
+import collections, hashlib, threading, time
+from Circles import constants, logs
+from Circles.models import db, Card
+
+log = logs.getLogger(__name__)
+
+# The card table is small and rarely changes so every worker keeps a read-only snapshot of it in memory.
+CatalogCard = collections.namedtuple("CatalogCard", ["id", "name", "objectType", "tagId"])
+
+_lock = threading.Lock()
+_snapshot = None
+_loadedAt = 0.0
+
+
+class CardCatalogSnapshot(object):
+    def __init__(self, cards):
+        self.cards = collections.OrderedDict((card.id, card) for card in sorted(cards, key=lambda card: card.id))
+        self.tagMembers = {}
+        for card in self.cards.values():
+            if card.tagId is not None:
+                self.tagMembers.setdefault(card.tagId, []).append(card.id)
+
+        digest = hashlib.sha1()
+        for card in self.cards.values():
+            digest.update(repr(tuple(card)).encode("utf-8"))
+        self.version = digest.hexdigest()[:16]
+
+
+def loadSnapshot():
+    rows = db.session.query(Card.id, Card.name, Card.objectType, Card.tagId).all()
+    return CardCatalogSnapshot([CatalogCard(*row) for row in rows])
+
+
+def getSnapshot():
+    """Returns the current catalog snapshot, reloading it from the database once the TTL has passed."""
+    global _snapshot, _loadedAt
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _loadedAt < constants.CARD_CATALOG_TTL_SECONDS:
+        return snapshot
+
+    with _lock:
+        if _snapshot is None or time.monotonic() - _loadedAt >= constants.CARD_CATALOG_TTL_SECONDS:
+            _snapshot = loadSnapshot()
+            _loadedAt = time.monotonic()
+        return _snapshot
+
+
+def invalidate():
+    """Forces the next lookup to reload the catalog."""
+    global _loadedAt
+    with _lock:
+        _loadedAt = 0.0
+
+
+def getVersion():
+    return getSnapshot().version
+
+
+def getCard(cardId):
+    try:
+        return getSnapshot().cards.get(int(cardId))
+    except (TypeError, ValueError):
+        return None
+
+
+def getName(cardId):
+    card = getCard(cardId)
+    if not card:
+        log.error('No card with cardId: %s', cardId)
+        return None
+    return card.name
+
+
+def namesFor(cardIds):
+    """Returns a dict of card id to card name for all the given ids; unknown ids map to None."""
+    cards = getSnapshot().cards
+    names = {}
+    for cardId in cardIds:
+        card = cards.get(cardId)
+        if not card:
+            log.error('No card with cardId: %s', cardId)
+        names[cardId] = card.name if card else None
+    return names
+
+
+def expandCardIds(card):
+    """Returns the ids of the cards a search for card covers; tags expand to their member cards."""
+    if card.objectType == constants.CARD_TYPE_TAG:
+        return list(getSnapshot().tagMembers.get(card.id, []))
+    return [card.id]
+
+
+def allCards():
+    return list(getSnapshot().cards.values())
+
+
+def cardsOfType(objectType):
+    return [card for card in getSnapshot().cards.values() if card.objectType == objectType]
@@ -0,0 +1,72 @@
+from sqlalchemy import func
+from sqlalchemy.orm.attributes import flag_modified
+from Circles.models import db, User, UserCard
+
+# UserCard is the source of truth for which user holds which card. User.cards is kept in sync as a denormalized
+# copy for older readers; Card.users is no longer maintained.
+
+
+def getCardIds(userId):
+    return [cardId for (cardId,) in db.session.query(UserCard.cardId).filter(UserCard.userId == userId).order_by(UserCard.cardId)]
+
+
+def getCardIdsForUsers(userIds):
+    """Returns a dict of user id -> card ids for all the given users in one query."""
+    cardIds = {userId: [] for userId in userIds}
+    if not cardIds:
+        return cardIds
+    rows = db.session.query(UserCard.userId, UserCard.cardId).filter(UserCard.userId.in_(list(cardIds.keys()))) \
+            .order_by(UserCard.userId, UserCard.cardId)
+    for userId, cardId in rows:
+        cardIds[userId].append(cardId)
+    return cardIds
+
+
+def countCardsColumn():
+    """Correlated count of the cards of User.id, for use in queries selecting from User."""
+    return db.session.query(func.count(UserCard.cardId)).filter(UserCard.userId == User.id).correlate(User).as_scalar()
+
+
+def countCards(userId):
+    return db.session.query(func.count(UserCard.cardId)).filter(UserCard.userId == userId).scalar()
+
+
+def getCardHolders(cardIds, userIds):
+    """Returns a dict of user id -> held card ids (in cardIds order) for the users of the set userIds holding any of cardIds."""
+    if not cardIds or not userIds:
+        return {}
+
+    # The holders of the cards come from the (cardId, userId) index alone; userIds can be a whole two hop circle,
+    # far too many to bind in the query, so the holders outside it are dropped here
+    heldCards = {}
+    rows = db.session.query(UserCard.userId, UserCard.cardId).filter(UserCard.cardId.in_(cardIds))
+    for userId, cardId in rows:
+        if userId in userIds:
+            heldCards.setdefault(userId, set()).add(cardId)
+
+    return {userId: [cardId for cardId in cardIds if cardId in held] for userId, held in heldCards.items()}
+
+
+def setUserCards(user, cardIds):
+    """
+    Replaces the cards of user with cardIds by inserting and deleting only the rows that changed. Changes are added
+    to the current session; the caller commits them in one transaction.
+    """
+    newCardIds = []
+    for cardId in cardIds:
+        if cardId not in newCardIds:
+            newCardIds.append(cardId)
+
+    existing = set(cardId for (cardId,) in db.session.query(UserCard.cardId).filter(UserCard.userId == user.id))
+    toRemove = existing.difference(newCardIds)
+    toAdd = [cardId for cardId in newCardIds if cardId not in existing]
+
+    if toRemove:
+        db.session.query(UserCard).filter(UserCard.userId == user.id).filter(UserCard.cardId.in_(toRemove)) \
+            .delete(synchronize_session=False)
+    for cardId in toAdd:
+        db.session.add(UserCard(userId=user.id, cardId=cardId))
+
+    user.cards = newCardIds
+    flag_modified(user, 'cards')
+    return toAdd, sorted(toRemove)
@@ -1,4 +1,6 @@
 TOKEN_EXPIRATION = 6000000
+AUTH_CACHE_SIZE = 10000
+AUTH_CACHE_TTL_SECONDS = 60
 
 # Timezone for registering created/update times
 TIMEZONE_KOLKATA = 'Asia/Kolkata'
@@ -6,6 +8,7 @@ DATETIME_NOT_AVAILABLE = "N/A"
 SECONDS_IN_DAY = 86400
 
 STATUS_OK = 200
+STATUS_NOT_MODIFIED = 304
 STATUS_BAD_REQUEST = 400
 STATUS_UNAUTHORIZED = 401
 STATUS_NOT_ALLOWED = 405
@@ -27,6 +30,8 @@ ACCESS_REQUEST_REJECTED = 3
 ACCESS_REQUEST_VALIDATED = 4
 ACCESS_REQUEST_INVALIDATED = 5
 ACCESS_REQUEST_EXPIRED = 6
+EXPIRY_SWEEP_SECONDS = 60
+EXPIRY_SWEEP_BATCH_SIZE = 1000
 ACCESS_REQUEST_NOTIFICATION_TYPE = "ar"
 ACCESS_REQUEST_NOTIFICATION_TITLE = "New card request from {}"
 ACCESS_REQUEST_NOTIFICATION_BODY = "{} wants to use {} you own for a purchase"
@@ -36,11 +41,29 @@ ACCESS_REQUEST_DECLINED_BODY = "{} declined your card request"
 ACCESS_REQUEST_ACCEPTED_TITLE = "Card request accepted"
 ACCESS_REQUEST_DECLINED_TITLE = "Card request declined"
 
+# Pagination
+POSTS_PAGE_SIZE = 50
+REQUESTS_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_PROFILES_PER_REQUEST = 50
+JSON_STREAM_BATCH_ITEMS = 250 # rows fetched and encoded at a time by unpaged list responses
+
+# Per-id errors of /user/profiles
+PROFILE_INVALID_ID = "invalidId"
+PROFILE_NOT_ACCESSIBLE = "notAccessible" # also returned for ids with no user, so existence is not revealed
+PROFILE_NOT_FOUND = "notFound"
+
 # Posts
 POST_NOTIFICATION_TYPE = "post"
 POST_NOTIFICATION_TITLE = "New broadcast from {}"
 POST_NOTIFICATION_BODY = "{} just sent a short message to their Circle."
 
+# sms
+SMS_TIMEOUT_SECONDS = 5
+SMS_MAX_LENGTH = 1600
+FOUNDER_ALERT_QUEUE_SIZE = 1000
+FOUNDER_DIGEST_SECONDS = 300
+
 # auth code status
 CODE_VERIFICATION_FAILED = 0
 CODE_VERIFICATION_SUCCEEDED = 1
@@ -61,12 +84,68 @@ FRIEND_REQUEST_DECLINED_BODY = "You'll remain outside each other's Circles"
 
 # notification constants
 FIREBASE_CHANNEL = "circlesWay"
+FCM_MULTICAST_BATCH_SIZE = 100
+
+# notification outbox
+OUTBOX_PENDING = 0
+OUTBOX_SENT = 1
+OUTBOX_DEAD = -1
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_POLL_SECONDS = 2
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE_SECONDS = 5
+OUTBOX_BACKOFF_MAX_SECONDS = 3600
+OUTBOX_LEASE_SECONDS = 300 # a claimed row is retried once this passes without its result being recorded
+OUTBOX_RETENTION_SECONDS = SECONDS_IN_DAY # sent rows are pruned after this
+OUTBOX_PRUNE_SECONDS = 600
 
 CHAT_NOTIFICATION_TITLE = "New message from {}"
 CHAT_NOTIFICATION_BODY = "You have new messages in your encrypted chat"
 
+# virgil
+VIRGIL_TOKEN_TTL_SECONDS = 20
+VIRGIL_TOKEN_REUSE_SECONDS = 10 # must stay well below the token ttl
+VIRGIL_TOKEN_CACHE_SIZE = 10000
+
 # user ids
 ABHIRAM_USER_ID = 24
 ANCHAL_USER_ID = 26
 
-CARD_TYPE_TAG = "Tag"
\ No newline at end of file
+CARD_TYPE_TAG = "Tag"
+CARD_CATALOG_TTL_SECONDS = 300
+ETAG_LENGTH = 32 # hex digits of the sha1 kept in an ETag
+# Logging
+LOG_LEVEL = "INFO"
+LOG_QUEUE_SIZE = 10000
+# (logger, message format) -> share of the records kept, for per-row messages a single request can log many times;
+# records not listed are always kept
+LOG_SAMPLE_RATES = {
+    ("Circles.search", "No friend with id: %s"): 0.25,
+    ("Circles.search", "No second degree friend with id: %s"): 0.25,
+}
+REQUEST_ID_HEADER = "X-Request-Id"
+REQUEST_ID_MAX_LENGTH = 64
+
+# Read replicas
+READ_FROM_HEADER = "X-Read-From" # "primary" sends the reads of a read-only handler to the primary
+REPLICA_MAX_LAG_SECONDS = 2
+REPLICA_LAG_CHECK_SECONDS = 5
+REPLICA_READ_YOUR_WRITES_SECONDS = 10
+REPLICA_WRITERS_CACHE_SIZE = 10000
+
+# Connection pool, overridable per deployment through environment variables of the same name
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 5
+DB_POOL_TIMEOUT_SECONDS = 10
+DB_POOL_RECYCLE_SECONDS = 1800
+DB_POOL_PRE_PING = True
+DB_STATEMENT_TIMEOUT_MS = 10000
+
+# Friend graph shared by the worker processes of a host
+FRIEND_GRAPH_DIR_PREFIX = "circles-friend-graph-"
+FRIEND_GRAPH_SYNC_SECONDS = 5 # how often rows added or removed through other hosts are picked up
+FRIEND_GRAPH_REBUILD_SECONDS = 900 # snapshot age after which it is read again from the primary
+FRIEND_GRAPH_MAX_LOG_RECORDS = 100000
+FRIEND_GRAPH_SYNC_ID_OVERLAP = 1000 # ids below a sync watermark read again, for rows that committed after higher ids
+FRIEND_GRAPH_LOCK_POLL_SECONDS = 0.005
+FRIEND_REMOVAL_RETENTION_SECONDS = SECONDS_IN_DAY # FriendRemoval rows are deleted after this
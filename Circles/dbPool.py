@@ -0,0 +1,131 @@
+import os, threading, time
+from flask import g, request
+from sqlalchemy import event
+from Circles import constants, logs, metrics
+
+# Connection pool settings for the primary and replica engines, session release at the end of every app context,
+# and a detector for connections still checked out by a thread once its request is over.
+
+log = logs.getLogger(__name__)
+
+# app.config key -> default; each can be overridden with an environment variable of the same name
+POOL_CONFIG = {
+    "DB_POOL_SIZE": constants.DB_POOL_SIZE,
+    "DB_MAX_OVERFLOW": constants.DB_MAX_OVERFLOW,
+    "DB_POOL_TIMEOUT_SECONDS": constants.DB_POOL_TIMEOUT_SECONDS,
+    "DB_POOL_RECYCLE_SECONDS": constants.DB_POOL_RECYCLE_SECONDS,
+    "DB_POOL_PRE_PING": constants.DB_POOL_PRE_PING,
+    "DB_STATEMENT_TIMEOUT_MS": constants.DB_STATEMENT_TIMEOUT_MS,
+}
+
+BACKGROUND_ROUTE = "background"
+
+_checkedOut = {} # id of the connection record -> [thread id, engine name, checkout time, reported]
+_checkedOutLock = threading.Lock()
+
+
+def parseSetting(value, default):
+    # bool("false") is True, so flags are spelled out rather than converted
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes")
+    return type(default)(value)
+
+
+def configure(app):
+    for key, default in POOL_CONFIG.items():
+        if key in os.environ:
+            app.config.setdefault(key, parseSetting(os.environ[key], default))
+        else:
+            app.config.setdefault(key, default)
+
+
+def applyEngineOptions(config, drivername, options):
+    """Adds the pool settings of config to the create_engine options for a database of the given driver."""
+    options["pool_pre_ping"] = config["DB_POOL_PRE_PING"]
+    if not drivername.startswith("postgres"):
+        return options # SQLite keeps the pool Flask-SQLAlchemy picks for it
+
+    options["pool_size"] = config["DB_POOL_SIZE"]
+    options["max_overflow"] = config["DB_MAX_OVERFLOW"]
+    options["pool_timeout"] = config["DB_POOL_TIMEOUT_SECONDS"]
+    options["pool_recycle"] = config["DB_POOL_RECYCLE_SECONDS"]
+    if config["DB_STATEMENT_TIMEOUT_MS"]:
+        connectArgs = options.setdefault("connect_args", {})
+        connectArgs["options"] = "-c statement_timeout=" + str(config["DB_STATEMENT_TIMEOUT_MS"])
+    return options
+
+
+def init_app(app, db):
+    """Tracks the connections of the primary engine and releases the session when an app context ends."""
+    configure(app)
+    with app.app_context():
+        trackEngine(db.engine, "primary")
+
+    # The request context is gone by the time the app context tears down, so its route is kept in g
+    def rememberRoute():
+        g.requestRoute = request.url_rule.rule if request.url_rule else metrics.UNMATCHED_ROUTE
+
+    # Registered after Flask-SQLAlchemy's teardown, so it runs first and the leak check sees the released session
+    def releaseSession(exception=None):
+        db.session.remove()
+        reportLeaks()
+
+    app.before_request(rememberRoute)
+    app.teardown_appcontext(releaseSession)
+
+
+def trackEngine(engine, name):
+    """Records which thread holds each connection of engine, and how many are checked out."""
+    if getattr(engine, "circlesTracked", False):
+        return
+    engine.circlesTracked = True
+
+    # Listening on the engine carries the listeners over to the pool dispose() replaces it with, so the pool is
+    # looked up when the event fires rather than kept from now
+    def onCheckout(dbapiConnection, connectionRecord, connectionProxy):
+        with _checkedOutLock:
+            _checkedOut[id(connectionRecord)] = [threading.get_ident(), name, time.monotonic(), False]
+        recordPoolUsage(name, engine.pool)
+
+    def onCheckin(dbapiConnection, connectionRecord):
+        with _checkedOutLock:
+            _checkedOut.pop(id(connectionRecord), None)
+        recordPoolUsage(name, engine.pool, returning=1)
+
+    event.listen(engine, "checkout", onCheckout)
+    event.listen(engine, "checkin", onCheckin)
+
+
+def recordPoolUsage(name, pool, returning=0):
+    # QueuePool (Postgres) reports its usage; the pools used for SQLite do not. The checkin event fires before the
+    # pool takes the connection back, so it passes the connection being returned.
+    if hasattr(pool, "checkedout"):
+        metrics.recordPoolUsage(name, pool.checkedout() - returning)
+
+
+def getLeakedConnections():
+    """
+    Returns (engine name, seconds held) of the connections still checked out by the current thread. Each connection
+    is returned once, however many requests it outlives.
+    """
+    thread = threading.get_ident()
+    now = time.monotonic()
+    leaks = []
+    with _checkedOutLock:
+        for entry in _checkedOut.values():
+            owner, name, checkedOutAt, reported = entry
+            if owner == thread and not reported:
+                entry[3] = True
+                leaks.append((name, now - checkedOutAt))
+    return leaks
+
+
+def reportLeaks():
+    leaks = getLeakedConnections()
+    if not leaks:
+        return
+
+    route = g.get("requestRoute", BACKGROUND_ROUTE)
+    for name, seconds in leaks:
+        log.error('Connection to %s checked out for %ss is still held after the end of %s', name, round(seconds, 3), route)
+        metrics.recordConnectionLeak(route)
@@ -0,0 +1,55 @@
+import hashlib
+from flask import Response, request
+from Circles import cardCatalog, constants, metrics
+
+# Strong ETags for the responses clients fetch on every screen but that rarely change. A tag is derived from cheap
+# version markers only, never from the response body, so a request whose If-None-Match still matches is answered
+# with 304 Not Modified before the body is built:
+# - the card lists: the version of the card catalog snapshot
+# - a profile: the user's profileVersion, bumped by every update of the profile, and the catalog version
+# - a post: its id and creation time, and the profileVersion of its creator
+
+HIT = "hit" # the client's copy is current, answered with 304
+MISS = "miss" # the client sent a tag that is out of date
+UNCONDITIONAL = "unconditional" # the client sent no tag
+
+
+def makeTag(*parts):
+    digest = hashlib.sha1("/".join(str(part) for part in parts).encode("utf-8"))
+    return digest.hexdigest()[:constants.ETAG_LENGTH]
+
+
+def catalogTag(*parts):
+    return makeTag("catalog", cardCatalog.getVersion(), *parts)
+
+
+def profileTag(user):
+    return makeTag("profile", user.id, user.profileVersion, cardCatalog.getVersion())
+
+
+def postTag(post, creator):
+    return makeTag("post", post.id, post.createdOn.isoformat() if post.createdOn else None, creator.id, creator.profileVersion)
+
+
+def isNotModified(tag):
+    """Returns whether the request already holds the representation tagged tag, and records the outcome."""
+    route = request.url_rule.rule if request.url_rule else metrics.UNMATCHED_ROUTE
+    if not request.if_none_match:
+        metrics.recordConditionalRequest(route, UNCONDITIONAL)
+        return False
+
+    current = request.if_none_match.contains(tag)
+    metrics.recordConditionalRequest(route, HIT if current else MISS)
+    return current
+
+
+def notModified(tag):
+    return tagResponse(Response(status=constants.STATUS_NOT_MODIFIED), tag)
+
+
+def tagResponse(response, tag):
+    """Sets the ETag of response. Clients may keep the response but must revalidate it before every use."""
+    response.set_etag(tag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
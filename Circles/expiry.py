@@ -0,0 +1,70 @@
+import datetime, pytz, threading, time
+from Circles import constants, logs, metrics
+from Circles.models import db, AccessRequest
+
+log = logs.getLogger(__name__)
+
+# Access requests that are still unaccepted a day after they are created expire. The sweeper writes that into the
+# status column so the database can filter and index live requests instead of every reader relabelling expired rows.
+# Requests that were answered keep their status.
+
+_workerLock = threading.Lock()
+_worker = None
+
+
+def getExpiryCutoff():
+    return datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA)) - datetime.timedelta(seconds=constants.SECONDS_IN_DAY)
+
+
+def sweepExpiredAccessRequests(batchSize=constants.EXPIRY_SWEEP_BATCH_SIZE):
+    """Marks overdue unaccepted access requests as expired in batched UPDATEs and returns the number of rows swept."""
+    start = time.monotonic()
+    cutoff = getExpiryCutoff()
+    swept = 0
+    try:
+        while True:
+            overdueIds = db.session.query(AccessRequest.id) \
+                            .filter(AccessRequest.status == constants.ACCESS_REQUEST_UNACCEPTED) \
+                            .filter(AccessRequest.createdOn < cutoff) \
+                            .limit(batchSize).subquery()
+            updated = db.session.query(AccessRequest).filter(AccessRequest.id.in_(overdueIds)) \
+                        .update({AccessRequest.status: constants.ACCESS_REQUEST_EXPIRED}, synchronize_session=False)
+            db.session.commit()
+            swept += updated
+            if updated < batchSize:
+                break
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+        recordSweep(swept, time.monotonic() - start)
+
+    return swept
+
+
+def recordSweep(rows, seconds):
+    metrics.recordExpirySweep(rows, seconds)
+    if rows:
+        log.info('Expired %s access requests in %ss', rows, round(seconds, 3))
+
+
+def runWorker(app, interval):
+    while True:
+        try:
+            with app.app_context():
+                sweepExpiredAccessRequests()
+        except Exception as err:
+            log.error('Access request expiry sweep failed: %s', err)
+        time.sleep(interval)
+
+
+def startWorker(app, interval=constants.EXPIRY_SWEEP_SECONDS):
+    """Starts the expiry sweeper of this process once."""
+    global _worker
+    with _workerLock:
+        if _worker is None:
+            _worker = threading.Thread(target=runWorker, args=(app, interval), name="access-request-expiry")
+            _worker.daemon = True
+            _worker.start()
+    return _worker
@@ -0,0 +1,565 @@
+import array, bisect, contextlib, datetime, hashlib, mmap, os, pytz, struct, tempfile, threading, time
+from flask import current_app
+from sqlalchemy import and_, func, select, tuple_
+from sqlalchemy.engine.url import make_url
+from Circles import constants, logs
+from Circles.models import db, Friend, FriendRemoval
+
+try:
+    import fcntl
+except ImportError: # without file locks the friendships are read from the database
+    fcntl = None
+
+# The Friend rows of every user, in memory shared by all the worker processes of a host. A snapshot file holds them
+# CSR style and each process maps it: the friend ids of userId are ids[offsets[userId]:offsets[userId + 1]], sorted,
+# so a membership check is a binary search within one row and a friend list is a slice of the mapping. The page
+# cache keeps a single copy for the host.
+#
+# Changes go to the log of the snapshot, which every process applies to a small overlay before reading:
+# - the friend request and removal handlers append the rows they commit
+# - a background worker appends the rows other hosts added since the highest Friend id it has seen, and the
+#   friendships they removed since the highest FriendRemoval id it has seen. Ids are handed out before the rows
+#   commit, so it also reads the last FRIEND_GRAPH_SYNC_ID_OVERLAP ids below each watermark again and appends the
+#   rows it had not seen yet.
+# The worker replaces the snapshot with one read from the primary once the log passes FRIEND_GRAPH_MAX_LOG_RECORDS
+# or the snapshot is older than FRIEND_GRAPH_REBUILD_SECONDS.
+
+log = logs.getLogger(__name__)
+
+MAGIC = b"CIRCCSR1"
+HEADER = struct.Struct("=8sQQQ") # magic, number of rows (highest user id + 1), number of friend ids, highest Friend id
+RECORD = struct.Struct("=iii") # operation, userId, friendId
+
+ADD = 1
+REMOVE = 2
+REPLACED = 3 # the snapshot was replaced, the current file names the next one
+
+CURRENT_FILE = "current"
+WATERMARK_FILE = "watermark"
+RECENT_IDS_FILE = "recentIds"
+REMOVAL_WATERMARK_FILE = "removalWatermark"
+REMOVAL_RECENT_IDS_FILE = "removalRecentIds"
+LOG_LOCK_FILE = "log.lock"
+REBUILD_LOCK_FILE = "rebuild.lock"
+
+_worker = None
+_workerLock = threading.Lock()
+
+
+def init_app(app):
+    app.config.setdefault("FRIEND_GRAPH_ENABLED", fcntl is not None)
+    app.config.setdefault("FRIEND_GRAPH_DIR", os.environ.get("FRIEND_GRAPH_DIR") or \
+                          getDefaultDirectory(app.config["SQLALCHEMY_DATABASE_URI"]))
+    app.extensions["friendGraph"] = FriendGraph(app.config["FRIEND_GRAPH_DIR"]) if app.config["FRIEND_GRAPH_ENABLED"] else None
+
+
+def getDefaultDirectory(databaseUri):
+    """A directory in memory backed storage, one per database. In memory SQLite databases get one per process."""
+    key = databaseUri
+    if make_url(databaseUri).database in (None, "", ":memory:"):
+        key += "/" + str(os.getpid())
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, constants.FRIEND_GRAPH_DIR_PREFIX + hashlib.sha1(key.encode("utf-8")).hexdigest()[:12])
+
+
+class Snapshot(object):
+    """A memory mapped snapshot file. Rows are views of the mapping, nothing is copied."""
+
+    def __init__(self, path):
+        with open(path, "rb") as snapshotFile:
+            self.buffer = mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.numRows, self.numIds, self.watermark = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError("Not a friend graph snapshot: " + path)
+
+        view = memoryview(self.buffer)
+        idsStart = HEADER.size + 4 * (self.numRows + 1)
+        self.offsets = view[HEADER.size:idsStart].cast("I")
+        self.ids = view[idsStart:idsStart + 4 * self.numIds].cast("i")
+
+    def getRow(self, userId):
+        if not 0 <= userId < self.numRows:
+            return ()
+        return self.ids[self.offsets[userId]:self.offsets[userId + 1]]
+
+    def contains(self, userId, friendId):
+        return isInRow(self.getRow(userId), friendId)
+
+
+def isInRow(row, friendId):
+    """Binary search of a sorted row of friend ids."""
+    index = bisect.bisect_left(row, friendId)
+    return index < len(row) and row[index] == friendId
+
+
+class GraphState(object):
+    """A snapshot and the changes read so far from its log."""
+
+    def __init__(self, generation, snapshot, logFd):
+        self.generation = generation
+        self.snapshot = snapshot
+        self.logFd = logFd
+        self.logOffset = 0
+        self.added = {} # userId -> friend ids missing from the snapshot
+        self.removed = {} # userId -> friend ids of the snapshot that are gone
+
+    def __del__(self):
+        # Other threads may still be reading through a replaced state, its log is closed once they are done
+        os.close(self.logFd)
+
+    def apply(self, operation, userId, friendId):
+        inSnapshot = self.snapshot.contains(userId, friendId)
+        if operation == ADD:
+            discard(self.removed, userId, friendId)
+            if not inSnapshot:
+                self.added.setdefault(userId, set()).add(friendId)
+        elif operation == REMOVE:
+            discard(self.added, userId, friendId)
+            if inSnapshot:
+                self.removed.setdefault(userId, set()).add(friendId)
+
+    def getRow(self, userId):
+        """The sorted friend ids of userId, a view of the snapshot unless the log changed them."""
+        row = self.snapshot.getRow(userId)
+        added = self.added.get(userId)
+        removed = self.removed.get(userId)
+        if not added and not removed:
+            return row
+        return sorted(set(row).difference(removed or ()).union(added or ()))
+
+
+def discard(overlay, userId, friendId):
+    friendIds = overlay.get(userId)
+    if friendIds is not None:
+        friendIds.discard(friendId)
+        if not friendIds:
+            overlay.pop(userId, None)
+
+
+class FriendGraph(object):
+    """The friend graph of the host as seen by this process."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.state = None
+        self.retryAt = 0.0
+
+    def load(self, engine):
+        """Maps the host's snapshot, building it first if there is none or it is out of date."""
+        os.makedirs(self.directory, exist_ok=True)
+        generation = readGeneration(self.directory)
+        if generation is None or isStale(self.directory, generation):
+            rebuild(self.directory, engine, blocking=True)
+        self.attach()
+
+    def attach(self):
+        generation = readGeneration(self.directory)
+        snapshot = Snapshot(getSnapshotPath(self.directory, generation))
+        logFd = os.open(getLogPath(self.directory, generation), os.O_RDONLY)
+        self.state = GraphState(generation, snapshot, logFd)
+        if not self.readLog(self.state):
+            self.attach()
+
+    def readLog(self, state):
+        """Applies the records appended to the log since the last read. Returns False if the snapshot was replaced."""
+        size = os.fstat(state.logFd).st_size
+        end = state.logOffset + (size - state.logOffset) // RECORD.size * RECORD.size
+        if end <= state.logOffset:
+            return True
+        data = os.pread(state.logFd, end - state.logOffset, state.logOffset)
+        state.logOffset = end
+        for operation, userId, friendId in RECORD.iter_unpack(data):
+            if operation == REPLACED:
+                return False
+            state.apply(operation, userId, friendId)
+        return True
+
+    def refresh(self):
+        """Returns the current state, with the log read up to its end."""
+        state = self.state
+        if os.fstat(state.logFd).st_size - state.logOffset < RECORD.size:
+            return state
+        with self.lock:
+            if not self.readLog(self.state):
+                self.attach()
+            return self.state
+
+    def isFriend(self, userId, friendId):
+        state = self.refresh()
+        if friendId in state.added.get(userId, ()):
+            return True
+        if friendId in state.removed.get(userId, ()):
+            return False
+        return state.snapshot.contains(userId, friendId)
+
+    def getFriendIds(self, userId):
+        return list(self.refresh().getRow(userId))
+
+    def getFriendsAmong(self, userId, otherIds):
+        row = self.refresh().getRow(userId)
+        return set(otherId for otherId in otherIds if isInRow(row, otherId))
+
+    def countFriends(self, userId):
+        return len(self.refresh().getRow(userId))
+
+    def getSecondDegreeIds(self, userId):
+        state = self.refresh()
+        friendIds = state.getRow(userId)
+        secondDegreeIds = set()
+        for friendId in friendIds:
+            secondDegreeIds.update(state.getRow(friendId))
+        secondDegreeIds.difference_update(friendIds)
+        secondDegreeIds.discard(userId)
+        return sorted(secondDegreeIds)
+
+
+def getGraph(app=None):
+    """Returns the FriendGraph of the app, mapped on first use, or None when the friendships must be read from the database."""
+    app = app or current_app
+    graph = app.extensions.get("friendGraph")
+    if graph is None or graph.state is not None:
+        return graph
+
+    with graph.lock:
+        if graph.state is None and time.monotonic() >= graph.retryAt:
+            try:
+                graph.load(db.get_engine(app))
+            except Exception as err:
+                log.error('Could not load the friend graph from %s, reading friendships from the database: %s', graph.directory, err)
+                graph.retryAt = time.monotonic() + constants.FRIEND_GRAPH_SYNC_SECONDS
+    return graph if graph.state is not None else None
+
+
+def isFriend(userId, friendId):
+    graph = getGraph()
+    if graph is None:
+        return db.session.query(Friend.id).filter(Friend.userId == userId).filter(Friend.friendId == friendId).first() is not None
+    return graph.isFriend(userId, friendId)
+
+
+def getFriendIds(userId):
+    """Returns the sorted distinct friend ids of a user."""
+    graph = getGraph()
+    if graph is None:
+        return sorted(set(friendId for (friendId,) in db.session.query(Friend.friendId).filter(Friend.userId == userId)))
+    return graph.getFriendIds(userId)
+
+
+def getFriendsAmong(userId, otherIds):
+    """Returns the set of otherIds that are friends of the user, from one lookup of the user's friends."""
+    if not otherIds:
+        return set()
+    graph = getGraph()
+    if graph is None:
+        return set(friendId for (friendId,) in db.session.query(Friend.friendId).filter(Friend.userId == userId) \
+                   .filter(Friend.friendId.in_(list(otherIds))))
+    return graph.getFriendsAmong(userId, otherIds)
+
+
+def countFriends(userId):
+    graph = getGraph()
+    if graph is None:
+        return db.session.query(func.count(Friend.friendId.distinct())).filter(Friend.userId == userId).scalar()
+    return graph.countFriends(userId)
+
+
+def getSecondDegreeIds(userId):
+    """Returns the sorted ids of the friends of the user's friends, without the user and their friends."""
+    graph = getGraph()
+    if graph is not None:
+        return graph.getSecondDegreeIds(userId)
+
+    friendIds = getFriendIds(userId)
+    if not friendIds:
+        return []
+    secondDegreeIds = set(friendId for (friendId,) in db.session.query(Friend.friendId).filter(Friend.userId.in_(friendIds)))
+    secondDegreeIds.difference_update(friendIds)
+    secondDegreeIds.discard(userId)
+    return sorted(secondDegreeIds)
+
+
+def recordAdded(rows):
+    """Logs committed Friend rows, given as (userId, friendId), for every process of the host."""
+    recordChanges(ADD, rows)
+
+
+def recordRemoved(rows):
+    recordChanges(REMOVE, rows)
+
+
+def recordChanges(operation, rows):
+    graph = current_app.extensions.get("friendGraph")
+    if graph is None:
+        return
+    try:
+        with fileLock(graph.directory, LOG_LOCK_FILE):
+            appendRecords(graph.directory, operation, rows)
+    except OSError as err:
+        log.error('Could not log friendship changes %s to the friend graph: %s', rows, err)
+
+
+def appendRecords(directory, operation, rows):
+    """Appends to the current log. Call with the log lock held."""
+    generation = readGeneration(directory)
+    if generation is None:
+        return # the first snapshot will read the rows from the database
+    data = b"".join(RECORD.pack(operation, userId, friendId) for userId, friendId in rows)
+    logFd = os.open(getLogPath(directory, generation), os.O_WRONLY | os.O_APPEND)
+    try:
+        os.write(logFd, data)
+    finally:
+        os.close(logFd)
+
+
+@contextlib.contextmanager
+def fileLock(directory, name, blocking=True):
+    """Yields whether the host wide lock name was acquired. Polls rather than blocks, so gevent workers keep running."""
+    lockFd = os.open(os.path.join(directory, name), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        while True:
+            try:
+                fcntl.flock(lockFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if not blocking:
+                    yield False
+                    return
+                time.sleep(constants.FRIEND_GRAPH_LOCK_POLL_SECONDS)
+        yield True
+    finally:
+        os.close(lockFd) # releases the lock
+
+
+def getSnapshotPath(directory, generation):
+    return os.path.join(directory, "graph-" + str(generation) + ".csr")
+
+
+def getLogPath(directory, generation):
+    return os.path.join(directory, "graph-" + str(generation) + ".log")
+
+
+def readInteger(path):
+    try:
+        with open(path) as integerFile:
+            return int(integerFile.read())
+    except (IOError, ValueError):
+        return None
+
+
+def readIntegers(path):
+    try:
+        with open(path) as integersFile:
+            return set(int(value) for value in integersFile.read().split(",") if value)
+    except (IOError, ValueError):
+        return set()
+
+
+def writeAtomically(path, data):
+    temporaryPath = path + "." + str(os.getpid()) + ".tmp"
+    with open(temporaryPath, "wb") as temporaryFile:
+        temporaryFile.write(data)
+    os.rename(temporaryPath, path)
+
+
+def readGeneration(directory):
+    return readInteger(os.path.join(directory, CURRENT_FILE))
+
+
+def isStale(directory, generation):
+    try:
+        return time.time() - os.path.getmtime(getSnapshotPath(directory, generation)) > constants.FRIEND_GRAPH_REBUILD_SECONDS
+    except OSError:
+        return True
+
+
+def countLogRecords(directory, generation):
+    try:
+        return os.path.getsize(getLogPath(directory, generation)) // RECORD.size
+    except OSError:
+        return 0
+
+
+def readWatermark(connection, table):
+    """The highest id of table and its ids within FRIEND_GRAPH_SYNC_ID_OVERLAP of it, all of them committed."""
+    watermark = connection.execute(select([func.max(table.c.id)])).scalar() or 0
+    recentIds = [rowId for (rowId,) in connection.execute(select([table.c.id]) \
+                 .where(table.c.id > watermark - constants.FRIEND_GRAPH_SYNC_ID_OVERLAP))]
+    return watermark, recentIds
+
+
+def writeWatermark(directory, watermarkFile, recentIdsFile, watermark, rowIds):
+    """Records the ids read up to now: the highest one and those the next sync reads again. Call with the log lock held."""
+    watermark = max([watermark] + list(rowIds))
+    recentIds = sorted(rowId for rowId in rowIds if rowId > watermark - constants.FRIEND_GRAPH_SYNC_ID_OVERLAP)
+    writeAtomically(os.path.join(directory, recentIdsFile), ",".join(str(rowId) for rowId in recentIds).encode("ascii"))
+    writeAtomically(os.path.join(directory, watermarkFile), str(watermark).encode("ascii"))
+
+
+def readUnseenRows(connection, table, directory, watermarkFile, recentIdsFile):
+    """
+    Returns the watermark, the ids read and the (id, userId, friendId) rows of table not read by an earlier sync or
+    snapshot: those past the watermark and those below it that committed after it was recorded.
+    """
+    watermark = readInteger(os.path.join(directory, watermarkFile)) or 0
+    recentIds = readIntegers(os.path.join(directory, recentIdsFile))
+    rows = connection.execute(select([table.c.id, table.c.userId, table.c.friendId]) \
+            .where(table.c.id > watermark - constants.FRIEND_GRAPH_SYNC_ID_OVERLAP).order_by(table.c.id)).fetchall()
+    return watermark, [row[0] for row in rows], [row for row in rows if row[0] not in recentIds]
+
+
+def writeSnapshot(connection, path):
+    """
+    Writes the Friend rows read through connection to a snapshot at path. Returns (rows, friend ids, watermark, ids
+    near the watermark), the ids being read before the rows so they are all in the snapshot.
+    """
+    watermark, recentIds = readWatermark(connection, Friend.__table__)
+    offsets = array.array("I", [0])
+    ids = array.array("i")
+    previous = None
+    rows = connection.execution_options(stream_results=True).execute(select([Friend.userId, Friend.friendId]) \
+            .where(and_(Friend.userId != None, Friend.friendId != None)).order_by(Friend.userId, Friend.friendId))
+    for row in rows:
+        userId, friendId = row
+        if (userId, friendId) == previous:
+            continue # the friendship was recorded twice
+        previous = (userId, friendId)
+        while len(offsets) <= userId:
+            offsets.append(len(ids))
+        ids.append(friendId)
+    offsets.append(len(ids))
+
+    temporaryPath = path + "." + str(os.getpid()) + ".tmp"
+    with open(temporaryPath, "wb") as snapshotFile:
+        snapshotFile.write(HEADER.pack(MAGIC, len(offsets) - 1, len(ids), watermark))
+        offsets.tofile(snapshotFile)
+        ids.tofile(snapshotFile)
+    os.rename(temporaryPath, path)
+    return len(offsets) - 1, len(ids), watermark, recentIds
+
+
+def rebuild(directory, engine, blocking=False):
+    """
+    Replaces the host's snapshot with one read from the primary. Returns False when another process holds the rebuild
+    lock and blocking is False. A blocking call that waited for another process's rebuild keeps that snapshot.
+    """
+    with fileLock(directory, REBUILD_LOCK_FILE, blocking) as acquired:
+        if not acquired:
+            return False
+
+        # Records logged from here on may predate the rows read below, they are carried over to the new log
+        with fileLock(directory, LOG_LOCK_FILE):
+            current = readGeneration(directory)
+            if blocking and current is not None and not isStale(directory, current):
+                return True
+            carryFrom = countLogRecords(directory, current) * RECORD.size if current is not None else 0
+
+        start = time.monotonic()
+        generation = (current or 0) + 1
+        with engine.connect() as connection:
+            # Read first, so removals racing with the snapshot are replayed; replaying one is harmless
+            removalWatermark, recentRemovalIds = readWatermark(connection, FriendRemoval.__table__)
+            numRows, numIds, watermark, recentIds = writeSnapshot(connection, getSnapshotPath(directory, generation))
+
+        with fileLock(directory, LOG_LOCK_FILE):
+            carried = b""
+            if current is not None:
+                with open(getLogPath(directory, current), "rb") as logFile:
+                    logFile.seek(carryFrom)
+                    carried = logFile.read()
+                carried = carried[:len(carried) // RECORD.size * RECORD.size]
+            writeAtomically(getLogPath(directory, generation), carried)
+            writeWatermark(directory, WATERMARK_FILE, RECENT_IDS_FILE, watermark, recentIds)
+            writeWatermark(directory, REMOVAL_WATERMARK_FILE, REMOVAL_RECENT_IDS_FILE, removalWatermark, recentRemovalIds)
+            writeAtomically(os.path.join(directory, CURRENT_FILE), str(generation).encode("ascii"))
+            if current is not None:
+                with open(getLogPath(directory, current), "ab") as logFile:
+                    logFile.write(RECORD.pack(REPLACED, 0, 0))
+
+    # Processes still on an older snapshot keep their mapping after the files are gone
+    for old in range(1, generation - 1):
+        for path in (getSnapshotPath(directory, old), getLogPath(directory, old)):
+            if os.path.exists(path):
+                os.remove(path)
+    log.info('Friend graph snapshot %s: %s users, %s friend ids read in %ss', generation, numRows, numIds, \
+             round(time.monotonic() - start, 3))
+    return True
+
+
+def syncNewFriendships(directory, engine):
+    """Logs the Friend rows added and removed through other hosts since the last sync. Returns the number of rows logged."""
+    with fileLock(directory, REBUILD_LOCK_FILE, blocking=False) as acquired:
+        if not acquired:
+            return 0
+        # Held across the reads so a removal committed after them is logged after the row it removes
+        with fileLock(directory, LOG_LOCK_FILE):
+            with engine.connect() as connection:
+                watermark, rowIds, rows = readUnseenRows(connection, Friend.__table__, directory, WATERMARK_FILE, RECENT_IDS_FILE)
+                removalWatermark, removalIds, removals = readUnseenRows(connection, FriendRemoval.__table__, directory, \
+                                                                        REMOVAL_WATERMARK_FILE, REMOVAL_RECENT_IDS_FILE)
+                removed = getRemovedPairs(connection, removals)
+
+            if rows:
+                appendRecords(directory, ADD, [(userId, friendId) for rowId, userId, friendId in rows \
+                                               if userId is not None and friendId is not None])
+                writeWatermark(directory, WATERMARK_FILE, RECENT_IDS_FILE, watermark, rowIds)
+            if removals:
+                appendRecords(directory, REMOVE, removed)
+                writeWatermark(directory, REMOVAL_WATERMARK_FILE, REMOVAL_RECENT_IDS_FILE, removalWatermark, removalIds)
+    return len(rows) + len(removals)
+
+
+def getRemovedPairs(connection, removals, batchSize=500):
+    """The (userId, friendId) of removals that are still gone: a friendship may have been made again since."""
+    pairs = sorted(set((userId, friendId) for rowId, userId, friendId in removals if userId is not None and friendId is not None))
+    existing = set()
+    for start in range(0, len(pairs), batchSize):
+        batch = pairs[start:start + batchSize]
+        existing.update(tuple(row) for row in connection.execute(select([Friend.userId, Friend.friendId]) \
+                        .where(tuple_(Friend.userId, Friend.friendId).in_(batch))))
+    return [pair for pair in pairs if pair not in existing]
+
+
+def pruneRemovals(engine):
+    """Deletes the FriendRemoval rows every host has had FRIEND_REMOVAL_RETENTION_SECONDS to pick up."""
+    cutoff = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA)) \
+                - datetime.timedelta(seconds=constants.FRIEND_REMOVAL_RETENTION_SECONDS)
+    with engine.begin() as connection:
+        return connection.execute(FriendRemoval.__table__.delete().where(FriendRemoval.removedOn < cutoff)).rowcount
+
+
+def maintain(app):
+    """Rebuilds the snapshot when it is due, otherwise picks up the changes made through other hosts."""
+    graph = app.extensions.get("friendGraph")
+    if graph is None or not os.path.isdir(graph.directory):
+        return
+    engine = db.get_engine(app)
+    generation = readGeneration(graph.directory)
+    if generation is None:
+        return # nothing mapped it yet
+    if isStale(graph.directory, generation) or countLogRecords(graph.directory, generation) > constants.FRIEND_GRAPH_MAX_LOG_RECORDS:
+        if rebuild(graph.directory, engine):
+            pruneRemovals(engine)
+    else:
+        syncNewFriendships(graph.directory, engine)
+
+
+def runWorker(app, interval):
+    while True:
+        try:
+            with app.app_context():
+                maintain(app)
+        except Exception as err:
+            log.error('Friend graph maintenance failed: %s', err)
+        time.sleep(interval)
+
+
+def startWorker(app, interval=constants.FRIEND_GRAPH_SYNC_SECONDS):
+    """Starts the friend graph maintenance of this process once."""
+    global _worker
+    with _workerLock:
+        if _worker is None:
+            _worker = threading.Thread(target=runWorker, args=(app, interval), name="friend-graph")
+            _worker.daemon = True
+            _worker.start()
+    return _worker
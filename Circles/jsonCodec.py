@@ -0,0 +1,113 @@
+import itertools
+from flask import current_app, stream_with_context
+from flask.json import JSONEncoder
+from Circles import constants, logs
+from Circles.models import db
+
+try:
+    import orjson
+except ImportError: # deployments without it keep the standard library encoder
+    orjson = None
+
+# JSON encoding of the API responses. The backend is picked with the JSON_BACKEND config key and plugged into
+# Flask as the app's json_encoder, so every jsonify() uses it. Pages of list endpoints go through listResponse().
+# Unpaged lists go through streamResponse(), which reads the rows from the query and encodes them a batch at a time
+# while the response is written, instead of holding the rows, the list of dicts and the whole document in memory.
+
+log = logs.getLogger(__name__)
+
+ORJSON = "orjson"
+STDLIB = "stdlib"
+
+
+def init_app(app):
+    app.config.setdefault("JSON_BACKEND", ORJSON if orjson is not None else STDLIB)
+    if app.config["JSON_BACKEND"] == ORJSON and orjson is None:
+        log.warning('orjson is not installed, encoding JSON with the standard library')
+        app.config["JSON_BACKEND"] = STDLIB
+    if app.config["JSON_BACKEND"] == ORJSON:
+        app.json_encoder = OrjsonEncoder
+
+
+class OrjsonEncoder(JSONEncoder):
+    """Flask's encoder with orjson doing the work. Types orjson does not know, and dates, go through default()."""
+
+    def encode(self, o):
+        # Pretty printing is left to the standard library; it is only used when debugging
+        if self.indent is not None:
+            return JSONEncoder.encode(self, o)
+        return orjson.dumps(o, default=self.default, option=getOrjsonOption(self.sort_keys)).decode("utf-8")
+
+
+def getOrjsonOption(sortKeys):
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if sortKeys:
+        option |= orjson.OPT_SORT_KEYS
+    return option
+
+
+def getEncoder():
+    """Returns a function encoding a value to compact JSON bytes with the backend and settings of the current app."""
+    sortKeys = current_app.config["JSON_SORT_KEYS"]
+    if current_app.json_encoder is OrjsonEncoder:
+        default = OrjsonEncoder().default
+        option = getOrjsonOption(sortKeys)
+        return lambda o: orjson.dumps(o, default=default, option=option)
+
+    encoder = current_app.json_encoder(sort_keys=sortKeys, ensure_ascii=current_app.config["JSON_AS_ASCII"], separators=(",", ":"))
+    return lambda o: encoder.encode(o).encode("utf-8")
+
+
+def jsonResponse(o):
+    """Like jsonify(o), minus the copy of the document jsonify makes when it appends its newline."""
+    return current_app.response_class(getEncoder()(o) + b"\n", mimetype=current_app.config["JSONIFY_MIMETYPE"])
+
+
+def listResponse(fields, key, rows, render):
+    """
+    Returns the JSON object of fields plus key, listing render(row) for each of rows. Rows should already be loaded
+    and the session closed, so no connection is held while a slow client reads the response.
+    """
+    document = dict(fields)
+    document[key] = [render(row) for row in rows]
+    return jsonResponse(document)
+
+
+def openQuery(query):
+    """
+    Runs query and returns an iterator over its rows, fetched JSON_STREAM_BATCH_ITEMS at a time, or None when it has
+    no rows. Errors of the query are raised here, before a streamed response has started.
+    """
+    rows = iter(query.yield_per(constants.JSON_STREAM_BATCH_ITEMS))
+    first = next(rows, None)
+    if first is None:
+        return None
+    return itertools.chain([first], rows)
+
+
+def streamResponse(key, rows, render):
+    """
+    Returns the JSON object listing render(row) under key for each of the rows from openQuery(), followed by their
+    count. Rows are read and encoded a batch at a time while the response is written, so the memory of the response
+    does not grow with the list. The session holds its connection until the client has read the response.
+    """
+    return current_app.response_class(stream_with_context(streamObject(key, rows, render)), \
+                                      mimetype=current_app.config["JSONIFY_MIMETYPE"])
+
+
+def streamObject(key, rows, render):
+    """Yields the encoded object a batch of JSON_STREAM_BATCH_ITEMS rows at a time."""
+    encode = getEncoder()
+    yield b"{" + encode(key) + b":["
+
+    count = 0
+    try:
+        while True:
+            batch = [render(row) for row in itertools.islice(rows, constants.JSON_STREAM_BATCH_ITEMS)]
+            if not batch:
+                break
+            yield (b"," if count else b"") + encode(batch)[1:-1] # the items without the brackets of the batch's own array
+            count += len(batch)
+    finally:
+        db.session.close()
+    yield b"]," + encode("count") + b":" + encode(count) + b"}\n"
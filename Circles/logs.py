@@ -0,0 +1,141 @@
+import atexit, json, logging, queue, random, sys, threading, uuid
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+from Circles import constants, metrics
+
+# Request threads only put records on an in-memory queue; one background thread per process formats them as JSON
+# lines and writes them to stdout. Records carry the id of the request that logged them, and the noisy messages
+# listed in LOG_SAMPLE_RATES are sampled before they reach the queue.
+
+ROOT_LOGGER = "Circles"
+
+_listener = None
+_listenerLock = threading.Lock()
+
+
+def getLogger(name):
+    return logging.getLogger(name)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the writer falls behind, records are dropped and counted."""
+
+    def prepare(self, record):
+        # Render on the calling thread; the arguments may be objects that must not be touched from another thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue has no bound, so the size is checked here; an occasional overshoot under races is harmless
+        if self.queue.qsize() >= constants.LOG_QUEUE_SIZE:
+            metrics.recordDroppedLog(record.levelname)
+            return
+        self.queue.put(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records of a (logger name, message format) pair, given by LOG_SAMPLE_RATES; every other
+    record is kept.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        # Filters run before prepare() renders the message, so record.msg is still the format string
+        rate = self.rates.get((record.name, record.msg))
+        if rate is None:
+            return True
+        record.sampleRate = rate
+        return random.random() < rate
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.requestId = g.get("requestId") if has_request_context() else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name, \
+                 "message": record.getMessage()}
+        requestId = getattr(record, "requestId", None)
+        if requestId:
+            entry["requestId"] = requestId
+        sampleRate = getattr(record, "sampleRate", None)
+        if sampleRate is not None:
+            entry["sampleRate"] = sampleRate
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def init_app(app):
+    """Routes the Circles loggers through the queue and tags every request with an id."""
+    startListener()
+    app.before_request(assignRequestId)
+    app.after_request(addRequestIdHeader)
+
+
+def startListener(stream=None):
+    """Configures the Circles loggers and starts the writer thread of this process once."""
+    global _listener
+    with _listenerLock:
+        if _listener is not None:
+            return _listener
+
+        logQueue = queue.SimpleQueue()
+        handler = DroppingQueueHandler(logQueue)
+        handler.addFilter(SamplingFilter(constants.LOG_SAMPLE_RATES))
+        handler.addFilter(RequestIdFilter())
+
+        streamHandler = logging.StreamHandler(stream or sys.stdout)
+        streamHandler.setFormatter(JsonFormatter())
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(constants.LOG_LEVEL)
+        logger.handlers = [handler]
+        logger.propagate = False
+
+        _listener = QueueListener(logQueue, streamHandler)
+        _listener.start()
+        atexit.register(stopListener)
+        return _listener
+
+
+def stopListener():
+    """Writes out the queued records and stops the writer thread."""
+    global _listener
+    with _listenerLock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def restartListener():
+    """Starts a writer thread in a forked process; the one of the parent is not running there."""
+    global _listener
+    with _listenerLock:
+        _listener = None # stopping it would wait on a thread that does not exist in this process
+    return startListener()
+
+
+def assignRequestId():
+    requestId = request.headers.get(constants.REQUEST_ID_HEADER, "")[:constants.REQUEST_ID_MAX_LENGTH]
+    g.requestId = requestId or uuid.uuid4().hex
+
+
+def addRequestIdHeader(response):
+    if "requestId" in g:
+        response.headers[constants.REQUEST_ID_HEADER] = g.requestId
+    return response
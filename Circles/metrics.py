@@ -0,0 +1,211 @@
+import hmac, ipaddress, os, time
+from flask import Response, current_app, g, has_app_context, request
+from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from sqlalchemy import event, exc
+from Circles import constants
+
+# Prometheus metrics of this process. With several worker processes, point the prometheus_multiproc_dir environment
+# variable at an empty local directory before the app starts: every worker then writes its samples there and
+# /metrics aggregates all of them, whichever worker serves the scrape.
+#
+# The app is public, so scrapes are only answered for a client sending "Authorization: Bearer <METRICS_TOKEN>" or
+# connecting directly from METRICS_ALLOWED_NETWORKS (loopback by default). Requests relayed by a proxy carry
+# X-Forwarded-For and always need the token, since the proxy itself connects from loopback. Both settings are read
+# from the environment variables of the same name.
+
+METRICS_PATH = "/metrics"
+MULTIPROCESS_DIRECTORY_ENV = "prometheus_multiproc_dir"
+UNMATCHED_ROUTE = "unmatched"
+DEFAULT_ALLOWED_NETWORKS = "127.0.0.1/32,::1/128"
+
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64, 128)
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5)
+
+REQUEST_SECONDS = Histogram("circles_http_request_duration_seconds", "Latency of API requests.", ["method", "route", "status"])
+REQUEST_QUERIES = Histogram("circles_http_request_queries", "SQL statements executed per API request.", ["route"], \
+                            buckets=QUERY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("circles_http_request_db_seconds", "Time spent executing SQL per API request.", ["route"], \
+                               buckets=FAST_BUCKETS)
+POOL_CHECKOUT_SECONDS = Histogram("circles_db_pool_checkout_seconds", "Time waited to check a connection out of the pool.", \
+                                  buckets=FAST_BUCKETS)
+NOTIFICATION_SECONDS = Histogram("circles_notification_send_seconds", "Latency of FCM sends.", ["kind", "outcome"])
+SMS_SECONDS = Histogram("circles_sms_send_seconds", "Latency of Twilio SMS sends.", ["kind", "outcome"])
+POOL_CHECKED_OUT = Gauge("circles_db_pool_checked_out", "Connections currently checked out of the pool.", ["pool"], \
+                         multiprocess_mode="livesum")
+POOL_TIMEOUTS = Counter("circles_db_pool_timeouts_total", "Checkouts that gave up because the pool was exhausted.")
+CONNECTION_LEAKS = Counter("circles_db_connection_leaks_total", "Connections still checked out after their request ended.", \
+                           ["route"])
+READ_ROUTES = Counter("circles_db_read_route_total", "Read-only handlers served from the primary or a replica.", ["target"])
+CONDITIONAL_REQUESTS = Counter("circles_http_conditional_requests_total", "Requests to ETag routes by whether the client's " \
+                               "copy was current (hit), out of date (miss) or absent (unconditional).", ["route", "result"])
+EXPIRED_ACCESS_REQUESTS = Counter("circles_access_requests_expired_total", "Unaccepted access requests marked as expired " \
+                                  "by the expiry sweeper.")
+EXPIRY_SWEEP_SECONDS = Histogram("circles_access_request_expiry_sweep_seconds", "Duration of access request expiry sweeps.")
+LOGS_DROPPED = Counter("circles_log_records_dropped_total", "Log records dropped because the log writer fell behind.", ["level"])
+
+
+def init_app(app, db):
+    """Times every request, counts its SQL and serves the metrics on METRICS_PATH."""
+    app.config.setdefault("METRICS_TOKEN", os.environ.get("METRICS_TOKEN"))
+    app.config.setdefault("METRICS_ALLOWED_NETWORKS", [ipaddress.ip_network(network.strip(), strict=False) for network in \
+                          os.environ.get("METRICS_ALLOWED_NETWORKS", DEFAULT_ALLOWED_NETWORKS).split(",") if network.strip()])
+    with app.app_context():
+        instrumentEngine(db.engine)
+
+    app.before_request(startRequest)
+    app.after_request(recordResponseStatus)
+    app.teardown_request(finishRequest)
+    app.add_url_rule(METRICS_PATH, "metrics", getMetrics, methods=["GET"])
+
+
+def instrumentEngine(engine):
+    """Counts statements and their time into the current request, and times pool checkouts, for one engine."""
+    if event.contains(engine, "before_cursor_execute", beforeCursorExecute):
+        return
+
+    event.listen(engine, "before_cursor_execute", beforeCursorExecute)
+    event.listen(engine, "after_cursor_execute", afterCursorExecute)
+    event.listen(engine, "handle_error", handleError)
+    # dispose() replaces the pool, e.g. before gunicorn forks the workers, and the new one is timed again
+    event.listen(engine, "engine_disposed", timePoolCheckouts)
+    timePoolCheckouts(engine)
+
+
+def timePoolCheckouts(engine):
+    # The pool has no event for the start of a checkout, so the time is taken around its connect
+    pool = engine.pool
+    connect = pool.connect
+    def timedConnect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+    pool.connect = timedConnect
+
+
+def beforeCursorExecute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("queryStartTimes", []).append(time.perf_counter())
+
+
+def afterCursorExecute(conn, cursor, statement, parameters, context, executemany):
+    recordQuery(conn)
+
+
+def handleError(context):
+    if context.connection is not None:
+        recordQuery(context.connection)
+
+
+def recordQuery(conn):
+    startTimes = conn.info.get("queryStartTimes")
+    if not startTimes:
+        return
+
+    elapsed = time.perf_counter() - startTimes.pop()
+    # Statements from background workers run outside of a request and are not attributed to one
+    if has_app_context() and "sqlQueries" in g:
+        g.sqlQueries += 1
+        g.sqlSeconds += elapsed
+
+
+def getRequestStats():
+    """Returns (SQL statements, seconds spent in SQL) of the current request so far."""
+    if "sqlQueries" not in g:
+        return 0, 0.0
+    return g.sqlQueries, g.sqlSeconds
+
+
+def startRequest():
+    if request.path == METRICS_PATH:
+        return
+    g.requestStart = time.perf_counter()
+    g.sqlQueries = 0
+    g.sqlSeconds = 0.0
+
+
+def recordResponseStatus(response):
+    g.responseStatus = response.status_code
+    return response
+
+
+def finishRequest(exception=None):
+    if "requestStart" not in g:
+        return
+
+    route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+    status = g.get("responseStatus", 500)
+    REQUEST_SECONDS.labels(request.method, route, str(status)).observe(time.perf_counter() - g.requestStart)
+    REQUEST_QUERIES.labels(route).observe(g.sqlQueries)
+    REQUEST_DB_SECONDS.labels(route).observe(g.sqlSeconds)
+
+
+def recordNotification(kind, seconds, sent):
+    NOTIFICATION_SECONDS.labels(kind, "sent" if sent else "failed").observe(seconds)
+
+
+def recordSMS(kind, seconds, sent):
+    SMS_SECONDS.labels(kind, "sent" if sent else "failed").observe(seconds)
+
+
+def recordPoolUsage(pool, checkedOut):
+    POOL_CHECKED_OUT.labels(pool).set(checkedOut)
+
+
+def recordConnectionLeak(route):
+    CONNECTION_LEAKS.labels(route).inc()
+
+
+def recordReadRoute(target):
+    READ_ROUTES.labels(target).inc()
+
+
+def recordConditionalRequest(route, result):
+    CONDITIONAL_REQUESTS.labels(route, result).inc()
+
+
+def recordExpirySweep(rows, seconds):
+    EXPIRED_ACCESS_REQUESTS.inc(rows)
+    EXPIRY_SWEEP_SECONDS.observe(seconds)
+
+
+def recordDroppedLog(level):
+    LOGS_DROPPED.labels(level).inc()
+
+
+def getRegistry():
+    if MULTIPROCESS_DIRECTORY_ENV not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def isScrapeAllowed():
+    token = current_app.config["METRICS_TOKEN"]
+    authorization = request.headers.get("Authorization", "")
+    if token and authorization.startswith("Bearer ") and hmac.compare_digest(authorization[len("Bearer "):], token):
+        return True
+
+    if "X-Forwarded-For" in request.headers:
+        return False
+    try:
+        address = ipaddress.ip_address(request.remote_addr or "")
+    except ValueError:
+        return False
+    return any(address in network for network in current_app.config["METRICS_ALLOWED_NETWORKS"])
+
+
+def getMetrics():
+    if not isScrapeAllowed():
+        return "", constants.STATUS_UNAUTHORIZED
+    return Response(generate_latest(getRegistry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def markProcessDead(pid):
+    """Drops the live samples of an exited worker process. Call it from the server's worker exit hook."""
+    if MULTIPROCESS_DIRECTORY_ENV in os.environ:
+        multiprocess.mark_process_dead(pid)
@@ -2,9 +2,15 @@ from itsdangerous import (TimedJSONWebSignatureSerializer as Serializer, Signatu
 from sqlalchemy.dialects.postgresql import ARRAY
 from flask import abort
 from flask_sqlalchemy import SQLAlchemy
-from Circles import constants
+from Circles import constants, logs, replicas
 
-db = SQLAlchemy()
+log = logs.getLogger(__name__)
+
+db = replicas.RoutingSQLAlchemy()
+
+# Arrays are stored as JSON on SQLite so the schema can be created locally for benchmarks
+IntArray = ARRAY(db.Integer()).with_variant(db.JSON(), "sqlite")
+StringArray = ARRAY(db.String()).with_variant(db.JSON(), "sqlite")
 
 class Card(db.Model):
     __tablename__ = "card"
@@ -14,7 +20,7 @@ class Card(db.Model):
     objectType = db.Column(db.String(), unique=False)
     rewards = db.Column(db.Numeric(), unique=False)
     minAmount = db.Column(db.Numeric(), unique=False)
-    users = db.Column(ARRAY(db.String()), unique=False)
+    users = db.Column(StringArray, unique=False) # deprecated, card holders live in UserCard
 
 class User(db.Model):
     __tablename__ = "user"
@@ -26,11 +32,12 @@ class User(db.Model):
     password = db.Column(db.Unicode(200), unique=False)
     fcmToken = db.Column(db.String(), unique=False)
     upiID = db.Column(db.String(100), unique=False)
-    cards = db.Column(ARRAY(db.Integer()), unique=False)
+    cards = db.Column(IntArray, unique=False) # denormalized copy of the user's UserCard rows
     suspended = db.Column(db.Boolean(), unique=False)
     joined = db.Column(db.String(), unique=False)
     friends = db.relationship("Friend", backref="user", lazy=True, foreign_keys = 'Friend.userId')
     profileImgUrl = db.Column(db.String(), unique=False)
+    profileVersion = db.Column(db.Integer(), nullable=False, default=0, server_default="0") # part of the profile ETag
     posts = db.relationship("Post", backref="creator", order_by="desc(Post.createdOn)", lazy=True, foreign_keys='Post.creatorId')
     fRequests_rec = db.relationship("FriendRequest", backref="recipient", order_by="desc(FriendRequest.createdOn)", lazy=True, cascade="all, delete, delete-orphan", foreign_keys = 'FriendRequest.toUserId')
     fRequests_sent = db.relationship("FriendRequest", backref="sender", order_by="desc(FriendRequest.createdOn)", lazy=True, cascade="all, delete, delete-orphan", foreign_keys = 'FriendRequest.fromUserId')
@@ -41,6 +48,11 @@ class User(db.Model):
         s = Serializer(key, expiration)
         return s.dumps({'id': self.id})
 
+    def bumpProfileVersion(self):
+        """Marks the profile as changed; call it with any update of the fields /user/profile returns."""
+        # Incremented in SQL so concurrent updates each get their own version
+        self.profileVersion = db.func.coalesce(User.profileVersion, 0) + 1
+
     @property
     def is_active(self):
         return not self.suspended
@@ -51,16 +63,23 @@ class User(db.Model):
         try:
             data = s.loads(token)
         except SignatureExpired:
-            print("ERROR: The token has expired.")
+            log.error('The token has expired.')
             abort(constants.STATUS_GONE)
             return None  # valid token, but expired
         except BadSignature:
-            print("ERROR: The token is invalid")
+            log.error('The token is invalid')
             return None  # invalid token
         user = User.query.get(data['id'])
         return user
 
 
+class UserCard(db.Model):
+    __tablename__ = "UserCard"
+    __table_args__ = (db.Index("ix_user_card_card", "cardId", "userId"),)
+    userId = db.Column(db.Integer(), db.ForeignKey('user.id'), primary_key=True)
+    cardId = db.Column(db.Integer(), primary_key=True)
+
+
 class AuthCodeVerification(db.Model):
     __tablename__ = "AuthCodeVerification"
     phoneNumber = db.Column(db.String(), primary_key=True)
@@ -70,16 +89,25 @@ class AuthCodeVerification(db.Model):
 
 class FriendRequest(db.Model):
     __tablename__ = "FriendRequest"
+    __table_args__ = (db.Index("ix_friend_request_to_created", "toUserId", "createdOn", "id"),
+                      db.Index("ix_friend_request_from_created", "fromUserId", "createdOn", "id"))
     id = db.Column(db.Integer(), primary_key=True)
     fromUserId = db.Column(db.Integer(), db.ForeignKey('user.id'))
     toUserId = db.Column(db.Integer(), db.ForeignKey('user.id'))
+    pairKey = db.Column(db.String(), unique=True) # same for both directions, see getPairKey
     createdOn = db.Column(db.DateTime(timezone=True))
     resolvedOn = db.Column(db.DateTime(timezone=True))
     status = db.Column(db.Integer())
 
+    @staticmethod
+    def getPairKey(firstUserId, secondUserId):
+        firstUserId, secondUserId = sorted((int(firstUserId), int(secondUserId)))
+        return str(firstUserId) + ":" + str(secondUserId)
+
 
 class Friend(db.Model):
     __tablename__ = "Friend"
+    __table_args__ = (db.Index("ix_friend_user_friend", "userId", "friendId"),)
     id = db.Column(db.Integer(), primary_key=True)
     userId = db.Column(db.Integer(), db.ForeignKey('user.id'))
     friendId = db.Column(db.Integer(), db.ForeignKey('user.id'))
@@ -87,8 +115,32 @@ class Friend(db.Model):
     startedOn = db.Column(db.DateTime(timezone=True))
 
 
+class FriendRemoval(db.Model):
+    """A removed friendship, kept for a while so every host can drop it from its friend graph."""
+    __tablename__ = "FriendRemoval"
+    __table_args__ = (db.Index("ix_friend_removal_removed", "removedOn"),)
+    id = db.Column(db.Integer(), primary_key=True)
+    userId = db.Column(db.Integer())
+    friendId = db.Column(db.Integer())
+    removedOn = db.Column(db.DateTime(timezone=True))
+
+
+class LastWrite(db.Model):
+    """When a user last wrote, so the user's reads stay on the primary whichever worker or host serves them."""
+    __tablename__ = "LastWrite"
+    userId = db.Column(db.Integer(), primary_key=True)
+    writtenAt = db.Column(db.Float()) # seconds since the epoch, compared by the reading host
+
+
 class AccessRequest(db.Model):
     __tablename__ = "AccessRequest"
+    __table_args__ = (db.Index("ix_access_request_to_created", "toUserId", "createdOn", "id"),
+                      db.Index("ix_access_request_from_created", "fromUserId", "createdOn", "id"),
+                      # partial indexes over requests that have not expired yet
+                      db.Index("ix_access_request_live_created", "createdOn", \
+                               postgresql_where=db.text('"status" = ' + str(constants.ACCESS_REQUEST_UNACCEPTED))),
+                      db.Index("ix_access_request_live_to", "toUserId", "createdOn", "id", \
+                               postgresql_where=db.text('"status" = ' + str(constants.ACCESS_REQUEST_UNACCEPTED))))
     id = db.Column(db.Integer(), primary_key=True)
     fromUserId = db.Column(db.Integer(), db.ForeignKey('user.id'))
     toUserId = db.Column(db.Integer(), db.ForeignKey('user.id'))
@@ -103,7 +155,25 @@ class AccessRequest(db.Model):
 
 class Post(db.Model):
     __tablename__ = "Post"
+    __table_args__ = (db.Index("ix_post_creator_created", "creatorId", "createdOn", "id"),)
     id = db.Column(db.Integer(), primary_key =True)
     text = db.Column(db.String())
     creatorId = db.Column(db.Integer(), db.ForeignKey('user.id')) 
-    createdOn = db.Column(db.DateTime(timezone=True)) 
\ No newline at end of file
+    createdOn = db.Column(db.DateTime(timezone=True))
+
+
+class NotificationOutbox(db.Model):
+    __tablename__ = "NotificationOutbox"
+    __table_args__ = (db.Index("ix_outbox_due", "status", "nextAttemptOn"),)
+    id = db.Column(db.Integer(), primary_key=True)
+    fcmToken = db.Column(db.String())
+    title = db.Column(db.String())
+    body = db.Column(db.String())
+    imageUrl = db.Column(db.String())
+    data = db.Column(db.Text()) # json encoded notification data
+    status = db.Column(db.Integer())
+    attempts = db.Column(db.Integer())
+    lastError = db.Column(db.String())
+    createdOn = db.Column(db.DateTime(timezone=True))
+    nextAttemptOn = db.Column(db.DateTime(timezone=True))
+    sentOn = db.Column(db.DateTime(timezone=True))
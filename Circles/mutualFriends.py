@@ -0,0 +1,70 @@
+import collections
+from sqlalchemy.orm import aliased
+from Circles import logs
+from Circles.models import db, Friend, User
+
+# Mutual friends of two users: the intersection of their Friend rows, computed by the database in one query over
+# the (userId, friendId) index. They are ranked by how long the mutual friend has known both users, the later of
+# the two friendships being the one that counts, so the strongest introduction comes first. This is the source of
+# truth for the mutual friend named in second degree access requests and in the cardholder search.
+
+log = logs.getLogger(__name__)
+
+MutualFriend = collections.namedtuple("MutualFriend", ["id", "name", "profileImgUrl"])
+
+
+def getRankKey(mutualId, startedOn, otherStartedOn):
+    """Sort key of a mutual friend given when it befriended each user: oldest first, unknown dates last."""
+    if startedOn is None or otherStartedOn is None:
+        return (True, None, mutualId)
+    return (False, max(startedOn, otherStartedOn), mutualId)
+
+
+def getMutualFriends(userId, otherId):
+    """Returns the ranked MutualFriends of two users, in one query."""
+    mine = aliased(Friend)
+    theirs = aliased(Friend)
+    rows = db.session.query(User.id, User.name, User.profileImgUrl, mine.startedOn, theirs.startedOn) \
+            .join(mine, mine.friendId == User.id) \
+            .join(theirs, theirs.friendId == User.id) \
+            .filter(mine.userId == userId) \
+            .filter(theirs.userId == otherId) \
+            .filter(User.id != userId, User.id != otherId)
+
+    # A friendship may have been recorded more than once, the oldest rows rank it
+    ranked = {}
+    for mutualId, name, profileImgUrl, startedOn, otherStartedOn in rows:
+        key = getRankKey(mutualId, startedOn, otherStartedOn)
+        if mutualId not in ranked or key < ranked[mutualId][0]:
+            ranked[mutualId] = (key, MutualFriend(mutualId, name, profileImgUrl))
+
+    return [mutualFriend for key, mutualFriend in sorted(ranked.values(), key=lambda entry: entry[0])]
+
+
+def getBestMutualFriends(userId, otherIds):
+    """
+    Returns a dict of each of otherIds with a mutual friend with userId to (the id of its best ranked mutual friend,
+    its number of mutual friends), in one query.
+    """
+    if not otherIds:
+        return {}
+
+    mine = aliased(Friend)
+    theirs = aliased(Friend)
+    rows = db.session.query(theirs.friendId, mine.friendId, mine.startedOn, theirs.startedOn) \
+            .select_from(mine) \
+            .join(theirs, theirs.userId == mine.friendId) \
+            .filter(mine.userId == userId) \
+            .filter(theirs.friendId.in_(otherIds))
+
+    best = {}
+    mutualIds = {}
+    for otherId, mutualId, startedOn, otherStartedOn in rows:
+        if mutualId == otherId:
+            continue
+        key = getRankKey(mutualId, startedOn, otherStartedOn)
+        if otherId not in best or key < best[otherId]:
+            best[otherId] = key
+        mutualIds.setdefault(otherId, set()).add(mutualId)
+
+    return {otherId: (key[-1], len(mutualIds[otherId])) for otherId, key in best.items()}
@@ -0,0 +1,197 @@
+import collections, datetime, json, pytz, threading, time
+from firebase_admin import messaging
+from Circles import constants, logs, utils
+from Circles.models import db, NotificationOutbox
+
+log = logs.getLogger(__name__)
+
+# Notifications are written to the outbox in the same transaction as the row they are about and a background
+# worker delivers them, so request latency does not depend on FCM and nothing is lost on a worker recycle.
+# A worker claims a batch by leasing it, pushing nextAttemptOn past the sends, and commits before calling FCM so
+# no row lock is held while it waits. Rows of a worker that dies mid-send are picked up again once the lease ends.
+# The attempt is counted in that same commit, so a row that kills its worker every time is still given up on.
+
+ClaimedNotification = collections.namedtuple("ClaimedNotification", ["id", "fcmToken", "title", "body", "imageUrl", "data"])
+
+_wakeup = threading.Event()
+_worker = None
+_workerLock = threading.Lock()
+
+
+def enqueueNotification(fcmToken, notification, data):
+    """Adds a notification to the current session. It is delivered once the session commits."""
+    if not fcmToken:
+        return None
+
+    now = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+    row = NotificationOutbox(fcmToken=fcmToken, title=notification.title, body=notification.body, \
+                             imageUrl=getattr(notification, "image", None), data=json.dumps(data, sort_keys=True), \
+                             status=constants.OUTBOX_PENDING, attempts=0, createdOn=now, nextAttemptOn=now)
+    db.session.add(row)
+    return row
+
+
+def enqueueNotifications(fcmTokens, notification, data):
+    """Adds the same notification for many tokens with a single multi-row insert on the current connection."""
+    now = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+    payload = json.dumps(data, sort_keys=True)
+    rows = [{"fcmToken": fcmToken, "title": notification.title, "body": notification.body, \
+             "imageUrl": getattr(notification, "image", None), "data": payload, "status": constants.OUTBOX_PENDING, \
+             "attempts": 0, "createdOn": now, "nextAttemptOn": now} for fcmToken in fcmTokens if fcmToken]
+    if rows:
+        db.session.execute(NotificationOutbox.__table__.insert(), rows)
+    return len(rows)
+
+
+def wake():
+    """Lets the worker of this process pick up freshly committed notifications without waiting for its poll."""
+    _wakeup.set()
+
+
+def getBackoffSeconds(attempts):
+    return min(constants.OUTBOX_BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), constants.OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+def markFailed(row, now, error):
+    """Backs off a failed send. Its attempt was already counted when the row was claimed."""
+    row.lastError = error
+    if row.attempts >= constants.OUTBOX_MAX_ATTEMPTS:
+        log.error('Giving up on notification: %s after %s attempts: %s', row.id, row.attempts, error)
+        row.status = constants.OUTBOX_DEAD
+    else:
+        row.nextAttemptOn = now + datetime.timedelta(seconds=getBackoffSeconds(row.attempts))
+
+
+def claimDueNotifications(now, batchSize):
+    """
+    Leases a batch of due notifications to this worker, counting the attempt, and returns them. Rows locked by
+    another worker are skipped and rows whose every attempt was left unfinished are given up on.
+    """
+    leaseUntil = now + datetime.timedelta(seconds=constants.OUTBOX_LEASE_SECONDS)
+    rows = NotificationOutbox.query.filter(NotificationOutbox.status == constants.OUTBOX_PENDING) \
+            .filter(NotificationOutbox.nextAttemptOn <= now) \
+            .order_by(NotificationOutbox.nextAttemptOn, NotificationOutbox.id) \
+            .limit(batchSize).with_for_update(skip_locked=True).all()
+    claimed = []
+    for row in rows:
+        if (row.attempts or 0) >= constants.OUTBOX_MAX_ATTEMPTS:
+            # Every lease of this row ended without a result, e.g. its send crashed the worker each time
+            log.error('Giving up on notification: %s after %s unfinished attempts', row.id, row.attempts)
+            row.status = constants.OUTBOX_DEAD
+            row.lastError = row.lastError or "Lease expired"
+            continue
+        row.attempts = (row.attempts or 0) + 1
+        row.nextAttemptOn = leaseUntil
+        claimed.append(ClaimedNotification(row.id, row.fcmToken, row.title, row.body, row.imageUrl, row.data))
+    db.session.commit()
+    return claimed
+
+
+def sendNotifications(claimed, sender):
+    """Sends the claimed notifications, identical ones together, and returns a dict of id -> error, None once sent."""
+    groups = collections.OrderedDict()
+    for notification in claimed:
+        groups.setdefault((notification.title, notification.body, notification.imageUrl, notification.data), []).append(notification)
+
+    errors = {}
+    for (title, body, imageUrl, data), group in groups.items():
+        error = "Send failed"
+        try:
+            results = sender([notification.fcmToken for notification in group], messaging.Notification(title, body, imageUrl), \
+                             json.loads(data))
+        except Exception as err:
+            results = {}
+            error = str(err)
+
+        for notification in group:
+            errors[notification.id] = None if results.get(notification.fcmToken) else error
+    return errors
+
+
+def recordResults(errors):
+    now = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+    for row in NotificationOutbox.query.filter(NotificationOutbox.id.in_(list(errors))):
+        if errors[row.id] is None:
+            row.status = constants.OUTBOX_SENT
+            row.sentOn = now
+        else:
+            markFailed(row, now, errors[row.id])
+    db.session.commit()
+
+
+def drainOutbox(sender=None, batchSize=constants.OUTBOX_BATCH_SIZE):
+    """
+    Delivers one batch of due notifications and returns the number of rows processed. Rows with identical content
+    are sent together through sender(tokens, notification, data), which returns a dict of token -> sent and
+    defaults to utils.sendMulticastNotification.
+    """
+    sender = sender or utils.sendMulticastNotification
+    now = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+    try:
+        claimed = claimDueNotifications(now, batchSize)
+        db.session.close() # no connection is held during the sends
+        if claimed:
+            recordResults(sendNotifications(claimed, sender))
+        return len(claimed)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+
+def pruneOutbox(batchSize=constants.OUTBOX_BATCH_SIZE):
+    """Deletes the notifications sent more than OUTBOX_RETENTION_SECONDS ago and returns how many were deleted."""
+    cutoff = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA)) \
+                - datetime.timedelta(seconds=constants.OUTBOX_RETENTION_SECONDS)
+    pruned = 0
+    try:
+        while True:
+            # The lease of a sent row ended shortly after it was sent, which lets the (status, nextAttemptOn) index find them
+            sentIds = db.session.query(NotificationOutbox.id) \
+                        .filter(NotificationOutbox.status == constants.OUTBOX_SENT) \
+                        .filter(NotificationOutbox.nextAttemptOn < cutoff) \
+                        .filter(NotificationOutbox.sentOn < cutoff) \
+                        .limit(batchSize).subquery()
+            deleted = db.session.query(NotificationOutbox).filter(NotificationOutbox.id.in_(sentIds)) \
+                        .delete(synchronize_session=False)
+            db.session.commit()
+            pruned += deleted
+            if deleted < batchSize:
+                break
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+    if pruned:
+        log.info('Pruned %s sent notifications from the outbox', pruned)
+    return pruned
+
+
+def runWorker(app, interval):
+    prunedAt = 0.0
+    while True:
+        try:
+            with app.app_context():
+                while drainOutbox() == constants.OUTBOX_BATCH_SIZE:
+                    pass
+                if time.monotonic() - prunedAt >= constants.OUTBOX_PRUNE_SECONDS:
+                    prunedAt = time.monotonic()
+                    pruneOutbox()
+        except Exception as err:
+            log.error('Notification outbox worker failed: %s', err)
+        _wakeup.wait(interval)
+        _wakeup.clear()
+
+
+def startWorker(app, interval=constants.OUTBOX_POLL_SECONDS):
+    """Starts the outbox worker of this process once."""
+    global _worker
+    with _workerLock:
+        if _worker is None:
+            _worker = threading.Thread(target=runWorker, args=(app, interval), name="notification-outbox")
+            _worker.daemon = True
+            _worker.start()
+    return _worker
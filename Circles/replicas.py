@@ -0,0 +1,189 @@
+import functools, random, threading, time
+from cachetools import TTLCache
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.expression import Select, UpdateBase
+from Circles import constants, dbPool, logs, metrics
+
+# Read replicas serve the handlers marked @readOnly. Everything else, writes inside any handler, the authentication
+# lookup and reads by a user who wrote in the last REPLICA_READ_YOUR_WRITES_SECONDS go to the primary, as do all
+# reads while every replica lags more than REPLICA_MAX_LAG_SECONDS.
+#
+# A write is remembered by the worker that served it and, for the other workers and hosts, in the user's LastWrite
+# row, upserted on the primary in the transaction of the write. A read that is not known locally to follow a write
+# looks the row up on the primary, by primary key, before it picks a replica.
+
+log = logs.getLogger(__name__)
+
+PRIMARY = "primary"
+REPLICA = "replica"
+
+_recentWriters = TTLCache(maxsize=constants.REPLICA_WRITERS_CACHE_SIZE, ttl=constants.REPLICA_READ_YOUR_WRITES_SECONDS)
+_recentWritersLock = threading.Lock()
+
+POSTGRES_LAG_QUERY = text("SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                          "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+class Replica(object):
+    """A replica engine and its last measured replication lag."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lag = 0.0
+        self.checkedAt = None
+        self.lock = threading.Lock()
+
+    def getLag(self):
+        """Returns the lag in seconds, measured at most every REPLICA_LAG_CHECK_SECONDS. Failures count as lagging."""
+        now = time.monotonic()
+        if self.checkedAt is not None and now - self.checkedAt < constants.REPLICA_LAG_CHECK_SECONDS:
+            return self.lag
+        # One thread measures; the others keep using the previous value meanwhile
+        if not self.lock.acquire(blocking=False):
+            return self.lag
+        try:
+            self.lag = measureLag(self.engine)
+        except Exception as err:
+            log.error('Could not read the lag of replica %s: %s', self.engine.url.host, err)
+            self.lag = float("inf")
+        finally:
+            self.checkedAt = time.monotonic()
+            self.lock.release()
+        return self.lag
+
+
+def measureLag(engine):
+    if engine.dialect.name != "postgresql":
+        return 0.0 # local databases used for testing do not replicate
+    with engine.connect() as connection:
+        return float(connection.execute(POSTGRES_LAG_QUERY).scalar() or 0)
+
+
+class RoutingSession(SignallingSession):
+    """Reads through the replica picked for the request, if any; flushes and DML always use the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context() and isReadClause(clause):
+            engine = g.get("readEngine")
+            if engine is not None:
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def execute(self, clause, params=None, mapper=None, bind=None, **kw):
+        # Bulk inserts, updates and deletes skip the flush, they are marked here
+        if isinstance(clause, UpdateBase):
+            markWrite(self)
+        return SignallingSession.execute(self, clause, params, mapper, bind, **kw)
+
+
+def isReadClause(clause):
+    # No clause means a bare connection was asked for, which may be used for anything
+    if clause is None or isinstance(clause, UpdateBase):
+        return False
+    return not (isinstance(clause, Select) and clause._for_update_arg is not None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        dbPool.applyEngineOptions(app.config, info.drivername, options)
+
+
+def init_app(app, uris):
+    """Creates the replica engines of app from uris, which may be empty."""
+    replicas = []
+    for uri in uris:
+        url = make_url(uri)
+        engine = create_engine(url, **dbPool.applyEngineOptions(app.config, url.drivername, {}))
+        metrics.instrumentEngine(engine)
+        dbPool.trackEngine(engine, "replica:" + str(url.host or url.database))
+        replicas.append(Replica(engine))
+    app.extensions["replicas"] = replicas
+
+
+def getReplicas(app=None):
+    return (app or current_app).extensions.get("replicas", [])
+
+
+def markWrite(session):
+    """
+    Sends the writing user's reads to the primary until the replicas have caught up with the write: in this worker
+    at once, in the others once the session commits.
+    """
+    if not has_request_context() or g.get("user") is None:
+        return
+    with _recentWritersLock:
+        _recentWriters[g.user.id] = True
+    if getReplicas() and not session.info.get("lastWriteMarked"):
+        session.info["lastWriteMarked"] = True
+        storeLastWrite(session.connection(), g.user.id)
+
+
+def storeLastWrite(connection, userId):
+    from Circles.models import LastWrite
+    table = LastWrite.__table__
+    values = {"userId": userId, "writtenAt": time.time()}
+    if connection.dialect.name == "postgresql":
+        statement = postgresql.insert(table).values(values) \
+                        .on_conflict_do_update(index_elements=[table.c.userId], set_={"writtenAt": values["writtenAt"]})
+    else:
+        statement = table.insert().prefix_with("OR REPLACE").values(values) # SQLite, used locally
+    connection.execute(statement)
+
+
+def clearLastWriteMark(session, transaction):
+    # Flushes run in subtransactions; only the end of the database transaction needs a new upsert
+    if transaction.parent is None:
+        session.info.pop("lastWriteMarked", None)
+
+
+event.listen(RoutingSession, "after_flush", lambda session, flushContext: markWrite(session))
+event.listen(RoutingSession, "after_bulk_update", lambda updateContext: markWrite(updateContext.session))
+event.listen(RoutingSession, "after_bulk_delete", lambda deleteContext: markWrite(deleteContext.session))
+event.listen(RoutingSession, "after_transaction_end", clearLastWriteMark)
+
+
+def hasStoredLastWrite(userId):
+    """Whether the primary has a write of userId in the last REPLICA_READ_YOUR_WRITES_SECONDS, from any worker."""
+    from Circles.models import LastWrite, db
+    # Called before the request picks its read engine, so this reads the primary
+    writtenAt = db.session.query(LastWrite.writtenAt).filter(LastWrite.userId == userId).scalar()
+    return writtenAt is not None and time.time() - writtenAt < constants.REPLICA_READ_YOUR_WRITES_SECONDS
+
+
+def isRecentWriter(userId):
+    with _recentWritersLock:
+        if userId in _recentWriters:
+            return True
+    return hasStoredLastWrite(userId)
+
+
+def chooseReadEngine():
+    """Returns the replica engine for the reads of the current request, or None to read from the primary."""
+    if request.headers.get(constants.READ_FROM_HEADER, "").lower() == PRIMARY:
+        return None
+    if g.get("user") is not None and isRecentWriter(g.user.id):
+        return None
+
+    candidates = [replica for replica in getReplicas() if replica.getLag() <= constants.REPLICA_MAX_LAG_SECONDS]
+    if not candidates:
+        return None
+    return random.choice(candidates).engine
+
+
+def readOnly(f):
+    """Routes the reads of a handler to a replica when one is usable. Apply it below @auth.login_required."""
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        engine = chooseReadEngine() if getReplicas() else None
+        g.readEngine = engine
+        metrics.recordReadRoute(PRIMARY if engine is None else REPLICA)
+        return f(*args, **kwargs)
+    return decorated
@@ -0,0 +1,52 @@
+from Circles import cardCatalog, cardOwnership, friendGraph, logs, mutualFriends
+from Circles.models import db, User
+
+log = logs.getLogger(__name__)
+
+
+def searchCardholders(userId, cardIds):
+    """
+    Finds the first and second degree friends of userId holding any of cardIds in a fixed number of queries.
+    Returns the (first, second) lists of the /user/search/cardholders payload.
+    """
+    friendIds = friendGraph.getFriendIds(userId)
+    secondDegreeIds = friendGraph.getSecondDegreeIds(userId)
+    holders = cardOwnership.getCardHolders(cardIds, set(friendIds).union(secondDegreeIds))
+    cardNames = cardCatalog.namesFor(cardIds)
+
+    firstHolders = [friendId for friendId in friendIds if friendId in holders]
+    secondHolders = [secondId for secondId in secondDegreeIds if secondId in holders]
+    if not firstHolders and not secondHolders:
+        return [], []
+
+    # Rank the friends connecting to second degree matches, then hydrate them and the matched users in one query
+    bestMutualFriends = mutualFriends.getBestMutualFriends(userId, secondHolders)
+    userIds = set(firstHolders)
+    userIds.update(secondHolders)
+    userIds.update(friendId for friendId, count in bestMutualFriends.values())
+    users = {}
+    for matchedId, name, phoneNumber in db.session.query(User.id, User.name, User.phoneNumber).filter(User.id.in_(userIds)):
+        users[matchedId] = (name, phoneNumber)
+
+    first = []
+    for friendId in firstHolders:
+        if friendId not in users:
+            log.warning('No friend with id: %s', friendId)
+            continue
+        name, phoneNumber = users[friendId]
+        for cardId in holders[friendId]:
+            first.append({"name": name, "id": friendId, "phoneNumber": phoneNumber, \
+                "cardId": cardId, "cardName": cardNames.get(cardId)})
+
+    second = []
+    for secondId in secondHolders:
+        if secondId not in users or secondId not in bestMutualFriends or bestMutualFriends[secondId][0] not in users:
+            log.warning('No second degree friend with id: %s', secondId)
+            continue
+        name = users[secondId][0]
+        friendId, numMutualFriends = bestMutualFriends[secondId]
+        for cardId in holders[secondId]:
+            second.append({"name": name, "id": secondId, "cardId": cardId, "cardName": cardNames.get(cardId), \
+                "friendName": users[friendId][0], "numMutualFriends": numMutualFriends})
+
+    return first, second
@@ -0,0 +1,65 @@
+import os
+from Circles import expiry, friendGraph, logs, metrics, outbox, replicas
+from Circles.models import db
+
+# Support for serving the app from gunicorn, see gunicorn.conf.py. The app is loaded once in the master and forked
+# into the workers, so everything that holds a connection or a thread is recreated in each worker after the fork.
+# With gevent workers the standard library is monkey patched before the app is imported: request handlers, the
+# background workers and the log writer then run as greenlets, and psycopg2 yields to them while it waits on RDS.
+
+PRELOAD_ENV = "CIRCLES_PRELOAD"
+
+log = logs.getLogger(__name__)
+
+
+def isPreloading():
+    """Whether the app is being loaded in a gunicorn master, which starts the background workers after forking."""
+    return os.environ.get(PRELOAD_ENV) == "1"
+
+
+def installWaitCallback():
+    """Makes psycopg2 yield to other greenlets while it waits on the database. Needs a monkey patched process."""
+    from psycopg2 import extensions
+    extensions.set_wait_callback(waitForConnection)
+
+
+def waitForConnection(conn, timeout=None):
+    """psycopg2 wait callback: polls the connection and lets other greenlets run until it is ready."""
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import extensions, OperationalError
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError("Bad result from poll: " + str(state))
+
+
+def startBackgroundWorkers(app):
+    outbox.startWorker(app)
+    expiry.startWorker(app)
+    friendGraph.startWorker(app)
+
+
+def beforeFork(app):
+    """Closes the connections of the master so no worker shares a socket with it."""
+    with app.app_context():
+        db.engine.dispose()
+    for replica in replicas.getReplicas(app):
+        replica.engine.dispose()
+
+
+def afterFork(app):
+    """Restarts, in a new worker, the log writer and the background workers a forked process does not inherit."""
+    logs.restartListener()
+    startBackgroundWorkers(app)
+    log.info('Worker %s started', os.getpid())
+
+
+def workerExited(pid):
+    metrics.markProcessDead(pid)
@@ -1,46 +1,138 @@
-import datetime, pytz, random, string, os
+import base64, binascii, datetime, pytz, queue, random, string, os, threading, time
+from dateutil import parser as dateparser
+from sqlalchemy import and_, or_
+from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
-from Circles import constants
+from Circles import constants, logs, metrics
 from firebase_admin import messaging
 
+log = logs.getLogger(__name__)
+
+def getAndroidConfig():
+    return messaging.AndroidConfig( priority='normal', notification=messaging.AndroidNotification( sound='default', channel_id=constants.FIREBASE_CHANNEL))
+
+
 def sendDeviceNotification(registration_token, notification, data):
+    start = time.monotonic()
     try:
-        message = messaging.Message(data=data, notification=notification,
-                                    android=messaging.AndroidConfig( priority='normal', notification=messaging.AndroidNotification( sound='default', channel_id=constants.FIREBASE_CHANNEL)),
-                                    token=registration_token)
+        message = messaging.Message(data=data, notification=notification, android=getAndroidConfig(), token=registration_token)
         response = messaging.send(message)
     except Exception as err:
-        print('Error while sending notification: ' + str(err))
+        log.error('Error while sending notification: %s', err)
+        metrics.recordNotification("device", time.monotonic() - start, False)
         return False
+    metrics.recordNotification("device", time.monotonic() - start, True)
     return True
 
-def sendSMS(smsBody, phoneNumber):
+
+def sendMulticastNotification(registration_tokens, notification, data):
+    """
+    Sends the same notification to many devices, FCM_MULTICAST_BATCH_SIZE tokens per FCM batch request.
+    The firebase app reuses one authorized HTTP session for all batches. Returns a dict of token -> sent.
+    """
+    results = {}
+    tokens = [token for token in registration_tokens if token]
+    for start in range(0, len(tokens), constants.FCM_MULTICAST_BATCH_SIZE):
+        batch = tokens[start:start + constants.FCM_MULTICAST_BATCH_SIZE]
+        batchStart = time.monotonic()
+        try:
+            message = messaging.MulticastMessage(tokens=batch, data=data, notification=notification, android=getAndroidConfig())
+            response = messaging.send_multicast(message)
+            metrics.recordNotification("multicast", time.monotonic() - batchStart, True)
+        except Exception as err:
+            log.error('Error while sending multicast notification: %s', err)
+            metrics.recordNotification("multicast", time.monotonic() - batchStart, False)
+            for token in batch:
+                results[token] = False
+            continue
+
+        for token, sendResponse in zip(batch, response.responses):
+            results[token] = sendResponse.success
+            if not sendResponse.success:
+                log.error('Error while sending notification: %s', sendResponse.exception)
+
+    return results
+
+# One pooled Twilio client per worker process, created on first use
+_smsClient = None
+_smsLock = threading.Lock()
+_founderAlerts = queue.Queue(maxsize=constants.FOUNDER_ALERT_QUEUE_SIZE)
+_founderDigestWorker = None
+
+
+def getSMSClient():
+    global _smsClient
+    if _smsClient is None:
+        with _smsLock:
+            if _smsClient is None:
+                httpClient = TwilioHttpClient(pool_connections=True, timeout=constants.SMS_TIMEOUT_SECONDS)
+                _smsClient = Client(os.environ['TWILIO_ACCOUNT_SID'], os.environ['TWILIO_AUTH_TOKEN'], http_client=httpClient)
+    return _smsClient
+
+
+def sendSMS(smsBody, phoneNumber, kind="user"):
+    start = time.monotonic()
+    sent = False
     try:
-        account_sid = os.environ['TWILIO_ACCOUNT_SID']
-        auth_token = os.environ['TWILIO_AUTH_TOKEN']
-        client = Client(account_sid, auth_token)
-        message = client.messages.create(body=smsBody, from_=os.environ['TWILIO_PHONE_NUMBER'], to=phoneNumber)
+        getSMSClient().messages.create(body=smsBody, from_=os.environ['TWILIO_PHONE_NUMBER'], to=phoneNumber)
+        sent = True
     except Exception as err:
-        print('Failed to send sms: ' + str(err))
-        return False
+        log.error('Failed to send sms: %s', err)
+    finally:
+        metrics.recordSMS(kind, time.monotonic() - start, sent)
 
-    return True
+    return sent
 
 def sendSMSToFounders(smsBody):
+    sent = True
+    for phoneNumber in [os.environ['ABHIRAM'], os.environ['ANCHAL']]:
+        sent = sendSMS(smsBody, phoneNumber, kind="founders") and sent
+
+    return sent
+
+
+def queueFounderAlert(text):
+    """Queues an alert for the founders. Alerts are sent off the request path as one periodic digest SMS."""
+    startFounderDigestWorker()
     try:
-        phoneNumbers = [os.environ['ABHIRAM'], os.environ['ANCHAL']] 
-        account_sid = os.environ['TWILIO_ACCOUNT_SID']
-        auth_token = os.environ['TWILIO_AUTH_TOKEN']
-        client = Client(account_sid, auth_token)
-        for phoneNumber in phoneNumbers:
-            client.messages.create(body=smsBody, from_=os.environ['TWILIO_PHONE_NUMBER'], to=phoneNumber)
-    except Exception as err:
-        print('Failed to send sms: ' + str(err))
+        _founderAlerts.put_nowait(text)
+    except queue.Full:
+        log.error('Founder alert queue is full, dropping alert: %s', text)
         return False
-
     return True
 
 
+def buildFounderDigest(alerts):
+    if len(alerts) == 1:
+        return alerts[0]
+    digest = str(len(alerts)) + " Circles alerts:\n" + "\n".join(alerts)
+    if len(digest) > constants.SMS_MAX_LENGTH:
+        digest = digest[:constants.SMS_MAX_LENGTH - 3] + "..."
+    return digest
+
+
+def runFounderDigestWorker(interval):
+    while True:
+        time.sleep(interval)
+        alerts = []
+        while True:
+            try:
+                alerts.append(_founderAlerts.get_nowait())
+            except queue.Empty:
+                break
+        if alerts and not sendSMSToFounders(buildFounderDigest(alerts)):
+            log.error('Could not send founder digest with %s alerts', len(alerts))
+
+
+def startFounderDigestWorker(interval=constants.FOUNDER_DIGEST_SECONDS):
+    global _founderDigestWorker
+    with _smsLock:
+        if _founderDigestWorker is None:
+            _founderDigestWorker = threading.Thread(target=runFounderDigestWorker, args=(interval,), name="founder-digest")
+            _founderDigestWorker.daemon = True
+            _founderDigestWorker.start()
+
+
 def generateAuthCode(length):
     return ''.join(random.choices(string.digits, k=length))
 
@@ -54,3 +146,30 @@ def getDateTimeAsString(dt):
         return constants.DATETIME_NOT_AVAILABLE
     
     return dt.strftime('%B %d, %H:%M')
+
+
+def getPageLimit(args, default):
+    limit = args.get("limit", default, type=int)
+    return max(1, min(limit, constants.MAX_PAGE_SIZE))
+
+
+def encodeCursor(createdOn, rowId):
+    """Opaque keyset cursor pointing just past the row with the given (createdOn, id)."""
+    raw = createdOn.isoformat() + "|" + str(rowId)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decodeCursor(cursor):
+    try:
+        createdOn, rowId = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return dateparser.isoparse(createdOn), int(rowId)
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        return None
+
+
+def applyCursor(query, createdOnColumn, idColumn, cursor):
+    """Restricts a query ordered by (createdOn DESC, id DESC) to the rows after the cursor."""
+    if not cursor:
+        return query
+    createdOn, rowId = cursor
+    return query.filter(or_(createdOnColumn < createdOn, and_(createdOnColumn == createdOn, idColumn < rowId)))
@@ -1,6 +1,6 @@
 from flask import Blueprint, Flask, jsonify, g, request, abort
 import os, json, random, datetime, firebase_admin, urllib.parse
-from Circles import create_app, create_db
+from Circles import create_app, create_db, serving
 from Circles.models import db
 from Circles.APIs import apiBlueprint, auth
 
@@ -10,8 +10,12 @@ firebase_app = firebase_admin.initialize_app()
 
 # Main application configuration
 application = create_app()
-db.init_app(application)
 application.register_blueprint(apiBlueprint)
 
+# Background delivery of the notification outbox and expiry of access requests. Under gunicorn every worker starts
+# its own after forking, see gunicorn.conf.py.
+if not serving.isPreloading():
+    serving.startBackgroundWorkers(application)
+
 if __name__ == "__main__":
     application.run()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import argparse, os, sys, tempfile, time
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
+from benchmarks import stubs
+stubs.install()
+
+from Circles import authCache, create_app, constants, logs
+from Circles.models import db, User
+from Circles.APIs import verify_password
+from benchmarks.seed import seedGraph
+
+# Cost of authenticating a request alone, without the handler: the former verification, which built a serializer
+# and loaded the full User on every call, against authCache on a miss and on a hit. Tokens of --users different
+# users are verified in turn, from one thread.
+#
+#   python -m benchmarks.authCost --users 200 --iterations 5000
+
+
+def verifyBefore(token):
+    data = Serializer(os.environ["SECRET_KEY"]).loads(token)
+    return User.query.get(data["id"])
+
+
+def verifyMiss(token):
+    authCache._principals.clear()
+    return verify_password(token, "unused")
+
+
+def verifyHit(token):
+    return verify_password(token, "unused")
+
+
+def measure(verify, tokens, iterations):
+    durations = []
+    for index in range(iterations):
+        token = tokens[index % len(tokens)]
+        start = time.perf_counter()
+        verify(token)
+        durations.append((time.perf_counter() - start) * 1e6)
+        db.session.remove()
+    durations.sort()
+    return durations[len(durations) // 2], durations[min(len(durations) - 1, int(len(durations) * 0.99))], \
+            len(durations) / (sum(durations) / 1e6)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-request cost of token authentication.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    handle, path = tempfile.mkstemp(prefix="circles-auth-", suffix=".db")
+    os.close(handle)
+    logs.startListener(sys.stderr)
+    app = create_app("sqlite:///" + path, checkSchema=False, replicaUris=[])
+    with app.app_context():
+        db.create_all()
+        seedGraph(users=args.users, meanDegree=4, postsPerUser=0, accessRequestsPerUser=0, friendRequestsPerUser=0)
+        tokens = [user.generate_auth_token(expiration=constants.TOKEN_EXPIRATION, key=os.environ["SECRET_KEY"]).decode("ascii") \
+                  for user in User.query.all()]
+        db.session.remove()
+
+    print("%-28s %10s %10s %12s" % ("verification", "p50 us", "p99 us", "per second"))
+    cases = [("serializer + User load", verifyBefore), ("authCache miss", verifyMiss), ("authCache hit", verifyHit)]
+    with app.test_request_context():
+        for name, verify in cases:
+            measure(verify, tokens, len(tokens)) # warm up, and fills the cache for the hits
+            p50, p99, perSecond = measure(verify, tokens, args.iterations)
+            print("%-28s %10.1f %10.1f %12.0f" % (name, p50, p99, perSecond))
+
+    os.remove(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
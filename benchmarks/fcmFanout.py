@@ -0,0 +1,107 @@
+import argparse, email, firebase_admin, json, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from firebase_admin import credentials, messaging
+from google.oauth2.credentials import Credentials
+from Circles import logs, utils
+
+# Delivery rate of a post fan-out through a local fake of the FCM HTTP v1 API: one send per token, as posts were
+# delivered before, against utils.sendMulticastNotification() and its batch requests. Every HTTP request to the
+# fake takes --latency-ms, standing in for the round trip to FCM.
+#
+#   python -m benchmarks.fcmFanout --tokens 1000 --latency-ms 20
+
+PROJECT_ID = "circles-benchmark"
+
+
+class FakeCredential(credentials.Base):
+    """A bearer token that never needs refreshing, so no request leaves the host."""
+
+    def get_credential(self):
+        return Credentials(token="benchmark")
+
+
+class FakeFcmHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # the headers and the body are written separately
+    latency = 0.0
+    requests = 0
+    messages = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.latency)
+        if self.path == "/batch":
+            content, contentType = self.answerBatch(body)
+        else:
+            FakeFcmHandler.messages += 1
+            content, contentType = json.dumps({"name": "projects/" + PROJECT_ID + "/messages/1"}).encode("utf-8"), "application/json"
+        FakeFcmHandler.requests += 1
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def answerBatch(self, body):
+        """Answers every request of a multipart batch with success, under the Content-ID it was sent with."""
+        request = email.message_from_bytes(b"Content-Type: " + self.headers["Content-Type"].encode("ascii") + b"\r\n\r\n" + body)
+        boundary = "batch_benchmark"
+        parts = []
+        for part in request.get_payload():
+            FakeFcmHandler.messages += 1
+            answer = json.dumps({"name": "projects/" + PROJECT_ID + "/messages/1"})
+            parts.append("--" + boundary + "\r\nContent-Type: application/http\r\nContent-ID: " + part["Content-ID"] + "\r\n\r\n" \
+                         + "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n" + answer + "\r\n")
+        content = "".join(parts) + "--" + boundary + "--\r\n"
+        return content.encode("utf-8"), "multipart/mixed; boundary=" + boundary
+
+    def log_message(self, format, *args):
+        pass
+
+
+def startFakeFcm(latency):
+    FakeFcmHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeFcmHandler)
+    thread = threading.Thread(target=server.serve_forever, name="fake-fcm")
+    thread.daemon = True
+    thread.start()
+    url = "http://127.0.0.1:" + str(server.server_address[1])
+    messaging._MessagingService.FCM_URL = url + "/v1/projects/{0}/messages:send"
+    messaging._MessagingService.FCM_BATCH_URL = url + "/batch"
+    firebase_admin.initialize_app(FakeCredential(), {"projectId": PROJECT_ID})
+    return server
+
+
+def sendOneByOne(tokens, notification, data):
+    return {token: utils.sendDeviceNotification(token, notification, data) for token in tokens}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Post fan-out rate against a local fake FCM.")
+    parser.add_argument("--tokens", type=int, default=1000, help="Friends to notify, one device token each.")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Time the fake takes to answer each HTTP request.")
+    args = parser.parse_args(argv)
+
+    logs.startListener(sys.stderr)
+    server = startFakeFcm(args.latency_ms / 1000.0)
+    tokens = ["fcm-token-" + str(index) for index in range(args.tokens)]
+    notification = messaging.Notification("New post", "A friend is looking for a card")
+    data = {"type": "post", "postId": "1"}
+
+    print("%-12s %8s %10s %10s %12s" % ("method", "tokens", "requests", "seconds", "messages/s"))
+    for name, send in (("one by one", sendOneByOne), ("multicast", utils.sendMulticastNotification)):
+        FakeFcmHandler.requests = FakeFcmHandler.messages = 0
+        start = time.perf_counter()
+        results = send(tokens, notification, data)
+        elapsed = time.perf_counter() - start
+        if sum(1 for sent in results.values() if sent) != len(tokens) or FakeFcmHandler.messages != len(tokens):
+            print("ERROR: " + name + " delivered " + str(FakeFcmHandler.messages) + " of " + str(len(tokens)) + " messages")
+            return 1
+        print("%-12s %8d %10d %10.2f %12.0f" % (name, len(tokens), FakeFcmHandler.requests, elapsed, len(tokens) / elapsed))
+
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
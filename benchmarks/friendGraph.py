@@ -0,0 +1,98 @@
+import argparse, os, random, shutil, sys, tempfile, time, tracemalloc
+from benchmarks import stubs
+stubs.install()
+
+from Circles import create_app, friendGraph, logs
+from Circles.models import db
+from benchmarks.seed import seedGraph
+
+# Memory and lookup latency of the shared friend graph. Seeds a heavy tailed graph, builds the snapshot and reports
+# its size per million friendships against a per-process dict of sets, then times the friendship reads of the
+# handlers through the graph and through the database queries they replace, for hubs and for typical users.
+#
+#   python -m benchmarks.friendGraph --users 50000 --mean-degree 20 --iterations 2000
+
+# operation -> share of --iterations it runs; a two hop expansion from a hub reaches most of the graph
+OPERATIONS = [("isFriend", 1), ("getFriendIds", 1), ("countFriends", 1), ("getSecondDegreeIds", 0.02)]
+
+
+def timeOperation(operation, userIds, iterations, rng, numUsers):
+    durations = []
+    for index in range(iterations):
+        userId = userIds[index % len(userIds)]
+        start = time.perf_counter()
+        if operation == "isFriend":
+            friendGraph.isFriend(userId, rng.randint(1, numUsers))
+        else:
+            getattr(friendGraph, operation)(userId)
+        durations.append((time.perf_counter() - start) * 1e6)
+        db.session.close()
+    durations.sort()
+    return durations[len(durations) // 2], durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+
+
+def measureDictOfSets(adjacency):
+    """Bytes a process would hold for the same friendships as a dict of sets."""
+    tracemalloc.start()
+    copy = {userId: set(friendIds) for userId, friendIds in adjacency.items()}
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del copy
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory and latency of the shared friend graph.")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--mean-degree", type=int, default=20)
+    parser.add_argument("--degree-exponent", type=float, default=2.1)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    handle, path = tempfile.mkstemp(prefix="circles-friend-graph-", suffix=".db")
+    os.close(handle)
+    logs.startListener(sys.stderr)
+    app = create_app("sqlite:///" + path, checkSchema=False, replicaUris=[])
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.create_all()
+        graph = seedGraph(users=args.users, meanDegree=args.mean_degree, degreeExponent=args.degree_exponent, cardsPerUser=0, \
+                          postsPerUser=0, accessRequestsPerUser=0, friendRequestsPerUser=0, seed=args.seed)
+        adjacency = graph["adjacency"]
+        friendships = graph["edges"]
+
+        start = time.perf_counter()
+        state = friendGraph.getGraph(app).state
+        buildSeconds = time.perf_counter() - start
+        snapshotBytes = os.path.getsize(friendGraph.getSnapshotPath(app.config["FRIEND_GRAPH_DIR"], state.generation))
+        dictBytes = measureDictOfSets(adjacency)
+        perMillion = 1e6 / friendships
+        print("%d users, %d friendships (%d Friend rows), snapshot built in %.2fs" % (args.users, friendships, \
+              state.snapshot.numIds, buildSeconds))
+        print("snapshot: %.1f MB per million friendships, shared by every process of the host" % (snapshotBytes * perMillion / 1e6))
+        print("dict of sets: %.1f MB per million friendships, in each process" % (dictBytes * perMillion / 1e6))
+
+        byDegree = sorted(adjacency, key=lambda userId: (-len(adjacency[userId]), userId))
+        groups = [("hubs", byDegree[:10]), ("median", byDegree[len(byDegree) // 2:len(byDegree) // 2 + 100])]
+        print("\n%-20s %-7s %7s %12s %12s %12s %12s" % ("operation", "users", "degree", "graph p50 us", "graph p99 us", \
+              "db p50 us", "db p99 us"))
+        for operation, share in OPERATIONS:
+            iterations = max(1, int(args.iterations * share))
+            for name, userIds in groups:
+                degree = sum(len(adjacency[userId]) for userId in userIds) // len(userIds)
+                cached = timeOperation(operation, userIds, iterations, rng, args.users)
+                graphExtension = app.extensions["friendGraph"]
+                app.extensions["friendGraph"] = None # the database queries the graph replaces
+                queried = timeOperation(operation, userIds, max(1, iterations // 10), rng, args.users)
+                app.extensions["friendGraph"] = graphExtension
+                print("%-20s %-7s %7d %12.1f %12.1f %12.1f %12.1f" % (operation, name, degree, cached[0], cached[1], \
+                      queried[0], queried[1]))
+
+    shutil.rmtree(app.config["FRIEND_GRAPH_DIR"], ignore_errors=True)
+    os.remove(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import argparse, datetime, functools, json, pytz, resource, subprocess, sys, time, tracemalloc
+from benchmarks import stubs
+stubs.install()
+
+from flask import jsonify
+from flask.json import JSONEncoder
+from Circles import create_app, constants, jsonCodec
+from Circles.APIs import accessRequests, posts
+
+# Cost of encoding the post feed and the access request inbox, per response: the former jsonify() of a list of
+# dicts against jsonCodec.listResponse() encoding the loaded rows in one go, and jsonCodec.streamResponse() reading
+# them from a generator as the query iterator would, with either backend. The rows are generated within each
+# response, so the loaded cases pay for holding them. Each case runs in its own process so its peak RSS is its own;
+# the peak of Python allocations during one response is measured too.
+#
+#   python -m benchmarks.jsonCost --items 200,5000 --iterations 50
+
+ENDPOINTS = ["posts", "accessRequests"]
+CASES = [("jsonify", "stdlib"), ("jsonify", "orjson"), ("buffered", "orjson"), ("streamed", "stdlib"), ("streamed", "orjson")]
+
+
+def buildRows(endpoint, items):
+    """
+    A function generating rows shaped like the ones the handlers' queries return, and the renderer the handler uses
+    for them.
+    """
+    now = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+    if endpoint == "posts":
+        makeRows = lambda: ((index, "Looking for someone with a travel card for a booking on Friday " + str(index), index % 500, \
+                             now, "User " + str(index % 500), "https://img.example/" + str(index % 500)) for index in range(items))
+        return "posts", makeRows, posts.renderPost
+
+    makeRows = lambda: ((index, index % 60, index % 500, now, None, constants.ACCESS_REQUEST_UNACCEPTED, "Flight booking", 2500, \
+                         "User " + str(index % 500), "https://img.example/" + str(index % 500)) for index in range(items))
+    cardNames = {cardId: "Card " + str(cardId) for cardId in range(60)}
+    return "requests", makeRows, functools.partial(accessRequests.renderAccessRequest, cardNames)
+
+
+def respond(mode, key, makeRows, render):
+    if mode == "streamed":
+        return jsonCodec.streamResponse(key, makeRows(), render)
+    rows = list(makeRows())
+    fields = {"count": len(rows)}
+    if mode == "jsonify":
+        document = dict(fields)
+        document[key] = [render(row) for row in rows]
+        return jsonify(document)
+    return jsonCodec.listResponse(fields, key, rows, render)
+
+
+def writeOut(response):
+    """Consumes the body the way a WSGI server does and returns its size."""
+    size = 0
+    for chunk in response.iter_encoded():
+        size += len(chunk)
+    response.close()
+    return size
+
+
+def runCase(endpoint, mode, backend, items, iterations):
+    app = create_app("sqlite://", checkSchema=False, replicaUris=[])
+    app.json_encoder = JSONEncoder
+    app.config["JSON_BACKEND"] = backend
+    jsonCodec.init_app(app)
+    key, makeRows, render = buildRows(endpoint, items)
+
+    with app.test_request_context():
+        writeOut(respond(mode, key, makeRows, render)) # warm up
+        baseRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        start = time.perf_counter()
+        size = 0
+        for _ in range(iterations):
+            size = writeOut(respond(mode, key, makeRows, render))
+        elapsed = time.perf_counter() - start
+        peakRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        tracemalloc.start()
+        writeOut(respond(mode, key, makeRows, render))
+        peakAllocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {"responsesPerSecond": iterations / elapsed, "mbPerSecond": size * iterations / elapsed / 1e6, "bytes": size, \
+            "peakAllocatedKB": peakAllocated / 1024.0, "rssGrowthKB": peakRss - baseRss, "rssKB": peakRss}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encoding cost of the list endpoints.")
+    parser.add_argument("--items", default="200,5000", help="Comma separated list lengths.")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--case", help=argparse.SUPPRESS) # endpoint,mode,backend,items run in this process
+    args = parser.parse_args(argv)
+
+    if args.case:
+        endpoint, mode, backend, items = args.case.split(",")
+        print(json.dumps(runCase(endpoint, mode, backend, int(items), args.iterations)))
+        return 0
+
+    print("%-15s %6s %-9s %-7s %9s %9s %10s %11s %9s" % ("endpoint", "items", "mode", "backend", "resp/s", "MB/s", \
+          "body KB", "peak KB", "RSS MB"))
+    for endpoint in ENDPOINTS:
+        for items in args.items.split(","):
+            for mode, backend in CASES:
+                output = subprocess.check_output([sys.executable, "-m", "benchmarks.jsonCost", "--iterations", str(args.iterations), \
+                                                  "--case", ",".join([endpoint, mode, backend, items])], stderr=subprocess.DEVNULL)
+                result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+                print("%-15s %6s %-9s %-7s %9.1f %9.1f %10.1f %11.1f %9.1f" % (endpoint, items, mode, backend, \
+                      result["responsesPerSecond"], result["mbPerSecond"], result["bytes"] / 1024.0, result["peakAllocatedKB"], \
+                      result["rssKB"] / 1024.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
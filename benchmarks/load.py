@@ -0,0 +1,183 @@
+import argparse, base64, http.client, os, shutil, socket, subprocess, sys, tempfile, threading, time
+from benchmarks import stubs
+stubs.install()
+
+from Circles import create_app, constants, friendGraph
+from Circles.models import db, User
+from benchmarks.seed import seedGraph
+
+# Load comparison of the gunicorn worker classes at equal memory: every mode runs the same number of worker
+# processes, and the resident memory of the master and its workers is measured after the load. Each SQL statement
+# waits --db-latency-ms to stand in for RDS, so the modes differ in how they overlap that wait.
+#
+#   python -m benchmarks.load --workers 4 --concurrency 64 --seconds 10 --db-latency-ms 5
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILE = os.path.join(ROOT, "gunicorn.conf.py")
+DATABASE_URI_ENV = "CIRCLES_BENCHMARK_DATABASE_URI" # read by benchmarks/wsgi.py in the server
+DB_LATENCY_ENV = "CIRCLES_BENCHMARK_DB_LATENCY_MS"
+
+
+def seedDatabase(args):
+    """Seeds a temporary SQLite database and returns its URI and the paths and token the clients request with."""
+    handle, path = tempfile.mkstemp(prefix="circles-load-", suffix=".db")
+    os.close(handle)
+    databaseUri = "sqlite:///" + path
+    app = create_app(databaseUri, checkSchema=False, replicaUris=[])
+    with app.app_context():
+        db.create_all()
+        graph = seedGraph(users=args.users, seed=args.seed)
+        actorId = max(graph["adjacency"], key=lambda userId: len(graph["adjacency"][userId]))
+        actor = User.query.get(actorId)
+        token = actor.generate_auth_token(expiration=constants.TOKEN_EXPIRATION, key=os.environ["SECRET_KEY"]).decode("ascii")
+        friendId = sorted(graph["adjacency"][actorId])[0]
+        db.session.close()
+
+    paths = ["/user/friends", "/user/profile", "/user/profile?id=" + str(friendId), "/posts/all?type=received", \
+             "/accessRequests/received", "/card/all"]
+    return databaseUri, paths, token
+
+
+def getFreePort():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def startServer(args, workerClass, databaseUri, port, logFile):
+    env = dict(os.environ)
+    env.update({"GUNICORN_WORKER_CLASS": workerClass, "GUNICORN_WORKERS": str(args.workers), "GUNICORN_THREADS": str(args.threads), \
+                "GUNICORN_WORKER_CONNECTIONS": str(args.worker_connections), "GUNICORN_BIND": "127.0.0.1:" + str(port), \
+                DATABASE_URI_ENV: databaseUri, DB_LATENCY_ENV: str(args.db_latency_ms)})
+    env.pop("prometheus_multiproc_dir", None)
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", CONFIG_FILE, "benchmarks.wsgi:application"], cwd=ROOT, env=env, \
+                            stdout=subprocess.DEVNULL, stderr=logFile)
+
+
+def waitUntilServing(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/card/all")
+            if connection.getresponse().status == constants.STATUS_OK:
+                return True
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def getTreeMemory(pid):
+    """Returns the resident memory in MB of a process and its children."""
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/" + entry + "/stat") as statFile:
+                    if int(statFile.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (IOError, IndexError, ValueError):
+                pass
+
+    total = 0
+    for processId in pids:
+        try:
+            with open("/proc/" + str(processId) + "/status") as statusFile:
+                for line in statusFile:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except IOError:
+            pass
+    return total / 1024.0, len(pids) - 1
+
+
+def runClients(port, paths, token, concurrency, seconds):
+    headers = {"Authorization": "Basic " + base64.b64encode((token + ":unused").encode("utf-8")).decode("ascii")}
+    deadline = time.time() + seconds
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(index):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine = []
+        failed = 0
+        request = index
+        while time.time() < deadline:
+            path = paths[request % len(paths)]
+            request += 1
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= constants.STATUS_SERVER_ERROR:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                continue
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    clients = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+
+    latencies.sort()
+    if not latencies:
+        return {"requests": 0, "rps": 0.0, "p50": 0.0, "p95": 0.0, "errors": errors[0]}
+    return {"requests": len(latencies), "rps": len(latencies) / float(seconds), "p50": latencies[len(latencies) // 2] * 1000, \
+            "p95": latencies[int(len(latencies) * 0.95)] * 1000, "errors": errors[0]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares gunicorn worker classes under concurrent load.")
+    parser.add_argument("--modes", default="sync,gthread,gevent", help="Comma separated gunicorn worker classes.")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes of every mode.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads per gthread worker.")
+    parser.add_argument("--worker-connections", type=int, default=100, help="Greenlets per gevent worker.")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent keep-alive clients.")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    databaseUri, paths, token = seedDatabase(args)
+    print("%-8s %7s %11s %9s %9s %9s %7s %8s" % ("mode", "workers", "concurrency", "req/s", "p50 ms", "p95 ms", "errors", "RSS MB"))
+    failed = False
+    for workerClass in args.modes.split(","):
+        port = getFreePort()
+        logFile = tempfile.TemporaryFile(mode="w+")
+        server = startServer(args, workerClass, databaseUri, port, logFile)
+        try:
+            if not waitUntilServing(port, 30):
+                logFile.seek(0)
+                print("ERROR: " + workerClass + " workers did not start:\n" + logFile.read()[-2000:])
+                failed = True
+                continue
+            result = runClients(port, paths, token, args.concurrency, args.seconds)
+            memory, workers = getTreeMemory(server.pid)
+            print("%-8s %7d %11d %9.1f %9.2f %9.2f %7d %8.1f" % (workerClass, workers, args.concurrency, result["rps"], result["p50"], \
+                  result["p95"], result["errors"], memory))
+        finally:
+            server.terminate()
+            server.wait()
+            logFile.close()
+
+    os.remove(databaseUri[len("sqlite:///"):])
+    shutil.rmtree(friendGraph.getDefaultDirectory(databaseUri), ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import argparse, os, sys, tempfile, time
+from Circles import constants, logs
+
+# Measures what a log line costs the request thread: print() to stdout against the queued structured logger.
+# Both write to a local file flushed on every line, as stdout is under mod_wsgi, and then to a sink whose writes
+# take --sink-latency-us, which is what the request thread waits on when the log pipe backs up.
+#
+#   python -m benchmarks.logCost --lines 5000 --sink-latency-us 200
+
+
+class SlowFile(object):
+    """A file whose writes take a fixed time, like a contended or remote log pipe."""
+
+    def __init__(self, target, latency):
+        self.target = target
+        self.latency = latency
+
+    def write(self, text):
+        time.sleep(self.latency)
+        return self.target.write(text)
+
+    def flush(self):
+        self.target.flush()
+
+
+def measure(emit, lines):
+    latencies = []
+    for index in range(lines):
+        start = time.perf_counter()
+        emit(index)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {"p50": latencies[len(latencies) // 2] * 1e6, "p99": latencies[int(len(latencies) * 0.99)] * 1e6, \
+            "total": sum(latencies) * 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Request-thread cost of logging.")
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--sink-latency-us", type=int, default=200, help="Time each write to the slow sink takes.")
+    args = parser.parse_args(argv)
+
+    handle, path = tempfile.mkstemp(prefix="circles-logcost-", suffix=".log")
+    os.close(handle)
+    target = open(path, "w")
+    log = logs.getLogger("Circles.search")
+    warningRate = constants.LOG_SAMPLE_RATES.get(("Circles.search", "No friend with id: %s"), 1.0)
+
+    sys.stdout.write("%-12s %-30s %9s %9s %10s\n" % ("sink", "emitter", "p50 us", "p99 us", "total ms"))
+    for sinkName, out in [("file", target), ("slow " + str(args.sink_latency_us) + "us", SlowFile(target, args.sink_latency_us / 1e6))]:
+        logs.startListener(out)
+        results = [
+            ("print", measure(lambda index: print("WARNING: No friend with id: " + str(index), file=out, flush=True), args.lines)),
+            ("log.error", measure(lambda index: log.error("Friend not found: %s", index), args.lines)),
+            ("log.warning (sampled " + str(warningRate) + ")", measure(lambda index: log.warning("No friend with id: %s", index), args.lines)),
+            ("log.debug (disabled)", measure(lambda index: log.debug("No friend with id: %s", index), args.lines)),
+        ]
+        logs.stopListener()
+        for name, result in results:
+            sys.stdout.write("%-12s %-30s %9.2f %9.2f %10.1f\n" % (sinkName, name, result["p50"], result["p99"], result["total"]))
+
+    target.close()
+    os.remove(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import argparse, collections, os, sys, tempfile, time
+from benchmarks import stubs
+stubs.install()
+
+from Circles import create_app, logs, mutualFriends
+from Circles.models import db, Friend, User
+from benchmarks.run import getBestSecondDegreeFriend
+from benchmarks.seed import seedGraph
+
+# Cost of finding the mutual friends of high degree users: mutualFriends.getMutualFriends() against loading both
+# friend lists and intersecting them in Python, with and without the Friend (userId, friendId) index. The pairs are
+# the highest degree users with their highest degree friend and with their best connected second degree friend.
+#
+#   python -m benchmarks.mutualFriends --users 5000 --mean-degree 40 --iterations 50
+
+INDEX_NAME = "ix_friend_user_friend"
+
+
+def getFriendListsIntersection(userId, otherId):
+    """The former way: both friend lists, their intersection, then the mutual friends themselves."""
+    mine = set(friendId for (friendId,) in db.session.query(Friend.friendId).filter(Friend.userId == userId))
+    theirs = set(friendId for (friendId,) in db.session.query(Friend.friendId).filter(Friend.userId == otherId))
+    common = mine.intersection(theirs).difference([userId, otherId])
+    if not common:
+        return []
+    return db.session.query(User.id, User.name, User.profileImgUrl).filter(User.id.in_(common)).all()
+
+
+def getPairs(adjacency, hubs):
+    pairs = []
+    for userId in sorted(adjacency, key=lambda userId: (-len(adjacency[userId]), userId))[:hubs]:
+        hubFriendId = max(adjacency[userId], key=lambda friendId: (len(adjacency[friendId]), -friendId))
+        pairs.append(("friend", userId, hubFriendId))
+        pairs.append(("second", userId, getBestSecondDegreeFriend(adjacency, userId)))
+    return pairs
+
+
+def timeCalls(function, userId, otherId, iterations):
+    durations = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = function(userId, otherId)
+        durations.append((time.perf_counter() - start) * 1000)
+        db.session.close()
+    durations.sort()
+    return durations[len(durations) // 2], durations[min(len(durations) - 1, int(len(durations) * 0.95))], len(result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mutual friends of high degree users.")
+    parser.add_argument("--database-uri", help="Empty database to seed. Defaults to a temporary SQLite file.")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--mean-degree", type=int, default=40)
+    parser.add_argument("--degree-exponent", type=float, default=2.1)
+    parser.add_argument("--hubs", type=int, default=3, help="How many of the highest degree users to measure.")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    databaseUri = args.database_uri
+    if not databaseUri:
+        handle, path = tempfile.mkstemp(prefix="circles-mutual-", suffix=".db")
+        os.close(handle)
+        databaseUri = "sqlite:///" + path
+
+    logs.startListener(sys.stderr)
+    app = create_app(databaseUri, checkSchema=False, replicaUris=[])
+    with app.app_context():
+        db.create_all()
+        graph = seedGraph(users=args.users, meanDegree=args.mean_degree, degreeExponent=args.degree_exponent, postsPerUser=0, \
+                          accessRequestsPerUser=0, friendRequestsPerUser=0, seed=args.seed)
+        adjacency = graph["adjacency"]
+        print("Seeded " + str(graph["users"]) + " users and " + str(graph["edges"]) + " friendships.")
+
+        cases = collections.OrderedDict([("query", mutualFriends.getMutualFriends), ("lists", getFriendListsIntersection)])
+        print("%-8s %7s %7s %7s %-8s %-6s %9s %9s" % ("pair", "user", "other", "mutual", "index", "method", "p50 ms", "p95 ms"))
+        for indexed in (True, False):
+            if not indexed:
+                db.session.execute("DROP INDEX " + INDEX_NAME)
+                db.session.commit()
+            for kind, userId, otherId in getPairs(adjacency, args.hubs):
+                for method, function in cases.items():
+                    p50, p95, count = timeCalls(function, userId, otherId, args.iterations)
+                    print("%-8s %7d %7d %7d %-8s %-6s %9.2f %9.2f" % (kind, len(adjacency[userId]), len(adjacency[otherId]), \
+                          count, "yes" if indexed else "no", method, p50, p95))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+import argparse, base64, collections, datetime, json, os, pytz, shutil, sys, tempfile, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks import stubs
+stubs.install()
+
+from Circles import create_app, constants, friendGraph, logs
+from Circles.models import db, AccessRequest, AuthCodeVerification, Card, FriendRequest, Post, User
+from Circles.APIs import apiBlueprint
+from benchmarks.seed import seedGraph
+
+# Drives every route of the API blueprint through the Flask test client against a seeded database and reports
+# latency and SQL query counts. The run fails when a route issues more queries than its budget in budgets.json or
+# answers with a server error.
+#
+#   python -m benchmarks.run                                   # temporary SQLite database
+#   python -m benchmarks.run --database-uri postgresql://...   # an empty local Postgres database
+#   python -m benchmarks.run --replica-uri sqlite:////tmp/replica.db   # read-only handlers served from a copy
+
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "budgets.json")
+
+# A conditional scenario fetches its path once during setup and then sends the ETag it got back as If-None-Match
+Scenario = collections.namedtuple("Scenario", ["name", "method", "rule", "build", "conditional"], defaults=(False,))
+
+
+class QueryCounter(object):
+    """
+    Counts the statements run between start() and stop(). Those on the LastWrite table, which only run with read
+    replicas to keep a writer's reads on the primary, are also counted apart in routing.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.count = 0
+        self.routing = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.active:
+            self.count += 1
+            if '"LastWrite"' in statement:
+                self.routing += 1
+
+    def start(self):
+        self.count = 0
+        self.routing = 0
+        self.active = True
+
+    def stop(self):
+        self.active = False
+        return self.count
+
+
+class Context(object):
+    """State shared by the scenarios: the acting user, some of its relations and a counter for unique values."""
+
+    def __init__(self, graph):
+        self.now = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+        self.adjacency = graph["adjacency"]
+        self.actorId = max(self.adjacency, key=lambda userId: len(self.adjacency[userId]))
+        self.friendIds = sorted(self.adjacency[self.actorId])
+        actor = User.query.get(self.actorId)
+        self.actorPhone = actor.phoneNumber
+        self.actorFcmToken = actor.fcmToken
+        self.token = actor.generate_auth_token(expiration=constants.TOKEN_EXPIRATION, key=os.environ["SECRET_KEY"]).decode("ascii")
+        self.otherIdCode = User.query.get(self.friendIds[0]).idCode
+        self.hubFriendId = max(self.friendIds, key=lambda userId: (len(self.adjacency[userId]), -userId))
+        self.secondDegreeId = getBestSecondDegreeFriend(self.adjacency, self.actorId)
+        self.cardId = db.session.query(Card.id).filter(Card.objectType != constants.CARD_TYPE_TAG).order_by(Card.id).first()[0]
+        self.tagId = db.session.query(Card.tagId).filter(Card.id == self.cardId).scalar()
+        self.cardIds = [cardId for (cardId,) in db.session.query(Card.id).filter(Card.objectType != constants.CARD_TYPE_TAG).limit(4)]
+        self.postId = db.session.query(Post.id).filter(Post.creatorId == self.actorId).first()[0]
+        self.accessRequestId = db.session.query(AccessRequest.id).filter(AccessRequest.toUserId == self.actorId).first()[0]
+        self.friendRequestId = db.session.query(FriendRequest.id).filter(FriendRequest.toUserId == self.actorId).first()[0]
+        self.sequence = 0
+        db.session.close()
+
+    def nextValue(self):
+        self.sequence += 1
+        return self.sequence
+
+    def newPhoneNumber(self):
+        return "+1555" + str(self.nextValue()).zfill(7)
+
+    def newUser(self):
+        """Inserts a user unrelated to the actor and returns its id."""
+        value = self.nextValue()
+        user = User(name="Stranger " + str(value), phoneNumber="+1444" + str(value).zfill(7), idCode="S" + str(value).zfill(5), \
+                    fcmToken="fcm-stranger-" + str(value), upiID="", cards=[], suspended=False, joined="N/A", profileImgUrl="")
+        db.session.add(user)
+        db.session.commit()
+        userId = user.id
+        db.session.close()
+        return userId
+
+    def newFriendRequestToActor(self):
+        senderId = self.newUser()
+        friendRequest = FriendRequest(fromUserId=senderId, toUserId=self.actorId, pairKey=FriendRequest.getPairKey(senderId, self.actorId), \
+                                      createdOn=self.now, status=constants.FRIEND_REQUEST_ACTIVE)
+        db.session.add(friendRequest)
+        db.session.commit()
+        requestId = friendRequest.id
+        db.session.close()
+        return requestId
+
+    def newAccessRequestToActor(self):
+        accessRequest = AccessRequest(fromUserId=self.friendIds[-1], toUserId=self.actorId, cardId=self.cardId, amount=100, \
+                                      shortDesc="benchmark", status=constants.ACCESS_REQUEST_UNACCEPTED, createdOn=self.now)
+        db.session.add(accessRequest)
+        db.session.commit()
+        requestId = accessRequest.id
+        db.session.close()
+        return requestId
+
+    def newAuthCode(self, phoneNumber):
+        verification = AuthCodeVerification(phoneNumber=phoneNumber, code="123456", \
+                                            expiration=self.now + datetime.timedelta(minutes=10))
+        db.session.add(verification)
+        db.session.commit()
+        db.session.close()
+
+
+def getScenarios():
+    """Each scenario builds (path, json body) for one request; any setup it does is not measured."""
+    get = lambda path: (lambda ctx: (path, None))
+    return [
+        Scenario("friends", "GET", "/user/friends", get("/user/friends")),
+        Scenario("friends?limit", "GET", "/user/friends", get("/user/friends?limit=20")),
+        Scenario("profile", "GET", "/user/profile", get("/user/profile")),
+        Scenario("profile?id", "GET", "/user/profile", lambda ctx: ("/user/profile?id=" + str(ctx.friendIds[0]), None)),
+        Scenario("profile?etag", "GET", "/user/profile", get("/user/profile"), True),
+        Scenario("profiles", "GET", "/user/profiles", profilesRequest),
+        Scenario("mutualFriends", "GET", "/user/mutualFriends", lambda ctx: ("/user/mutualFriends?id=" + str(ctx.secondDegreeId), None)),
+        Scenario("mutualFriends?hub", "GET", "/user/mutualFriends", lambda ctx: ("/user/mutualFriends?id=" + str(ctx.hubFriendId), None)),
+        Scenario("searchUser", "GET", "/user/searchUser", lambda ctx: ("/user/searchUser?idCode=" + ctx.otherIdCode, None)),
+        Scenario("idCode", "GET", "/user/idCode", get("/user/idCode")),
+        Scenario("cardholders", "GET", "/user/search/cardholders", lambda ctx: ("/user/search/cardholders?cardId=" + str(ctx.cardId), None)),
+        Scenario("cardholders?tag", "GET", "/user/search/cardholders", lambda ctx: ("/user/search/cardholders?cardId=" + str(ctx.tagId), None)),
+        Scenario("virgilJWT", "GET", "/user/getVirgilJWT", get("/user/getVirgilJWT")),
+        Scenario("chatNotification", "POST", "/user/sendChatNotification", \
+                 lambda ctx: ("/user/sendChatNotification", {"data": {"text": "hi"}, "to": "fcm-" + str(ctx.friendIds[0])})),
+        Scenario("updateUPI", "POST", "/user/updateUPI", lambda ctx: ("/user/updateUPI", {"upiID": "actor" + str(ctx.nextValue()) + "@upi"})),
+        Scenario("updateCards", "POST", "/user/updateCards", \
+                 lambda ctx: ("/user/updateCards", {"cards": json.dumps([{"id": cardId} for cardId in ctx.cardIds[ctx.nextValue() % 2:]])})),
+        Scenario("cards", "GET", "/card/all", get("/card/all")),
+        Scenario("cards?type", "GET", "/card/filter", get("/card/filter?type=" + constants.CARD_TYPE_TAG)),
+        Scenario("cards?etag", "GET", "/card/all", get("/card/all"), True),
+        Scenario("posts?sent", "GET", "/posts/all", get("/posts/all?type=sent")),
+        Scenario("posts?received", "GET", "/posts/all", get("/posts/all?type=received")),
+        Scenario("posts?received&limit", "GET", "/posts/all", get("/posts/all?type=received&limit=" + str(constants.MAX_PAGE_SIZE))),
+        Scenario("post", "GET", "/posts", lambda ctx: ("/posts?id=" + str(ctx.postId), None)),
+        Scenario("post?etag", "GET", "/posts", lambda ctx: ("/posts?id=" + str(ctx.postId), None), True),
+        Scenario("newPost", "POST", "/posts/new", lambda ctx: ("/posts/new", {"text": "Benchmark post " + str(ctx.nextValue())})),
+        Scenario("accessRequest", "GET", "/accessRequests", lambda ctx: ("/accessRequests?id=" + str(ctx.accessRequestId), None)),
+        Scenario("accessRequests?received", "GET", "/accessRequests/received", get("/accessRequests/received")),
+        Scenario("accessRequests?sent", "GET", "/accessRequests/sent", get("/accessRequests/sent")),
+        Scenario("newAccessRequest", "POST", "/accessRequests/new", \
+                 lambda ctx: ("/accessRequests/new", {"to": ctx.friendIds[0], "amount": 500, "cardId": ctx.cardId, "shortDesc": "benchmark"})),
+        Scenario("newAccessRequest?second", "POST", "/accessRequests/new", \
+                 lambda ctx: ("/accessRequests/new", {"to": ctx.secondDegreeId, "amount": 500, "cardId": ctx.cardId, "shortDesc": "benchmark"})),
+        Scenario("respondAccessRequest", "POST", "/accessRequests/respond", \
+                 lambda ctx: ("/accessRequests/respond", {"requestId": ctx.newAccessRequestToActor(), "action": constants.ACCESS_REQUEST_ACCEPTED})),
+        Scenario("friendRequest", "GET", "/friendRequests", lambda ctx: ("/friendRequests?id=" + str(ctx.friendRequestId), None)),
+        Scenario("friendRequests?received", "GET", "/friendRequests/received", get("/friendRequests/received")),
+        Scenario("friendRequests?sent", "GET", "/friendRequests/sent", get("/friendRequests/sent")),
+        Scenario("newFriendRequest", "POST", "/friendRequests/new", lambda ctx: ("/friendRequests/new", {"to": ctx.newUser()})),
+        Scenario("respondFriendRequest", "POST", "/friendRequests/respond", \
+                 lambda ctx: ("/friendRequests/respond", {"requestId": ctx.newFriendRequestToActor(), "action": constants.FRIEND_REQUEST_ACCEPTED})),
+        Scenario("cancelFriendRequest", "POST", "/friendRequests/cancel", \
+                 lambda ctx: ("/friendRequests/cancel", {"requestId": ctx.newFriendRequestToActor()})),
+        Scenario("removeFriend", "POST", "/friends/remove", lambda ctx: ("/friends/remove", {"friendId": ctx.friendIds.pop()})),
+        Scenario("userExists", "GET", "/auth/userExists", lambda ctx: ("/auth/userExists?idCode=" + ctx.otherIdCode, None)),
+        Scenario("sendAuthCode", "POST", "/auth/sendAuthCode", lambda ctx: ("/auth/sendAuthCode", {"phoneNumber": ctx.actorPhone, "mustExist": True})),
+        Scenario("verifyAuthCode", "POST", "/auth/verifyAuthCode", verifyAuthCodeRequest),
+        Scenario("phoneAuthLogin", "POST", "/auth/phoneAuthLogin", \
+                 lambda ctx: ("/auth/phoneAuthLogin", {"phoneNumber": ctx.actorPhone, "fcmToken": ctx.actorFcmToken})),
+        Scenario("signup", "POST", "/auth/signup", signupRequest),
+    ]
+
+
+def getBestSecondDegreeFriend(adjacency, userId):
+    """The user who is not a friend of userId but has the most friends in common with them."""
+    friendIds = set(adjacency[userId])
+    mutualCounts = collections.Counter(secondId for friendId in friendIds for secondId in set(adjacency[friendId]) \
+                                       if secondId != userId and secondId not in friendIds)
+    return min(mutualCounts, key=lambda secondId: (-mutualCounts[secondId], secondId))
+
+
+def profilesRequest(ctx):
+    """The actor, a page of friends, a stranger and an invalid id."""
+    ids = [ctx.actorId] + ctx.friendIds[:constants.MAX_PROFILES_PER_REQUEST - 3] + [ctx.newUser(), "x"]
+    return "/user/profiles?ids=" + ",".join(str(userId) for userId in ids), None
+
+
+def verifyAuthCodeRequest(ctx):
+    phoneNumber = ctx.newPhoneNumber()
+    ctx.newAuthCode(phoneNumber)
+    return "/auth/verifyAuthCode", {"phoneNumber": phoneNumber, "code": "123456"}
+
+
+def signupRequest(ctx):
+    return "/auth/signup", {"name": "New User", "phoneNumber": ctx.newPhoneNumber(), "inviteCode": "", "phoneAuth": True, \
+                            "fcmToken": "fcm-new", "cards": json.dumps([{"id": cardId} for cardId in ctx.cardIds])}
+
+
+def getUncoveredRoutes(app, scenarios):
+    covered = set((scenario.rule, scenario.method) for scenario in scenarios)
+    uncovered = []
+    for rule in app.url_map.iter_rules():
+        if not rule.endpoint.startswith(apiBlueprint.name + "."):
+            continue
+        for method in rule.methods.difference(["HEAD", "OPTIONS"]):
+            if (rule.rule, method) not in covered:
+                uncovered.append(method + " " + rule.rule)
+    return sorted(uncovered)
+
+
+def getPercentile(values, percentile):
+    ordered = sorted(values)
+    index = max(0, int(round(percentile / 100.0 * len(ordered) + 0.5)) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def runScenario(app, client, counter, ctx, scenario, iterations):
+    headers = {"Authorization": "Basic " + base64.b64encode((ctx.token + ":unused").encode("utf-8")).decode("ascii")}
+    latencies = []
+    queries = []
+    routing = []
+    statuses = set()
+    for _ in range(iterations):
+        # Setup runs in its own app context so each request still gets a fresh session
+        with app.app_context():
+            path, body = scenario.build(ctx)
+        requestHeaders = dict(headers)
+        if scenario.conditional:
+            requestHeaders["If-None-Match"] = client.open(path, method=scenario.method, json=body, headers=headers).headers["ETag"]
+        counter.start()
+        start = time.perf_counter()
+        # Buffered, so the queries and time of streamed responses are counted
+        response = client.open(path, method=scenario.method, json=body, headers=requestHeaders, buffered=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.stop() - counter.routing)
+        routing.append(counter.routing)
+        statuses.add(response.status_code)
+
+    return {"p50": getPercentile(latencies, 50), "p95": getPercentile(latencies, 95), "queries": max(queries), \
+            "routing": max(routing),             "statuses": sorted(statuses)}
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks the Circles API over a synthetic social graph.")
+    parser.add_argument("--database-uri", help="Empty database to seed. Defaults to a temporary SQLite file.")
+    parser.add_argument("--replica-uri", help="Database to use as a read replica. A SQLite replica of a SQLite database " \
+                        "gets a copy of the seeded data; any other replica must be replicating from --database-uri.")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--mean-degree", type=int, default=12)
+    parser.add_argument("--degree-exponent", type=float, default=2.5)
+    parser.add_argument("--cards", type=int, default=60)
+    parser.add_argument("--tags", type=int, default=6)
+    parser.add_argument("--cards-per-user", type=int, default=3)
+    parser.add_argument("--posts-per-user", type=int, default=5)
+    parser.add_argument("--access-requests-per-user", type=int, default=3)
+    parser.add_argument("--friend-requests-per-user", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--only", help="Comma separated scenario names to run.")
+    parser.add_argument("--budgets", default=BUDGETS_FILE, help="JSON file of scenario name -> maximum SQL queries.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    databaseUri = args.database_uri
+    if not databaseUri:
+        handle, path = tempfile.mkstemp(prefix="circles-benchmark-", suffix=".db")
+        os.close(handle)
+        databaseUri = "sqlite:///" + path
+
+    logs.startListener(sys.stderr) # keeps the report alone on stdout
+    replicaUris = [args.replica_uri] if args.replica_uri else []
+    app = create_app(databaseUri, checkSchema=False, replicaUris=replicaUris)
+    app.register_blueprint(apiBlueprint)
+    failures = []
+    with app.app_context():
+        db.create_all()
+        if User.query.first():
+            print("ERROR: The benchmark database must be empty: " + databaseUri)
+            return 2
+
+        start = time.perf_counter()
+        graph = seedGraph(users=args.users, meanDegree=args.mean_degree, degreeExponent=args.degree_exponent, cards=args.cards, \
+                          tags=args.tags, cardsPerUser=args.cards_per_user, postsPerUser=args.posts_per_user, \
+                          accessRequestsPerUser=args.access_requests_per_user, friendRequestsPerUser=args.friend_requests_per_user, \
+                          seed=args.seed)
+        if args.replica_uri and databaseUri.startswith("sqlite:///") and args.replica_uri.startswith("sqlite:///"):
+            shutil.copyfile(databaseUri[len("sqlite:///"):], args.replica_uri[len("sqlite:///"):])
+        ctx = Context(graph)
+        friendGraph.getGraph(app) # snapshot of the seeded friendships, as a running host has one
+        print("Seeded " + str(graph["users"]) + " users, " + str(graph["edges"]) + " friendships, " + str(graph["posts"]) + " posts, " \
+              + str(graph["accessRequests"]) + " access requests in " + str(round(time.perf_counter() - start, 2)) + "s. Actor " \
+              + str(ctx.actorId) + " has " + str(len(ctx.friendIds)) + " friends.")
+
+        # Counts the statements of every engine, replicas included
+        counter = QueryCounter()
+        event.listen(Engine, "before_cursor_execute", counter)
+
+    with open(args.budgets) as budgetsFile:
+        budgets = json.load(budgetsFile)
+
+    scenarios = getScenarios()
+    uncovered = getUncoveredRoutes(app, scenarios)
+    for route in uncovered:
+        failures.append("No scenario drives " + route)
+    if args.only:
+        names = set(args.only.split(","))
+        scenarios = [scenario for scenario in scenarios if scenario.name in names]
+
+    results = collections.OrderedDict()
+    client = app.test_client()
+    for scenario in scenarios:
+        result = runScenario(app, client, counter, ctx, scenario, args.iterations)
+        result["budget"] = budgets.get(scenario.name)
+        results[scenario.name] = result
+        if result["budget"] is None:
+            failures.append(scenario.name + " has no query budget")
+        elif result["queries"] > result["budget"]:
+            failures.append(scenario.name + " issued " + str(result["queries"]) + " queries, budget is " + str(result["budget"]))
+        if any(status >= constants.STATUS_SERVER_ERROR for status in result["statuses"]):
+            failures.append(scenario.name + " returned " + ",".join(str(status) for status in result["statuses"]))
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2))
+    else:
+        print("%-26s %9s %9s %8s %7s %8s  %s" % ("scenario", "p50 ms", "p95 ms", "queries", "budget", "routing", "statuses"))
+        for name, result in results.items():
+            print("%-26s %9.2f %9.2f %8d %7s %8d  %s" % (name, result["p50"], result["p95"], result["queries"], \
+                  "-" if result["budget"] is None else result["budget"], result["routing"], \
+                  ",".join(str(status) for status in result["statuses"])))
+        for failure in failures:
+            print("FAILED: " + failure)
+
+    if not args.database_uri:
+        shutil.rmtree(app.config["FRIEND_GRAPH_DIR"], ignore_errors=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
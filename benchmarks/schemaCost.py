@@ -0,0 +1,75 @@
+import argparse, os, shutil, sys, tempfile
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks import stubs
+stubs.install()
+
+from Circles import create_app, friendGraph, logs
+from Circles.models import db
+from Circles.APIs import apiBlueprint
+from benchmarks.run import Context, QueryCounter, getScenarios, runScenario
+from benchmarks.seed import seedGraph
+
+# What the db.create_all() the handlers used to call on every request cost: a few representative scenarios run
+# as they are now, then with db.create_all() before each request as before the schema moved to migrations.
+#
+#   python -m benchmarks.schemaCost --iterations 50
+#   python -m benchmarks.schemaCost --database-uri postgresql://localhost/circles_bench
+
+SCENARIOS = ["friends", "profile", "posts?received", "accessRequests?received", "newPost", "respondFriendRequest"]
+
+
+def createSchema():
+    db.create_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-request cost of db.create_all().")
+    parser.add_argument("--database-uri", help="Empty database to seed. Defaults to a temporary SQLite file.")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--mean-degree", type=int, default=12)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    databaseUri = args.database_uri
+    if not databaseUri:
+        handle, path = tempfile.mkstemp(prefix="circles-schema-", suffix=".db")
+        os.close(handle)
+        databaseUri = "sqlite:///" + path
+
+    logs.startListener(sys.stderr)
+    app = create_app(databaseUri, checkSchema=False, replicaUris=[])
+    app.register_blueprint(apiBlueprint)
+    with app.app_context():
+        db.create_all()
+        ctx = Context(seedGraph(users=args.users, meanDegree=args.mean_degree, seed=args.seed))
+        friendGraph.getGraph(app)
+    counter = QueryCounter()
+    event.listen(Engine, "before_cursor_execute", counter)
+
+    scenarios = [scenario for scenario in getScenarios() if scenario.name in SCENARIOS]
+    client = app.test_client()
+    results = {}
+    for case in ("migrations", "create_all"):
+        if case == "create_all":
+            app.before_request(createSchema)
+        for scenario in scenarios:
+            results[(scenario.name, case)] = runScenario(app, client, counter, ctx, scenario, args.iterations)
+
+    print("%-26s %9s %9s %9s %9s %10s %10s" % ("scenario", "queries", "p50 ms", "p95 ms", "before q", "before p50", "before p95"))
+    for scenario in scenarios:
+        after = results[(scenario.name, "migrations")]
+        before = results[(scenario.name, "create_all")]
+        print("%-26s %9d %9.2f %9.2f %9d %10.2f %10.2f" % (scenario.name, after["queries"], after["p50"], after["p95"], \
+              before["queries"], before["p50"], before["p95"]))
+
+    if not args.database_uri:
+        shutil.rmtree(app.config["FRIEND_GRAPH_DIR"], ignore_errors=True)
+        os.remove(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import datetime, pytz, random
+from werkzeug.security import generate_password_hash
+from Circles import constants
+from Circles.models import db, AccessRequest, Card, Friend, FriendRequest, Post, User, UserCard
+
+# Seeds a database with a synthetic social graph. Degrees follow a Pareto distribution (Chung-Lu style sampling)
+# so a few users have very large circles, which is where N+1 query patterns show up.
+
+
+def seedGraph(users=200, meanDegree=10, degreeExponent=2.5, cards=60, tags=6, cardsPerUser=3, postsPerUser=5, \
+              accessRequestsPerUser=3, friendRequestsPerUser=2, seed=7):
+    rng = random.Random(seed)
+    tz = pytz.timezone(constants.TIMEZONE_KOLKATA)
+    now = datetime.datetime.now(tz=tz)
+    password = generate_password_hash("benchmark")
+
+    # Card catalog: tags first, then cards that belong to a tag
+    cardRows = [{"id": tagId, "name": "Tag " + str(tagId), "objectType": constants.CARD_TYPE_TAG, "tagId": None} \
+                for tagId in range(1, tags + 1)]
+    cardIds = list(range(tags + 1, tags + cards + 1))
+    for cardId in cardIds:
+        cardRows.append({"id": cardId, "name": "Card " + str(cardId), "objectType": "Card", "tagId": rng.randint(1, tags)})
+    db.session.bulk_insert_mappings(Card, cardRows)
+
+    userIds = list(range(1, users + 1))
+    userCards = {userId: rng.sample(cardIds, min(cardsPerUser, len(cardIds))) for userId in userIds}
+    userRows = []
+    for userId in userIds:
+        userRows.append({"id": userId, "idCode": "U" + str(userId).zfill(5), "name": "User " + str(userId), \
+                         "phoneNumber": "+91" + str(9000000000 + userId), "password": password, "fcmToken": "fcm-" + str(userId), \
+                         "upiID": "user" + str(userId) + "@upi", "cards": userCards[userId], "suspended": False, \
+                         "joined": "N/A", "profileImgUrl": "https://img.example/" + str(userId)})
+    db.session.bulk_insert_mappings(User, userRows)
+    db.session.bulk_insert_mappings(UserCard, [{"userId": userId, "cardId": cardId} \
+                                               for userId in userIds for cardId in userCards[userId]])
+
+    # Friendships: sample endpoints proportionally to heavy tailed weights until the target edge count is reached
+    weights = [rng.paretovariate(degreeExponent - 1) for _ in userIds]
+    targetEdges = min(users * meanDegree // 2, users * (users - 1) // 2)
+    edges = set()
+    while len(edges) < targetEdges:
+        first, second = rng.choices(userIds, weights=weights, k=2)
+        if first != second:
+            edges.add((min(first, second), max(first, second)))
+
+    friendRequestRows = []
+    friendRows = []
+    requestId = 0
+    for first, second in sorted(edges):
+        requestId += 1
+        startedOn = now - datetime.timedelta(days=rng.randint(1, 365))
+        friendRequestRows.append({"id": requestId, "fromUserId": first, "toUserId": second, \
+                                  "pairKey": FriendRequest.getPairKey(first, second), "createdOn": startedOn, \
+                                  "resolvedOn": startedOn, "status": constants.FRIEND_REQUEST_ACCEPTED})
+        friendRows.append({"userId": first, "friendId": second, "fRequestId": requestId, "startedOn": startedOn})
+        friendRows.append({"userId": second, "friendId": first, "fRequestId": requestId, "startedOn": startedOn})
+
+    # Pending friend requests between users who are not friends yet
+    pairs = set(edges)
+    for userId in userIds:
+        for _ in range(friendRequestsPerUser):
+            other = rng.choice(userIds)
+            pair = (min(userId, other), max(userId, other))
+            if other == userId or pair in pairs:
+                continue
+            pairs.add(pair)
+            requestId += 1
+            friendRequestRows.append({"id": requestId, "fromUserId": other, "toUserId": userId, \
+                                      "pairKey": FriendRequest.getPairKey(userId, other), \
+                                      "createdOn": now - datetime.timedelta(hours=rng.randint(1, 200)), \
+                                      "status": constants.FRIEND_REQUEST_ACTIVE})
+    db.session.bulk_insert_mappings(FriendRequest, friendRequestRows)
+    db.session.bulk_insert_mappings(Friend, friendRows)
+
+    postRows = []
+    for userId in userIds:
+        for postIndex in range(postsPerUser):
+            postRows.append({"text": "Post " + str(postIndex) + " from " + str(userId), "creatorId": userId, \
+                             "createdOn": now - datetime.timedelta(minutes=rng.randint(1, 60 * 24 * 30))})
+    db.session.bulk_insert_mappings(Post, postRows)
+
+    adjacency = {}
+    for first, second in edges:
+        adjacency.setdefault(first, []).append(second)
+        adjacency.setdefault(second, []).append(first)
+
+    accessRequestRows = []
+    statuses = [constants.ACCESS_REQUEST_UNACCEPTED, constants.ACCESS_REQUEST_ACCEPTED, constants.ACCESS_REQUEST_REJECTED]
+    for userId in userIds:
+        friends = adjacency.get(userId)
+        if not friends:
+            continue
+        for _ in range(accessRequestsPerUser):
+            recipient = rng.choice(friends)
+            accessRequestRows.append({"fromUserId": userId, "toUserId": recipient, "cardId": rng.choice(userCards[recipient]), \
+                                      "amount": rng.randint(100, 5000), "shortDesc": "benchmark", "status": rng.choice(statuses), \
+                                      "createdOn": now - datetime.timedelta(hours=rng.randint(1, 48))})
+    db.session.bulk_insert_mappings(AccessRequest, accessRequestRows)
+    db.session.commit()
+
+    return {"users": users, "edges": len(edges), "friendRequests": len(friendRequestRows), "posts": len(postRows), \
+            "accessRequests": len(accessRequestRows), "adjacency": adjacency}
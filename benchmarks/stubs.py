@@ -0,0 +1,61 @@
+import os
+from Circles import utils
+from Circles.APIs import users
+
+# Replaces the calls to FCM, Twilio and Virgil with in-process fakes so benchmarks only measure the server.
+
+ENVIRONMENT = {
+    "SECRET_KEY": "benchmark-secret",
+    "APP_KEY": "benchmark-app-key",
+    "LOGO_URL": "https://logo.example/logo.png",
+    "TWILIO_ACCOUNT_SID": "ACbenchmark",
+    "TWILIO_AUTH_TOKEN": "benchmark",
+    "TWILIO_PHONE_NUMBER": "+10000000000",
+    "ABHIRAM": "+10000000001",
+    "ANCHAL": "+10000000002",
+}
+
+
+class FakeMessages(object):
+    def __init__(self):
+        self.sent = []
+
+    def create(self, body, from_, to):
+        self.sent.append((to, body))
+
+
+class FakeSMSClient(object):
+    def __init__(self):
+        self.messages = FakeMessages()
+
+
+class FakeToken(object):
+    def __init__(self, identity):
+        self.identity = identity
+
+    def to_string(self):
+        return "virgil-token-" + self.identity
+
+
+class FakeJwtGenerator(object):
+    def generate_token(self, identity):
+        return FakeToken(identity)
+
+
+def sendDeviceNotification(registration_token, notification, data):
+    return True
+
+
+def sendMulticastNotification(registration_tokens, notification, data):
+    return {token: True for token in registration_tokens if token}
+
+
+def install():
+    for key, value in ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+
+    smsClient = FakeSMSClient()
+    utils.getSMSClient = lambda: smsClient
+    utils.sendDeviceNotification = sendDeviceNotification
+    utils.sendMulticastNotification = sendMulticastNotification
+    users.buildVirgilJwtGenerator = FakeJwtGenerator
@@ -0,0 +1,64 @@
+import argparse, os, sys, time
+from virgil_crypto import VirgilCrypto
+from virgil_crypto.access_token_signer import AccessTokenSigner
+from virgil_sdk.jwt import JwtGenerator
+from virgil_sdk.utils import Utils
+from Circles import constants
+from Circles.APIs import users
+
+# Virgil JWTs minted per second with the real virgil_crypto and a key generated for the run: the former handler,
+# which imported the key and built a JwtGenerator on every call, against the generator kept by the worker and
+# against users.getVirgilToken() with its per-user cache. Tokens of --users identities are requested in turn, so
+# the cache hits once every identity has been seen within VIRGIL_TOKEN_REUSE_SECONDS.
+#
+#   python -m benchmarks.virgilCost --users 200 --iterations 2000
+
+
+def generateBefore(identity):
+    crypto = VirgilCrypto()
+    imported_key = crypto.import_private_key(Utils.b64decode(os.environ["VIRGIL_API_PRIVATE_KEY_ID"])).private_key
+    builder = JwtGenerator(os.environ["VIRGIL_API_ID"], imported_key, os.environ["VIRGIL_API_KEY_ID"], \
+                           constants.VIRGIL_TOKEN_TTL_SECONDS, AccessTokenSigner())
+    return builder.generate_token(str(identity)).to_string()
+
+
+def measure(generate, identities, iterations):
+    durations = []
+    for index in range(iterations):
+        identity = identities[index % len(identities)]
+        start = time.perf_counter()
+        generate(identity)
+        durations.append((time.perf_counter() - start) * 1e6)
+    durations.sort()
+    return durations[len(durations) // 2], durations[min(len(durations) - 1, int(len(durations) * 0.99))], \
+            len(durations) / (sum(durations) / 1e6)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Virgil JWTs minted per second.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    crypto = VirgilCrypto()
+    keyPair = crypto.generate_key_pair()
+    os.environ["VIRGIL_API_ID"] = "benchmark-app"
+    os.environ["VIRGIL_API_KEY_ID"] = "benchmark-key"
+    os.environ["VIRGIL_API_PRIVATE_KEY_ID"] = Utils.b64encode(crypto.export_private_key(keyPair.private_key))
+
+    generator = users.buildVirgilJwtGenerator()
+    identities = list(range(1, args.users + 1))
+    cases = [("key import + generator", generateBefore), \
+             ("cached generator", lambda identity: generator.generate_token(str(identity)).to_string()), \
+             ("getVirgilToken", users.getVirgilToken)]
+
+    print("%-28s %10s %10s %12s" % ("token", "p50 us", "p99 us", "per second"))
+    for name, generate in cases:
+        measure(generate, identities, len(identities)) # warm up, and fills the per-user cache
+        p50, p99, perSecond = measure(generate, identities, args.iterations)
+        print("%-28s %10.1f %10.1f %12.0f" % (name, p50, p99, perSecond))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
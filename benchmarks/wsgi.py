@@ -0,0 +1,24 @@
+import os, time
+from sqlalchemy import event
+from benchmarks import stubs
+stubs.install()
+
+from benchmarks.load import DATABASE_URI_ENV, DB_LATENCY_ENV
+
+from Circles import create_app
+from Circles.APIs import apiBlueprint
+from Circles.models import db
+
+# The app gunicorn serves during benchmarks.load: a seeded SQLite database whose statements each wait
+# CIRCLES_BENCHMARK_DB_LATENCY_MS, standing in for the round trip to RDS that a local database does not have.
+
+application = create_app(os.environ[DATABASE_URI_ENV], checkSchema=False, replicaUris=[])
+application.register_blueprint(apiBlueprint)
+
+dbLatency = float(os.environ.get(DB_LATENCY_ENV, 0)) / 1000
+if dbLatency:
+    def waitForDatabase(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(dbLatency) # cooperative under gevent, as psycopg2 is with the wait callback
+
+    with application.app_context():
+        event.listen(db.engine, "before_cursor_execute", waitForDatabase)
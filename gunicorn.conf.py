@@ -0,0 +1,48 @@
+import multiprocessing, os, shutil
+
+# gunicorn settings for serving application.py: `gunicorn application:application` from the repository root.
+# GUNICORN_WORKER_CLASS picks how each worker handles concurrent requests:
+# - gevent (default): one greenlet per request, up to GUNICORN_WORKER_CONNECTIONS per worker
+# - gthread: GUNICORN_THREADS threads per worker
+# - sync: one request at a time per worker, like mod_wsgi's default
+# The app is loaded once in the master and forked into the workers, see Circles/serving.py.
+
+workerClass = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+if workerClass == "gevent":
+    # Before anything else is imported, so every lock, socket and sleep of the app cooperates
+    from gevent import monkey
+    monkey.patch_all()
+
+# Samples left by the workers of a previous run would otherwise be summed into /metrics
+metricsDirectory = os.environ.get("prometheus_multiproc_dir")
+if metricsDirectory:
+    shutil.rmtree(metricsDirectory, ignore_errors=True)
+    os.makedirs(metricsDirectory, exist_ok=True)
+
+from Circles import serving
+
+os.environ[serving.PRELOAD_ENV] = "1"
+if workerClass == "gevent":
+    serving.installWaitCallback()
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = workerClass
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * (2 if workerClass == "sync" else 1) + 1))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+threads = int(os.environ.get("GUNICORN_THREADS", 8)) if workerClass == "gthread" else 1
+preload_app = True
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def pre_fork(server, worker):
+    serving.beforeFork(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    serving.afterFork(server.app.wsgi())
+
+
+def child_exit(server, worker):
+    serving.workerExited(worker.pid)
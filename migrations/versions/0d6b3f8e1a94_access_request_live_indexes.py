@@ -0,0 +1,37 @@
+"""access request live indexes
+
+Revision ID: 0d6b3f8e1a94
+Revises: e41a7b2c9d05
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d6b3f8e1a94'
+down_revision = 'e41a7b2c9d05'
+branch_labels = None
+depends_on = None
+
+ACCESS_REQUEST_UNACCEPTED = 0
+ACCESS_REQUEST_EXPIRED = 6
+
+
+def upgrade():
+    live = sa.text('"status" = ' + str(ACCESS_REQUEST_UNACCEPTED))
+    op.create_index('ix_access_request_live_created', 'AccessRequest', ['createdOn'], unique=False, postgresql_where=live)
+    op.create_index('ix_access_request_live_to', 'AccessRequest', ['toUserId', 'createdOn', 'id'], unique=False, postgresql_where=live)
+
+    # Materialize the expiry of existing unaccepted requests once; the sweeper keeps it up to date afterwards
+    op.execute('UPDATE "AccessRequest" SET "status" = ' + str(ACCESS_REQUEST_EXPIRED) \
+               + ' WHERE "status" = ' + str(ACCESS_REQUEST_UNACCEPTED) + " AND \"createdOn\" < now() - interval '1 day'")
+
+
+def downgrade():
+    # Only unaccepted requests are ever expired, so they can be put back; readers relabel them by age again
+    op.execute('UPDATE "AccessRequest" SET "status" = ' + str(ACCESS_REQUEST_UNACCEPTED) \
+               + ' WHERE "status" = ' + str(ACCESS_REQUEST_EXPIRED))
+    op.drop_index('ix_access_request_live_to', table_name='AccessRequest')
+    op.drop_index('ix_access_request_live_created', table_name='AccessRequest')
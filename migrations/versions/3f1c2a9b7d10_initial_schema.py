@@ -0,0 +1,107 @@
+"""initial schema
+
+Revision ID: 3f1c2a9b7d10
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('card',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('tagId', sa.Integer(), nullable=True),
+    sa.Column('objectType', sa.String(), nullable=True),
+    sa.Column('rewards', sa.Numeric(), nullable=True),
+    sa.Column('minAmount', sa.Numeric(), nullable=True),
+    sa.Column('users', postgresql.ARRAY(sa.String()), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('idCode', sa.String(), nullable=True),
+    sa.Column('inviteCodeUsed', sa.String(), nullable=True),
+    sa.Column('name', sa.String(length=40), nullable=True),
+    sa.Column('phoneNumber', sa.String(length=15), nullable=True),
+    sa.Column('password', sa.Unicode(length=200), nullable=True),
+    sa.Column('fcmToken', sa.String(), nullable=True),
+    sa.Column('upiID', sa.String(length=100), nullable=True),
+    sa.Column('cards', postgresql.ARRAY(sa.Integer()), nullable=True),
+    sa.Column('suspended', sa.Boolean(), nullable=True),
+    sa.Column('joined', sa.String(), nullable=True),
+    sa.Column('profileImgUrl', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('idCode'),
+    sa.UniqueConstraint('phoneNumber')
+    )
+    op.create_table('AuthCodeVerification',
+    sa.Column('phoneNumber', sa.String(), nullable=False),
+    sa.Column('code', sa.String(), nullable=True),
+    sa.Column('expiration', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('phoneNumber')
+    )
+    op.create_table('FriendRequest',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('fromUserId', sa.Integer(), nullable=True),
+    sa.Column('toUserId', sa.Integer(), nullable=True),
+    sa.Column('createdOn', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('resolvedOn', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('status', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['fromUserId'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['toUserId'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('Friend',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('userId', sa.Integer(), nullable=True),
+    sa.Column('friendId', sa.Integer(), nullable=True),
+    sa.Column('fRequestId', sa.Integer(), nullable=True),
+    sa.Column('startedOn', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['fRequestId'], ['FriendRequest.id'], ),
+    sa.ForeignKeyConstraint(['friendId'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['userId'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('AccessRequest',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('fromUserId', sa.Integer(), nullable=True),
+    sa.Column('toUserId', sa.Integer(), nullable=True),
+    sa.Column('cardId', sa.Integer(), nullable=True),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('shortDesc', sa.String(), nullable=True),
+    sa.Column('mutualFriendName', sa.String(), nullable=True),
+    sa.Column('status', sa.Integer(), nullable=True),
+    sa.Column('createdOn', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('resolvedOn', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['fromUserId'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['toUserId'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('Post',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('text', sa.String(), nullable=True),
+    sa.Column('creatorId', sa.Integer(), nullable=True),
+    sa.Column('createdOn', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['creatorId'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('Post')
+    op.drop_table('AccessRequest')
+    op.drop_table('Friend')
+    op.drop_table('FriendRequest')
+    op.drop_table('AuthCodeVerification')
+    op.drop_table('user')
+    op.drop_table('card')
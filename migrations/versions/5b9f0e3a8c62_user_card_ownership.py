@@ -0,0 +1,62 @@
+"""user card ownership table
+
+Revision ID: 5b9f0e3a8c62
+Revises: c72d5e0f9a41
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9f0e3a8c62'
+down_revision = 'c72d5e0f9a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    userCard = op.create_table('UserCard',
+    sa.Column('userId', sa.Integer(), nullable=False),
+    sa.Column('cardId', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['userId'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('userId', 'cardId')
+    )
+    op.create_index('ix_user_card_card', 'UserCard', ['cardId', 'userId'], unique=False)
+    backfill(userCard)
+
+
+def backfill(userCard):
+    """Copies ownership from user.cards and reports where card.users disagrees with it."""
+    bind = op.get_bind()
+    fromUsers = set()
+    for userId, cards in bind.execute(sa.text('SELECT id, cards FROM "user"')):
+        for cardId in cards or []:
+            fromUsers.add((userId, int(cardId)))
+
+    fromCards = set()
+    for cardId, users in bind.execute(sa.text('SELECT id, users FROM card')):
+        for userId in users or []:
+            try:
+                fromCards.add((int(userId), cardId))
+            except (TypeError, ValueError):
+                print('WARNING: Ignoring invalid user id: ' + str(userId) + ' in card.users of card: ' + str(cardId))
+
+    onlyInUsers = sorted(fromUsers - fromCards)
+    onlyInCards = sorted(fromCards - fromUsers)
+    print('Backfilling ' + str(len(fromUsers)) + ' card ownership rows from user.cards')
+    print('Drift: ' + str(len(onlyInUsers)) + ' (user, card) pairs only in user.cards, ' \
+          + str(len(onlyInCards)) + ' only in card.users')
+    for userId, cardId in onlyInUsers[:50]:
+        print('  only in user.cards: user ' + str(userId) + ' card ' + str(cardId))
+    for userId, cardId in onlyInCards[:50]:
+        print('  only in card.users: user ' + str(userId) + ' card ' + str(cardId))
+
+    if fromUsers:
+        op.bulk_insert(userCard, [{'userId': userId, 'cardId': cardId} for userId, cardId in sorted(fromUsers)])
+
+
+def downgrade():
+    op.drop_index('ix_user_card_card', table_name='UserCard')
+    op.drop_table('UserCard')
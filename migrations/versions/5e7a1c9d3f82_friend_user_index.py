@@ -0,0 +1,24 @@
+"""friend user index
+
+Revision ID: 5e7a1c9d3f82
+Revises: d3b8f2a6c417
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7a1c9d3f82'
+down_revision = 'd3b8f2a6c417'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_friend_user_friend', 'Friend', ['userId', 'friendId'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_friend_user_friend', table_name='Friend')
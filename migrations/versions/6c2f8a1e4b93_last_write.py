@@ -0,0 +1,28 @@
+"""last write
+
+Revision ID: 6c2f8a1e4b93
+Revises: 9b2e4d7c1f60
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c2f8a1e4b93'
+down_revision = '9b2e4d7c1f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('LastWrite',
+    sa.Column('userId', sa.Integer(), nullable=False),
+    sa.Column('writtenAt', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('userId')
+    )
+
+
+def downgrade():
+    op.drop_table('LastWrite')
@@ -0,0 +1,24 @@
+"""post feed index
+
+Revision ID: 8a4e6c1d2b37
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6c1d2b37'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_post_creator_created', 'Post', ['creatorId', 'createdOn', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_post_creator_created', table_name='Post')
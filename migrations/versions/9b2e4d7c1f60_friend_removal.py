@@ -0,0 +1,32 @@
+"""friend removal
+
+Revision ID: 9b2e4d7c1f60
+Revises: 5e7a1c9d3f82
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e4d7c1f60'
+down_revision = '5e7a1c9d3f82'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('FriendRemoval',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('userId', sa.Integer(), nullable=True),
+    sa.Column('friendId', sa.Integer(), nullable=True),
+    sa.Column('removedOn', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_friend_removal_removed', 'FriendRemoval', ['removedOn'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_friend_removal_removed', table_name='FriendRemoval')
+    op.drop_table('FriendRemoval')
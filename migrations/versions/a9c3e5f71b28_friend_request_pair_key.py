@@ -0,0 +1,44 @@
+"""friend request pair key and inbox indexes
+
+Revision ID: a9c3e5f71b28
+Revises: 0d6b3f8e1a94
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c3e5f71b28'
+down_revision = '0d6b3f8e1a94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('FriendRequest', sa.Column('pairKey', sa.String(), nullable=True))
+
+    # Key the newest request of every unordered pair; older duplicates keep a NULL key
+    op.execute('''
+        UPDATE "FriendRequest" SET "pairKey" = LEAST("fromUserId", "toUserId") || ':' || GREATEST("fromUserId", "toUserId")
+        WHERE id IN (
+            SELECT DISTINCT ON (LEAST("fromUserId", "toUserId"), GREATEST("fromUserId", "toUserId")) id
+            FROM "FriendRequest"
+            WHERE "fromUserId" IS NOT NULL AND "toUserId" IS NOT NULL
+            ORDER BY LEAST("fromUserId", "toUserId"), GREATEST("fromUserId", "toUserId"), "createdOn" DESC NULLS LAST, id DESC
+        )
+    ''')
+    duplicates = op.get_bind().execute(sa.text('SELECT count(*) FROM "FriendRequest" WHERE "pairKey" IS NULL')).scalar()
+    print('Friend requests left without a pair key (older duplicates): ' + str(duplicates))
+
+    op.create_unique_constraint('FriendRequest_pairKey_key', 'FriendRequest', ['pairKey'])
+    op.create_index('ix_friend_request_to_created', 'FriendRequest', ['toUserId', 'createdOn', 'id'], unique=False)
+    op.create_index('ix_friend_request_from_created', 'FriendRequest', ['fromUserId', 'createdOn', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_friend_request_from_created', table_name='FriendRequest')
+    op.drop_index('ix_friend_request_to_created', table_name='FriendRequest')
+    op.drop_constraint('FriendRequest_pairKey_key', 'FriendRequest', type_='unique')
+    op.drop_column('FriendRequest', 'pairKey')
@@ -0,0 +1,40 @@
+"""notification outbox
+
+Revision ID: c72d5e0f9a41
+Revises: 8a4e6c1d2b37
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c72d5e0f9a41'
+down_revision = '8a4e6c1d2b37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('NotificationOutbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('fcmToken', sa.String(), nullable=True),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('body', sa.String(), nullable=True),
+    sa.Column('imageUrl', sa.String(), nullable=True),
+    sa.Column('data', sa.Text(), nullable=True),
+    sa.Column('status', sa.Integer(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('lastError', sa.String(), nullable=True),
+    sa.Column('createdOn', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('nextAttemptOn', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('sentOn', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_due', 'NotificationOutbox', ['status', 'nextAttemptOn'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_due', table_name='NotificationOutbox')
+    op.drop_table('NotificationOutbox')
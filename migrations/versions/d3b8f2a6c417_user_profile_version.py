@@ -0,0 +1,24 @@
+"""user profile version
+
+Revision ID: d3b8f2a6c417
+Revises: a9c3e5f71b28
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3b8f2a6c417'
+down_revision = 'a9c3e5f71b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('profileVersion', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('user', 'profileVersion')
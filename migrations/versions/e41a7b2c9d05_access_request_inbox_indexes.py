@@ -0,0 +1,26 @@
+"""access request inbox indexes
+
+Revision ID: e41a7b2c9d05
+Revises: 5b9f0e3a8c62
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a7b2c9d05'
+down_revision = '5b9f0e3a8c62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_access_request_to_created', 'AccessRequest', ['toUserId', 'createdOn', 'id'], unique=False)
+    op.create_index('ix_access_request_from_created', 'AccessRequest', ['fromUserId', 'createdOn', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_access_request_from_created', table_name='AccessRequest')
+    op.drop_index('ix_access_request_to_created', table_name='AccessRequest')
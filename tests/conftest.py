@@ -0,0 +1,60 @@
+import base64, os, shutil
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks import stubs
+stubs.install()
+
+from Circles import authCache, cardCatalog, constants, create_app, replicas
+from Circles.models import db, User
+from Circles.APIs import apiBlueprint
+from benchmarks.run import QueryCounter
+
+# Every test gets the app over a fresh SQLite database, with FCM, Twilio and Virgil stubbed out as in the benchmarks.
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("FRIEND_GRAPH_DIR", str(tmp_path / "friendGraph"))
+    app = create_app("sqlite:///" + str(tmp_path / "circles.db"), checkSchema=False, replicaUris=[])
+    app.register_blueprint(apiBlueprint)
+    with app.app_context():
+        db.create_all()
+    cardCatalog.invalidate()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    authCache._principals.clear()
+    replicas._recentWriters.clear()
+    shutil.rmtree(app.config["FRIEND_GRAPH_DIR"], ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def queryCounter():
+    counter = QueryCounter()
+    event.listen(Engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(Engine, "before_cursor_execute", counter)
+
+
+def getAuthHeaders(app, userId):
+    with app.app_context():
+        token = User.query.get(userId).generate_auth_token(expiration=constants.TOKEN_EXPIRATION, key=os.environ["SECRET_KEY"])
+        db.session.close()
+    return {"Authorization": "Basic " + base64.b64encode(token + b":unused").decode("ascii")}
+
+
+def addUser(name):
+    """Adds a user named name, with a phone number and invite code derived from it, inside an app context."""
+    user = User(name=name, phoneNumber="+1555" + name, idCode="T" + name, fcmToken="fcm-" + name, upiID="", cards=[], \
+                suspended=False, joined="N/A", profileImgUrl="")
+    db.session.add(user)
+    db.session.commit()
+    return user.id
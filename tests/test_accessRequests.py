@@ -0,0 +1,83 @@
+import datetime, pytz
+from Circles import constants
+from Circles.models import AccessRequest, Card, db, Friend
+from tests.conftest import addUser, getAuthHeaders
+
+
+def addReceivedAccessRequests(app, count):
+    """Adds a user with count unaccepted access requests from as many other users and returns its id."""
+    with app.app_context():
+        db.session.add(Card(id=1, name="Card", objectType="Card"))
+        receiverId = addUser("0")
+        start = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA)) - datetime.timedelta(hours=1)
+        for index in range(count):
+            senderId = addUser(str(index + 1))
+            db.session.add(AccessRequest(fromUserId=senderId, toUserId=receiverId, cardId=1, amount=100, shortDesc="", \
+                                         mutualFriendName="", status=constants.ACCESS_REQUEST_UNACCEPTED, \
+                                         createdOn=start + datetime.timedelta(seconds=index)))
+        db.session.commit()
+        db.session.close()
+    return receiverId
+
+
+def test_access_requests_without_limit_or_cursor_returns_every_request(app, client):
+    count = constants.REQUESTS_PAGE_SIZE + 10
+    headers = getAuthHeaders(app, addReceivedAccessRequests(app, count))
+
+    response = client.get("/accessRequests/received", headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    assert response.get_json()["count"] == count
+    assert "next" not in response.get_json()
+
+
+def test_access_requests_with_limit_pages_with_cursor(app, client):
+    count = constants.REQUESTS_PAGE_SIZE + 10
+    headers = getAuthHeaders(app, addReceivedAccessRequests(app, count))
+
+    first = client.get("/accessRequests/received?limit=40", headers=headers).get_json()
+    assert first["count"] == 40
+    second = client.get("/accessRequests/received?limit=40&cursor=" + first["next"], headers=headers).get_json()
+    assert second["count"] == count - 40
+    assert "next" not in second
+
+
+def addFriendship(userId, friendId, startedOn):
+    db.session.add_all([Friend(userId=userId, friendId=friendId, startedOn=startedOn), \
+                        Friend(userId=friendId, friendId=userId, startedOn=startedOn)])
+
+
+def addCircle(app):
+    """A user, a friend, a second degree friend through two mutual friends, and a stranger."""
+    with app.app_context():
+        db.session.add(Card(id=1, name="Card", objectType="Card"))
+        userId, friendId, secondId, strangerId, oldMutualId, newMutualId = [addUser(name) for name in ["1", "2", "3", "4", "5", "6"]]
+        start = datetime.datetime(2019, 1, 1)
+        addFriendship(userId, friendId, start)
+        addFriendship(userId, oldMutualId, start)
+        addFriendship(secondId, oldMutualId, start + datetime.timedelta(days=1))
+        addFriendship(userId, newMutualId, start + datetime.timedelta(days=2))
+        addFriendship(secondId, newMutualId, start)
+        db.session.commit()
+        db.session.close()
+    return userId, friendId, secondId, strangerId
+
+
+def createAccessRequest(app, client, userId, recipientId, mutualFriendName=None):
+    body = {"to": recipientId, "amount": 100, "cardId": 1}
+    if mutualFriendName is not None:
+        body["mutualFriendName"] = mutualFriendName
+    response = client.post("/accessRequests/new", json=body, headers=getAuthHeaders(app, userId))
+    assert response.status_code == constants.STATUS_OK
+    with app.app_context():
+        accessRequest = AccessRequest.query.filter_by(fromUserId=userId, toUserId=recipientId).one()
+        db.session.close()
+    return accessRequest.mutualFriendName
+
+
+def test_mutual_friend_of_new_access_requests(app, client):
+    userId, friendId, secondId, strangerId = addCircle(app)
+    assert createAccessRequest(app, client, userId, friendId) is None
+    # The server's best ranked mutual friend wins over the client's
+    assert createAccessRequest(app, client, userId, secondId, "6") == "5"
+    # Without a mutual friend the request is still accepted, with the name the client sent
+    assert createAccessRequest(app, client, userId, strangerId, "Someone") == "Someone"
@@ -0,0 +1,61 @@
+import base64, os, time
+from Circles import authCache, constants
+from Circles.models import db, User
+from tests.conftest import addUser
+
+
+def getHeaders(app, userId, expiration=constants.TOKEN_EXPIRATION):
+    with app.app_context():
+        token = User.query.get(userId).generate_auth_token(expiration=expiration, key=os.environ["SECRET_KEY"])
+        db.session.close()
+    # The token reaches verifyToken as the username of the basic auth header
+    return token.decode("ascii"), {"Authorization": "Basic " + base64.b64encode(token + b":unused").decode("ascii")}
+
+
+def addCachedUser(app):
+    with app.app_context():
+        userId = addUser("0")
+    token, headers = getHeaders(app, userId)
+    with app.app_context():
+        assert authCache.verifyToken(token, os.environ["SECRET_KEY"]).fcmToken == "fcm-0"
+    return userId, token, headers
+
+
+def test_verified_tokens_are_served_from_the_cache(app, queryCounter):
+    userId, token, headers = addCachedUser(app)
+    with app.app_context():
+        queryCounter.start()
+        assert authCache.verifyToken(token, os.environ["SECRET_KEY"]).id == userId
+        assert queryCounter.stop() == 0
+        assert authCache.verifyToken(b"not a token", os.environ["SECRET_KEY"]) is None
+
+
+def test_invalidate_user_drops_its_cached_tokens(app):
+    userId, token, headers = addCachedUser(app)
+    with app.app_context():
+        User.query.filter(User.id == userId).update({"fcmToken": "fcm-new"})
+        db.session.commit()
+        assert authCache.verifyToken(token, os.environ["SECRET_KEY"]).fcmToken == "fcm-0"
+
+        authCache.invalidateUser(userId)
+        assert authCache.verifyToken(token, os.environ["SECRET_KEY"]).fcmToken == "fcm-new"
+
+
+def test_profile_updates_invalidate_the_cache(app, client):
+    userId, token, headers = addCachedUser(app)
+    assert token in authCache._principals
+    response = client.post("/user/updateUPI", json={"upiID": "user@upi"}, headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    assert token not in authCache._principals
+
+
+def test_cached_tokens_still_expire(app, client, monkeypatch):
+    with app.app_context():
+        userId = addUser("0")
+    token, headers = getHeaders(app, userId, expiration=60)
+    assert client.get("/user/friends", headers=headers).status_code == constants.STATUS_OK
+    assert token in authCache._principals
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert client.get("/user/friends", headers=headers).status_code == constants.STATUS_GONE
@@ -0,0 +1,48 @@
+from Circles import cardCatalog, constants
+from Circles.models import db, Card
+
+
+def addCards():
+    db.session.add_all([Card(id=1, name="Travel", objectType=constants.CARD_TYPE_TAG), \
+                        Card(id=2, name="Miles", objectType="Card", tagId=1), \
+                        Card(id=3, name="Lounge", objectType="Card", tagId=1), \
+                        Card(id=4, name="Grocery", objectType="Card")])
+    db.session.commit()
+
+
+def test_tags_expand_to_their_member_cards(app):
+    with app.app_context():
+        addCards()
+        assert cardCatalog.expandCardIds(cardCatalog.getCard(1)) == [2, 3]
+        assert cardCatalog.expandCardIds(cardCatalog.getCard("4")) == [4]
+        assert cardCatalog.getCard("not a card id") is None
+        assert cardCatalog.namesFor([4, 2, 99]) == {4: "Grocery", 2: "Miles", 99: None}
+        assert [card.id for card in cardCatalog.cardsOfType(constants.CARD_TYPE_TAG)] == [1]
+
+
+def test_snapshot_is_kept_until_invalidated(app, queryCounter):
+    with app.app_context():
+        addCards()
+        version = cardCatalog.getVersion()
+        Card.query.filter(Card.id == 4).update({"name": "Groceries"})
+        db.session.commit()
+
+        queryCounter.start()
+        assert cardCatalog.getName(4) == "Grocery"
+        assert queryCounter.stop() == 0
+
+        cardCatalog.invalidate()
+        assert cardCatalog.getName(4) == "Groceries"
+        assert cardCatalog.getVersion() != version
+
+
+def test_snapshot_is_reloaded_once_its_ttl_passes(app, monkeypatch):
+    with app.app_context():
+        addCards()
+        assert cardCatalog.getName(4) == "Grocery"
+        db.session.add(Card(id=5, name="Fuel", objectType="Card", tagId=1))
+        db.session.commit()
+        assert cardCatalog.expandCardIds(cardCatalog.getCard(1)) == [2, 3]
+
+        monkeypatch.setattr(constants, "CARD_CATALOG_TTL_SECONDS", 0)
+        assert cardCatalog.expandCardIds(cardCatalog.getCard(1)) == [2, 3, 5]
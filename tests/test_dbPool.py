@@ -0,0 +1,20 @@
+import pytest
+from flask import Flask
+from Circles import constants, dbPool
+
+
+@pytest.mark.parametrize("value, expected", [("true", True), ("True", True), ("1", True), ("yes", True), \
+                                             ("false", False), ("False", False), ("0", False), ("no", False)])
+def test_pre_ping_is_parsed_from_the_environment(monkeypatch, value, expected):
+    monkeypatch.setenv("DB_POOL_PRE_PING", value)
+    app = Flask("Circles")
+    dbPool.configure(app)
+    assert app.config["DB_POOL_PRE_PING"] is expected
+
+
+def test_integer_settings_are_parsed_from_the_environment(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "25")
+    app = Flask("Circles")
+    dbPool.configure(app)
+    assert app.config["DB_POOL_SIZE"] == 25
+    assert app.config["DB_MAX_OVERFLOW"] == constants.DB_MAX_OVERFLOW
@@ -0,0 +1,75 @@
+import json
+from Circles import cardCatalog, constants
+from Circles.models import db, Card
+from benchmarks.seed import seedGraph
+from tests.conftest import getAuthHeaders
+
+
+def seed(app):
+    with app.app_context():
+        seedGraph(users=20, meanDegree=4, cards=10, tags=2, postsPerUser=1, accessRequestsPerUser=0, friendRequestsPerUser=0)
+        db.session.close()
+    return getAuthHeaders(app, 1)
+
+
+def getTag(client, path, headers):
+    response = client.get(path, headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    return response.headers["ETag"]
+
+
+def assertNotModified(client, path, headers, tag):
+    response = client.get(path, headers=dict(headers, **{"If-None-Match": tag}))
+    assert response.status_code == constants.STATUS_NOT_MODIFIED
+    assert response.headers["ETag"] == tag
+
+
+def assertModified(client, path, headers, tag):
+    """The stale tag gets the full response with a new tag, which is current again."""
+    response = client.get(path, headers=dict(headers, **{"If-None-Match": tag}))
+    assert response.status_code == constants.STATUS_OK
+    assert response.get_json() is not None
+    assert response.headers["ETag"] != tag
+    assertNotModified(client, path, headers, response.headers["ETag"])
+
+
+def test_update_upi_changes_the_profile_tag(app, client):
+    headers = seed(app)
+    tag = getTag(client, "/user/profile", headers)
+    assertNotModified(client, "/user/profile", headers, tag)
+
+    response = client.post("/user/updateUPI", json={"upiID": "changed@upi"}, headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    assertModified(client, "/user/profile", headers, tag)
+
+
+def test_update_cards_changes_the_profile_tag(app, client):
+    headers = seed(app)
+    tag = getTag(client, "/user/profile", headers)
+
+    cards = json.dumps([{"id": cardId} for cardId in (3, 4)])
+    response = client.post("/user/updateCards", json={"cards": cards}, headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    assertModified(client, "/user/profile", headers, tag)
+
+
+def test_catalog_change_changes_the_card_tags(app, client):
+    headers = seed(app)
+    paths = ["/card/all", "/card/filter?type=" + constants.CARD_TYPE_TAG, "/user/profile"]
+    tags = [getTag(client, path, headers) for path in paths]
+
+    with app.app_context():
+        db.session.add(Card(id=100, name="New card", objectType="Card", tagId=1))
+        db.session.commit()
+        db.session.close()
+    for path, tag in zip(paths, tags):
+        assertNotModified(client, path, headers, tag) # until the catalog snapshot is reloaded
+    cardCatalog.invalidate()
+    for path, tag in zip(paths, tags):
+        assertModified(client, path, headers, tag)
+
+
+def test_stale_tag_gets_the_full_response(app, client):
+    headers = seed(app)
+    for path in ("/card/all", "/user/profile", "/posts?id=1"):
+        assertModified(client, path, headers, '"stale"')
@@ -0,0 +1,41 @@
+import datetime, pytz
+from Circles import constants, expiry
+from Circles.models import db, AccessRequest, Card
+from tests.conftest import addUser
+
+
+def addAccessRequests(app, requests):
+    """Adds an access request of each (status, age in seconds) and returns their ids in the same order."""
+    with app.app_context():
+        db.session.add(Card(id=1, name="Card", objectType="Card"))
+        senderId, receiverId = addUser("0"), addUser("1")
+        now = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+        rows = [AccessRequest(fromUserId=senderId, toUserId=receiverId, cardId=1, amount=100, shortDesc="", mutualFriendName="", \
+                              status=status, createdOn=now - datetime.timedelta(seconds=age)) for status, age in requests]
+        db.session.add_all(rows)
+        db.session.commit()
+        ids = [row.id for row in rows]
+        db.session.close()
+    return ids
+
+
+def getStatuses(app, ids):
+    with app.app_context():
+        statuses = dict(db.session.query(AccessRequest.id, AccessRequest.status).filter(AccessRequest.id.in_(ids)))
+        db.session.close()
+    return [statuses[requestId] for requestId in ids]
+
+
+def test_sweep_expires_only_overdue_unaccepted_requests(app):
+    overdue = constants.SECONDS_IN_DAY + 60
+    requests = [(constants.ACCESS_REQUEST_UNACCEPTED, overdue)] * 5 + \
+               [(constants.ACCESS_REQUEST_UNACCEPTED, 60), \
+                (constants.ACCESS_REQUEST_ACCEPTED, overdue), \
+                (constants.ACCESS_REQUEST_REJECTED, overdue), \
+                (constants.ACCESS_REQUEST_CANCELLED, overdue)]
+    ids = addAccessRequests(app, requests)
+
+    with app.app_context():
+        assert expiry.sweepExpiredAccessRequests(batchSize=2) == 5
+        assert expiry.sweepExpiredAccessRequests(batchSize=2) == 0
+    assert getStatuses(app, ids) == [constants.ACCESS_REQUEST_EXPIRED] * 5 + [status for status, age in requests[5:]]
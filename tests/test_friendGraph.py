@@ -0,0 +1,121 @@
+import datetime, pytz
+from Circles import constants, friendGraph
+from Circles.models import db, Friend, FriendRemoval
+from benchmarks.seed import seedGraph
+from tests.conftest import getAuthHeaders
+
+
+def seedFriends(app):
+    """Returns a user, one of its friends and the friend graph, mapped from the seeded friendships."""
+    with app.app_context():
+        adjacency = seedGraph(users=30, meanDegree=4, postsPerUser=0, accessRequestsPerUser=0, friendRequestsPerUser=0)["adjacency"]
+        graph = friendGraph.getGraph(app)
+        db.session.close()
+    userId = max(adjacency, key=lambda userId: len(adjacency[userId]))
+    return userId, min(adjacency[userId]), graph
+
+
+def isFriend(app, userId, friendId):
+    with app.test_request_context():
+        return friendGraph.isFriend(userId, friendId)
+
+
+def getProfileStatus(client, app, userId, otherId):
+    return client.get("/user/profile?id=" + str(otherId), headers=getAuthHeaders(app, userId)).status_code
+
+
+def test_remove_friend(app, client):
+    userId, friendId, graph = seedFriends(app)
+    assert getProfileStatus(client, app, friendId, userId) == constants.STATUS_OK
+
+    response = client.post("/friends/remove", json={"friendId": friendId}, headers=getAuthHeaders(app, userId))
+    assert response.status_code == constants.STATUS_OK
+    with app.app_context():
+        assert Friend.query.filter(Friend.userId.in_([userId, friendId]), Friend.friendId.in_([userId, friendId])).count() == 0
+        assert FriendRemoval.query.count() == 2
+        db.session.close()
+    assert not isFriend(app, userId, friendId)
+    assert not isFriend(app, friendId, userId)
+    assert getProfileStatus(client, app, friendId, userId) == constants.STATUS_BAD_REQUEST
+
+    response = client.post("/friends/remove", json={"friendId": friendId}, headers=getAuthHeaders(app, userId))
+    assert response.status_code == constants.STATUS_BAD_REQUEST
+
+
+def removeThroughOtherHost(app, userId, friendId):
+    """What removeFriend does on another host: the rows and tombstones, without this host's log."""
+    with app.app_context():
+        Friend.query.filter(Friend.userId.in_([userId, friendId]), Friend.friendId.in_([userId, friendId])) \
+            .delete(synchronize_session=False)
+        timeNow = datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA))
+        db.session.add_all([FriendRemoval(userId=userId, friendId=friendId, removedOn=timeNow), \
+                            FriendRemoval(userId=friendId, friendId=userId, removedOn=timeNow)])
+        db.session.commit()
+        db.session.close()
+
+
+def sync(app, graph):
+    with app.app_context():
+        return friendGraph.syncNewFriendships(graph.directory, db.engine)
+
+
+def test_removals_through_other_hosts_are_synced(app):
+    userId, friendId, graph = seedFriends(app)
+    removeThroughOtherHost(app, userId, friendId)
+    assert isFriend(app, userId, friendId) # until the next sync
+
+    assert sync(app, graph) == 2
+    assert not isFriend(app, userId, friendId)
+    assert not isFriend(app, friendId, userId)
+    assert sync(app, graph) == 0
+
+
+def test_friendship_made_again_is_not_removed_by_its_tombstone(app):
+    userId, friendId, graph = seedFriends(app)
+    removeThroughOtherHost(app, userId, friendId)
+    with app.app_context():
+        db.session.add_all([Friend(userId=userId, friendId=friendId), Friend(userId=friendId, friendId=userId)])
+        db.session.commit()
+        db.session.close()
+
+    sync(app, graph)
+    assert isFriend(app, userId, friendId)
+    assert isFriend(app, friendId, userId)
+
+
+def test_old_removals_are_pruned(app):
+    userId, friendId, graph = seedFriends(app)
+    removeThroughOtherHost(app, userId, friendId)
+    with app.app_context():
+        old = datetime.datetime.now() - datetime.timedelta(seconds=constants.FRIEND_REMOVAL_RETENTION_SECONDS + 60)
+        FriendRemoval.query.filter(FriendRemoval.userId == userId).update({"removedOn": old})
+        db.session.commit()
+        assert friendGraph.pruneRemovals(db.engine) == 1
+        assert FriendRemoval.query.count() == 1
+        db.session.close()
+
+
+def addFriendship(app, userId, friendId, firstId):
+    """Adds both Friend rows of a friendship with the given ids, as a transaction that got them earlier would."""
+    with app.app_context():
+        db.session.add_all([Friend(id=firstId, userId=userId, friendId=friendId), Friend(id=firstId + 1, userId=friendId, friendId=userId)])
+        db.session.commit()
+        db.session.close()
+
+
+def test_rows_committed_after_higher_ids_are_synced(app):
+    userId, friendId, graph = seedFriends(app)
+    with app.app_context():
+        watermark = db.session.query(db.func.max(Friend.id)).scalar()
+        db.session.close()
+    strangerId, otherStrangerId = [otherId for otherId in range(1, 31) if otherId != userId and not isFriend(app, userId, otherId)][:2]
+
+    # The later transaction commits first, the sync moves the watermark past the ids of the earlier one
+    addFriendship(app, userId, otherStrangerId, watermark + 10)
+    assert sync(app, graph) == 2
+    addFriendship(app, userId, strangerId, watermark + 1)
+    assert sync(app, graph) == 2
+    assert isFriend(app, userId, strangerId)
+    assert isFriend(app, strangerId, userId)
+    assert isFriend(app, userId, otherStrangerId)
+    assert sync(app, graph) == 0
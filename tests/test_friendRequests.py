@@ -0,0 +1,77 @@
+import datetime
+from Circles import constants
+from Circles.models import db, FriendRequest
+from tests.conftest import addUser, getAuthHeaders
+
+
+def addFriendRequest(app, names):
+    """Adds three users, a friend request from the first to the second, and returns their ids and the request's."""
+    with app.app_context():
+        senderId, receiverId, otherId = [addUser(name) for name in names]
+        friendRequest = FriendRequest(fromUserId=senderId, toUserId=receiverId, pairKey=FriendRequest.getPairKey(senderId, receiverId), \
+                                      status=constants.FRIEND_REQUEST_ACTIVE)
+        db.session.add(friendRequest)
+        db.session.commit()
+        requestId = friendRequest.id
+        db.session.close()
+    return senderId, receiverId, otherId, requestId
+
+
+def countFriendRequests(app):
+    with app.app_context():
+        count = FriendRequest.query.count()
+        db.session.close()
+    return count
+
+
+def test_cancel_friend_request(app, client):
+    for actor in (0, 1):
+        names = [str(actor) + "1", str(actor) + "2", str(actor) + "3"]
+        userIds = addFriendRequest(app, names)
+        response = client.post("/friendRequests/cancel", json={"requestId": userIds[3]}, headers=getAuthHeaders(app, userIds[actor]))
+        assert response.status_code == constants.STATUS_OK
+        assert countFriendRequests(app) == 0
+
+
+def test_cancel_friend_request_of_other_users(app, client):
+    senderId, receiverId, otherId, requestId = addFriendRequest(app, ["1", "2", "3"])
+    response = client.post("/friendRequests/cancel", json={"requestId": requestId}, headers=getAuthHeaders(app, otherId))
+    assert response.status_code == constants.STATUS_BAD_REQUEST
+    assert countFriendRequests(app) == 1
+
+
+def addReceivedFriendRequests(app, count):
+    """Adds a user with count pending friend requests from as many other users and returns its id."""
+    with app.app_context():
+        receiverId = addUser("0")
+        start = datetime.datetime(2019, 1, 1)
+        for index in range(count):
+            senderId = addUser(str(index + 1))
+            db.session.add(FriendRequest(fromUserId=senderId, toUserId=receiverId, pairKey=FriendRequest.getPairKey(senderId, receiverId), \
+                                         createdOn=start + datetime.timedelta(minutes=index), status=constants.FRIEND_REQUEST_ACTIVE))
+        db.session.commit()
+        db.session.close()
+    return receiverId
+
+
+def test_friend_requests_without_limit_or_cursor_returns_every_request(app, client):
+    count = constants.REQUESTS_PAGE_SIZE + 10
+    headers = getAuthHeaders(app, addReceivedFriendRequests(app, count))
+
+    response = client.get("/friendRequests/received", headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    assert response.get_json()["count"] == count
+    assert "next" not in response.get_json()
+
+
+def test_friend_requests_with_limit_pages_with_cursor(app, client):
+    count = constants.REQUESTS_PAGE_SIZE + 10
+    headers = getAuthHeaders(app, addReceivedFriendRequests(app, count))
+
+    first = client.get("/friendRequests/received?limit=40", headers=headers).get_json()
+    assert first["count"] == 40
+    second = client.get("/friendRequests/received?cursor=" + first["next"], headers=headers).get_json()
+    assert second["count"] == count - 40
+    assert "next" not in second
+    requestIds = [friendRequest["requestId"] for friendRequest in first["requests"] + second["requests"]]
+    assert len(set(requestIds)) == count
@@ -0,0 +1,44 @@
+from Circles import constants
+from Circles.models import db
+from benchmarks.seed import seedGraph
+from tests.conftest import getAuthHeaders
+
+
+def seedCircles(app):
+    """Returns a user with a small circle of friends and one with a much larger one."""
+    with app.app_context():
+        adjacency = seedGraph(users=120, meanDegree=10, postsPerUser=0, accessRequestsPerUser=0, friendRequestsPerUser=0)["adjacency"]
+        db.session.close()
+    byDegree = sorted((userId for userId in adjacency if adjacency[userId]), key=lambda userId: len(adjacency[userId]))
+    return byDegree[0], byDegree[-1], adjacency
+
+
+def getFriendsQueries(client, queryCounter, headers, path="/user/friends"):
+    queryCounter.start()
+    response = client.get(path, headers=headers)
+    queries = queryCounter.stop()
+    assert response.status_code == constants.STATUS_OK
+    return response.get_json(), queries
+
+
+def test_friends_query_count_does_not_grow_with_circle_size(app, client, queryCounter):
+    smallId, largeId, adjacency = seedCircles(app)
+    assert len(adjacency[largeId]) >= 5 * len(adjacency[smallId])
+
+    small, smallQueries = getFriendsQueries(client, queryCounter, getAuthHeaders(app, smallId))
+    large, largeQueries = getFriendsQueries(client, queryCounter, getAuthHeaders(app, largeId))
+    assert small["count"] == len(adjacency[smallId])
+    assert large["count"] == len(adjacency[largeId])
+    assert largeQueries == smallQueries
+
+
+def test_friends_limit_is_clamped(app, client, queryCounter):
+    smallId, largeId, adjacency = seedCircles(app)
+    headers = getAuthHeaders(app, largeId)
+
+    page, _ = getFriendsQueries(client, queryCounter, headers, "/user/friends?limit=0")
+    assert page["count"] == 1
+    assert page["next"] == page["friends"][-1]["id"]
+
+    page, _ = getFriendsQueries(client, queryCounter, headers, "/user/friends?limit=" + str(constants.MAX_PAGE_SIZE * 10))
+    assert page["count"] == len(adjacency[largeId])
@@ -0,0 +1,43 @@
+import json, tracemalloc
+from Circles import jsonCodec
+from Circles.APIs import posts
+from tests.conftest import getAuthHeaders
+from tests.test_posts import addUserWithPosts
+
+
+def makeRows(items):
+    return ((index, "Post " + str(index), index % 50, None, "User " + str(index % 50), "") for index in range(items))
+
+
+def streamPeak(app, items):
+    """The body of a streamed list of items posts and the peak of Python allocations while writing it."""
+    with app.test_request_context():
+        tracemalloc.start()
+        response = jsonCodec.streamResponse("posts", makeRows(items), posts.renderPost)
+        size = sum(len(chunk) for chunk in response.iter_encoded())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        body = b"".join(jsonCodec.streamResponse("posts", makeRows(items), posts.renderPost).iter_encoded())
+    assert len(body) == size
+    return json.loads(body.decode("utf-8")), peak
+
+
+def test_streamed_list_matches_buffered_list(app):
+    document, peak = streamPeak(app, 600)
+    with app.test_request_context():
+        buffered = jsonCodec.listResponse({"count": 600}, "posts", list(makeRows(600)), posts.renderPost).get_json()
+    assert document == buffered
+
+
+def test_streamed_list_memory_does_not_grow_with_the_list(app):
+    small, smallPeak = streamPeak(app, 1000)
+    large, largePeak = streamPeak(app, 20000)
+    assert large["count"] == 20000
+    assert largePeak < 2 * smallPeak
+
+
+def test_unpaged_posts_are_streamed(app, client):
+    headers = getAuthHeaders(app, addUserWithPosts(app, 5))
+    # A streamed object lists the rows before their count
+    assert client.get("/posts/all?type=sent", headers=headers).data.startswith(b'{"posts":[')
+    assert client.get("/posts/all?type=sent&limit=5", headers=headers).data.startswith(b'{"count":5,')
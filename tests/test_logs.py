@@ -0,0 +1,26 @@
+import logging, random
+from Circles import constants, logs
+
+
+def makeRecord(name, level, msg):
+    return logging.LogRecord(name, level, __file__, 1, msg, (7,), None)
+
+
+def test_only_listed_messages_are_sampled(monkeypatch):
+    samplingFilter = logs.SamplingFilter(constants.LOG_SAMPLE_RATES)
+    monkeypatch.setattr(random, "random", lambda: 0.99)
+
+    assert not samplingFilter.filter(makeRecord("Circles.search", logging.WARNING, "No friend with id: %s"))
+    assert not samplingFilter.filter(makeRecord("Circles.search", logging.WARNING, "No second degree friend with id: %s"))
+    # The same message from another logger, and any other warning, is always kept
+    assert samplingFilter.filter(makeRecord("Circles.APIs.users", logging.WARNING, "No friend with id: %s"))
+    assert samplingFilter.filter(makeRecord("Circles.APIs.friendRequests", logging.WARNING, "Friend request status already at the desired state:%s"))
+    assert samplingFilter.filter(makeRecord("Circles.search", logging.ERROR, "Search failed: %s"))
+
+
+def test_sampled_records_carry_their_rate(monkeypatch):
+    samplingFilter = logs.SamplingFilter(constants.LOG_SAMPLE_RATES)
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    record = makeRecord("Circles.search", logging.WARNING, "No friend with id: %s")
+    assert samplingFilter.filter(record)
+    assert record.sampleRate == constants.LOG_SAMPLE_RATES[("Circles.search", "No friend with id: %s")]
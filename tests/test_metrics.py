@@ -0,0 +1,28 @@
+import ipaddress
+from Circles import constants
+
+
+def scrape(client, address, headers=None):
+    return client.get("/metrics", headers=headers or {}, environ_base={"REMOTE_ADDR": address})
+
+
+def test_metrics_are_served_to_loopback_only(client):
+    response = scrape(client, "127.0.0.1")
+    assert response.status_code == constants.STATUS_OK
+    assert b"circles_http_request_duration_seconds" in response.data
+    assert scrape(client, "203.0.113.7").status_code == constants.STATUS_UNAUTHORIZED
+    assert scrape(client, "127.0.0.1", {"X-Forwarded-For": "203.0.113.7"}).status_code == constants.STATUS_UNAUTHORIZED
+
+
+def test_metrics_token(app, client):
+    app.config["METRICS_TOKEN"] = "scraper-token"
+    assert scrape(client, "203.0.113.7", {"Authorization": "Bearer scraper-token"}).status_code == constants.STATUS_OK
+    assert scrape(client, "127.0.0.1", {"Authorization": "Bearer scraper-token", "X-Forwarded-For": "203.0.113.7"}) \
+            .status_code == constants.STATUS_OK
+    assert scrape(client, "203.0.113.7", {"Authorization": "Bearer wrong"}).status_code == constants.STATUS_UNAUTHORIZED
+
+
+def test_metrics_allowed_networks(app, client):
+    app.config["METRICS_ALLOWED_NETWORKS"] = [ipaddress.ip_network("10.0.0.0/8")]
+    assert scrape(client, "10.1.2.3").status_code == constants.STATUS_OK
+    assert scrape(client, "127.0.0.1").status_code == constants.STATUS_UNAUTHORIZED
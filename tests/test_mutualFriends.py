@@ -0,0 +1,51 @@
+import datetime
+from Circles import constants, mutualFriends
+from Circles.models import db, Friend
+from tests.conftest import addUser, getAuthHeaders
+
+
+def addFriendship(userId, friendId, startedOn):
+    db.session.add_all([Friend(userId=userId, friendId=friendId, startedOn=startedOn), \
+                        Friend(userId=friendId, friendId=userId, startedOn=startedOn)])
+
+
+def addMutualFriends(app):
+    """Returns the two users and their mutual friends, in the order they should be ranked."""
+    with app.app_context():
+        me, other, oldest, newer, undated, recorded = [addUser(name) for name in ["0", "1", "2", "3", "4", "5"]]
+        addFriendship(me, other, datetime.datetime(2019, 1, 1))
+        # The later of the two friendships ranks a mutual friend
+        addFriendship(me, oldest, datetime.datetime(2017, 1, 1))
+        addFriendship(other, oldest, datetime.datetime(2018, 1, 1))
+        addFriendship(me, newer, datetime.datetime(2016, 1, 1))
+        addFriendship(other, newer, datetime.datetime(2019, 1, 1))
+        addFriendship(me, undated, None)
+        addFriendship(other, undated, datetime.datetime(2015, 1, 1))
+        # Recorded twice, the older row counts
+        addFriendship(me, recorded, datetime.datetime(2018, 6, 1))
+        addFriendship(me, recorded, datetime.datetime(2019, 6, 1))
+        addFriendship(other, recorded, datetime.datetime(2018, 3, 1))
+        addFriendship(me, addUser("6"), datetime.datetime(2015, 1, 1))
+        db.session.commit()
+    return me, other, [oldest, recorded, newer, undated]
+
+
+def test_mutual_friends_are_ranked_by_their_later_friendship(app):
+    me, other, ranked = addMutualFriends(app)
+    with app.app_context():
+        assert [mutual.id for mutual in mutualFriends.getMutualFriends(me, other)] == ranked
+        assert [mutual.id for mutual in mutualFriends.getMutualFriends(other, me)] == ranked
+        assert mutualFriends.getBestMutualFriends(me, [other]) == {other: (ranked[0], len(ranked))}
+        assert mutualFriends.getBestMutualFriends(me, []) == {}
+
+
+def test_mutual_friends_endpoint(app, client):
+    me, other, ranked = addMutualFriends(app)
+    headers = getAuthHeaders(app, me)
+
+    response = client.get("/user/mutualFriends?id=" + str(other), headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    assert response.get_json()["count"] == len(ranked)
+    assert [mutual["id"] for mutual in response.get_json()["mutualFriends"]] == ranked
+    assert client.get("/user/mutualFriends?id=" + str(me), headers=headers).status_code == constants.STATUS_BAD_REQUEST
+    assert client.get("/user/mutualFriends", headers=headers).status_code == constants.STATUS_BAD_REQUEST
@@ -0,0 +1,119 @@
+import datetime, pytz
+from firebase_admin import messaging
+from Circles import constants, outbox
+from Circles.models import db, NotificationOutbox
+
+
+class FakeSender(object):
+    """Records each multicast and fails the tokens in failing, or every token when raising is set."""
+
+    def __init__(self, failing=(), raising=None):
+        self.calls = []
+        self.failing = set(failing)
+        self.raising = raising
+
+    def __call__(self, tokens, notification, data):
+        self.calls.append((list(tokens), notification.title, data))
+        if self.raising:
+            raise self.raising
+        return {token: token not in self.failing for token in tokens}
+
+
+def enqueue(app, tokens, title, data):
+    with app.app_context():
+        outbox.enqueueNotifications(tokens, messaging.Notification(title, "body"), data)
+        db.session.commit()
+        db.session.close()
+
+
+def getRows(app):
+    with app.app_context():
+        rows = {row.fcmToken: row for row in NotificationOutbox.query.all()}
+        db.session.expunge_all()
+        db.session.close()
+    return rows
+
+
+def now():
+    return datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA)).replace(tzinfo=None)
+
+
+def test_drain_groups_identical_notifications(app):
+    enqueue(app, ["a", "b", "c"], "first", {"type": "1"})
+    enqueue(app, ["d"], "second", {"type": "2"})
+    sender = FakeSender()
+    with app.app_context():
+        assert outbox.drainOutbox(sender) == 4
+        assert outbox.drainOutbox(sender) == 0
+
+    assert sender.calls == [(["a", "b", "c"], "first", {"type": "1"}), (["d"], "second", {"type": "2"})]
+    assert all(row.status == constants.OUTBOX_SENT and row.sentOn for row in getRows(app).values())
+
+
+def test_drain_backs_off_failed_sends(app):
+    enqueue(app, ["a", "b"], "first", {})
+    enqueue(app, ["c"], "second", {})
+    with app.app_context():
+        assert outbox.drainOutbox(FakeSender(failing=["b"])) == 3
+    rows = getRows(app)
+    assert rows["a"].status == constants.OUTBOX_SENT
+    assert rows["c"].status == constants.OUTBOX_SENT
+    assert rows["b"].status == constants.OUTBOX_PENDING
+    assert rows["b"].attempts == 1
+    backoff = (rows["b"].nextAttemptOn - now()).total_seconds()
+    assert 0 < backoff <= outbox.getBackoffSeconds(1)
+
+    # Not due again before its backoff, then given up on after the last attempt
+    with app.app_context():
+        assert outbox.drainOutbox(FakeSender()) == 0
+        for attempt in range(2, constants.OUTBOX_MAX_ATTEMPTS + 1):
+            NotificationOutbox.query.filter(NotificationOutbox.fcmToken == "b").update({"nextAttemptOn": now()})
+            db.session.commit()
+            assert outbox.drainOutbox(FakeSender(raising=RuntimeError("FCM down"))) == 1
+    rows = getRows(app)
+    assert rows["b"].status == constants.OUTBOX_DEAD
+    assert rows["b"].attempts == constants.OUTBOX_MAX_ATTEMPTS
+    assert rows["b"].lastError == "FCM down"
+
+
+def test_claimed_rows_are_leased(app):
+    enqueue(app, ["a"], "first", {})
+    with app.app_context():
+        claimed = outbox.claimDueNotifications(datetime.datetime.now(tz=pytz.timezone(constants.TIMEZONE_KOLKATA)), 10)
+        db.session.close()
+        assert [notification.fcmToken for notification in claimed] == ["a"]
+        assert outbox.drainOutbox(FakeSender()) == 0 # another worker does not send it again while it is leased
+    row = getRows(app)["a"]
+    assert row.status == constants.OUTBOX_PENDING
+    assert row.attempts == 1
+    assert (row.nextAttemptOn - now()).total_seconds() > constants.OUTBOX_LEASE_SECONDS - 60
+
+
+def test_expired_leases_count_as_attempts(app):
+    enqueue(app, ["a"], "first", {})
+    with app.app_context():
+        # The worker dies mid-send every time, so no result is ever recorded
+        for attempt in range(1, constants.OUTBOX_MAX_ATTEMPTS + 1):
+            NotificationOutbox.query.update({"nextAttemptOn": now()})
+            db.session.commit()
+            assert len(outbox.claimDueNotifications(now(), 10)) == 1
+            db.session.close()
+        NotificationOutbox.query.update({"nextAttemptOn": now()})
+        db.session.commit()
+        assert outbox.claimDueNotifications(now(), 10) == []
+        db.session.close()
+    row = getRows(app)["a"]
+    assert row.status == constants.OUTBOX_DEAD
+    assert row.attempts == constants.OUTBOX_MAX_ATTEMPTS
+
+
+def test_prune_deletes_old_sent_rows(app):
+    enqueue(app, ["old", "recent", "failed"], "first", {})
+    with app.app_context():
+        outbox.drainOutbox(FakeSender(failing=["failed"]))
+        old = now() - datetime.timedelta(seconds=constants.OUTBOX_RETENTION_SECONDS + constants.OUTBOX_LEASE_SECONDS + 60)
+        NotificationOutbox.query.filter(NotificationOutbox.fcmToken.in_(["old", "failed"])) \
+            .update({"sentOn": old, "nextAttemptOn": old}, synchronize_session=False)
+        db.session.commit()
+        assert outbox.pruneOutbox() == 1
+    assert sorted(getRows(app)) == ["failed", "recent"]
@@ -0,0 +1,52 @@
+import datetime
+from Circles import constants
+from Circles.models import db, Post, User
+from tests.conftest import getAuthHeaders
+
+
+def addUserWithPosts(app, count):
+    with app.app_context():
+        user = User(name="Poster", phoneNumber="+15550000", idCode="POSTER", fcmToken="", upiID="", cards=[], \
+                    suspended=False, joined="N/A", profileImgUrl="")
+        db.session.add(user)
+        db.session.commit()
+        start = datetime.datetime(2019, 1, 1)
+        db.session.add_all([Post(text="Post " + str(index), creatorId=user.id, createdOn=start + datetime.timedelta(minutes=index)) \
+                            for index in range(count)])
+        db.session.commit()
+        userId = user.id
+        db.session.close()
+    return userId
+
+
+def getPosts(client, headers, path):
+    response = client.get(path, headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    return response.get_json()
+
+
+def test_posts_without_limit_or_cursor_returns_every_post(app, client):
+    count = constants.POSTS_PAGE_SIZE + 10
+    headers = getAuthHeaders(app, addUserWithPosts(app, count))
+
+    posts = getPosts(client, headers, "/posts/all?type=sent")
+    assert posts["count"] == count
+    assert "next" not in posts
+    assert posts["posts"][0]["text"] == "Post " + str(count - 1)
+
+
+def test_posts_with_limit_pages_with_cursor(app, client):
+    count = constants.POSTS_PAGE_SIZE + 10
+    headers = getAuthHeaders(app, addUserWithPosts(app, count))
+
+    first = getPosts(client, headers, "/posts/all?type=sent&limit=40")
+    assert first["count"] == 40
+    second = getPosts(client, headers, "/posts/all?type=sent&limit=40&cursor=" + first["next"])
+    assert second["count"] == count - 40
+    assert "next" not in second
+
+    # A cursor alone pages with the default page size
+    third = getPosts(client, headers, "/posts/all?type=sent&cursor=" + first["next"])
+    assert third["count"] == count - 40
+    texts = [post["text"] for post in first["posts"] + second["posts"]]
+    assert len(set(texts)) == count
@@ -0,0 +1,36 @@
+import pytest
+from Circles import constants
+from Circles.models import db
+from benchmarks.seed import seedGraph
+from tests.conftest import getAuthHeaders
+
+
+@pytest.mark.parametrize("withGraph", [True, False])
+def test_profiles_of_friends_and_strangers(app, client, queryCounter, withGraph):
+    with app.app_context():
+        adjacency = seedGraph(users=60, meanDegree=6, postsPerUser=0, accessRequestsPerUser=0, friendRequestsPerUser=0)["adjacency"]
+        db.session.close()
+    if not withGraph:
+        app.extensions["friendGraph"] = None
+    userId = max(adjacency, key=lambda userId: len(adjacency[userId]))
+    friendIds = sorted(adjacency[userId])[:3]
+    strangerIds = [otherId for otherId in sorted(adjacency) if otherId != userId and otherId not in adjacency[userId]][:3]
+    requested = [friendIds[0], strangerIds[0], userId, friendIds[1], strangerIds[1], 10000, friendIds[2], strangerIds[2]]
+    headers = getAuthHeaders(app, userId)
+    path = "/user/profiles?ids=" + ",".join(str(otherId) for otherId in requested) + ",x"
+    client.get(path, headers=headers) # maps the friend graph and caches the user
+
+    queryCounter.start()
+    response = client.get(path, headers=headers)
+    queries = queryCounter.stop()
+    assert response.status_code == constants.STATUS_OK
+
+    result = response.get_json()
+    assert [profile["id"] for profile in result["profiles"]] == [friendIds[0], userId, friendIds[1], friendIds[2]]
+    errors = dict((error["id"], error["error"]) for error in result["errors"])
+    assert errors == {"x": constants.PROFILE_INVALID_ID, strangerIds[0]: constants.PROFILE_NOT_ACCESSIBLE, \
+                      strangerIds[1]: constants.PROFILE_NOT_ACCESSIBLE, strangerIds[2]: constants.PROFILE_NOT_ACCESSIBLE, \
+                      10000: constants.PROFILE_NOT_ACCESSIBLE}
+
+    # The profiles and their cards, plus one query for all the friendships without the graph
+    assert queries == (2 if withGraph else 3)
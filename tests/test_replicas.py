@@ -0,0 +1,76 @@
+import shutil, time
+import flask
+import pytest
+from Circles import constants, create_app, outbox, replicas
+from firebase_admin import messaging
+from Circles.models import db, LastWrite, User, UserCard
+from Circles.APIs import apiBlueprint
+from benchmarks.seed import seedGraph
+from tests.conftest import getAuthHeaders
+
+
+@pytest.fixture
+def replicaApp(tmp_path, monkeypatch):
+    """The app over a seeded database and a copy of it as its replica."""
+    monkeypatch.setenv("FRIEND_GRAPH_DIR", str(tmp_path / "friendGraph"))
+    primaryPath = str(tmp_path / "primary.db")
+    replicaPath = str(tmp_path / "replica.db")
+    open(replicaPath, "w").close()
+    app = create_app("sqlite:///" + primaryPath, checkSchema=False, replicaUris=["sqlite:///" + replicaPath])
+    app.register_blueprint(apiBlueprint)
+    with app.app_context():
+        db.create_all()
+        seedGraph(users=10, meanDegree=3, postsPerUser=0, accessRequestsPerUser=0, friendRequestsPerUser=0)
+        db.session.close()
+    shutil.copyfile(primaryPath, replicaPath)
+    replicas._recentWriters.clear()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    replicas._recentWriters.clear()
+
+
+def readsFromReplica(client, headers):
+    with client:
+        assert client.get("/user/friends", headers=headers).status_code == constants.STATUS_OK
+        return flask.g.readEngine is not None
+
+
+def test_reads_after_a_write_use_the_primary_on_any_worker(replicaApp):
+    # No cookies are kept between requests, like the mobile client
+    client = replicaApp.test_client(use_cookies=False)
+    headers = getAuthHeaders(replicaApp, 1)
+    assert readsFromReplica(client, headers)
+
+    assert client.post("/user/updateUPI", json={"upiID": "new@upi"}, headers=headers).status_code == constants.STATUS_OK
+    replicas._recentWriters.clear() # the next request is served by another worker
+    assert not readsFromReplica(client, headers)
+    # Only the user who wrote reads from the primary
+    assert readsFromReplica(client, getAuthHeaders(replicaApp, 2))
+
+    # Not past REPLICA_READ_YOUR_WRITES_SECONDS
+    with replicaApp.app_context():
+        LastWrite.query.filter_by(userId=1).update({"writtenAt": time.time() - constants.REPLICA_READ_YOUR_WRITES_SECONDS - 1})
+        db.session.commit()
+    replicas._recentWriters.clear()
+    assert readsFromReplica(client, headers)
+
+
+def enqueueNotifications():
+    outbox.enqueueNotifications(["fcm-1", "fcm-2"], messaging.Notification("Title", "Body"), {})
+
+
+def deleteCards():
+    UserCard.query.filter(UserCard.userId == 3).delete(synchronize_session=False)
+
+
+@pytest.mark.parametrize("write", [enqueueNotifications, deleteCards])
+def test_bulk_writes_are_marked(replicaApp, write):
+    with replicaApp.test_request_context():
+        flask.g.user = User.query.get(3)
+        write()
+        db.session.commit()
+        db.session.close()
+    replicas._recentWriters.clear()
+    assert not readsFromReplica(replicaApp.test_client(use_cookies=False), getAuthHeaders(replicaApp, 3))
@@ -0,0 +1,86 @@
+import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from Circles import constants
+from Circles.models import db, Card, Friend, UserCard
+from benchmarks.seed import seedGraph
+from tests.conftest import addUser, getAuthHeaders
+
+
+class ParameterCounter(object):
+    """Largest number of parameters bound to one statement."""
+
+    def __init__(self):
+        self.largest = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.largest = max(self.largest, len(parameters))
+
+
+def test_cardholders_of_a_dense_circle(app, client):
+    with app.app_context():
+        adjacency = seedGraph(users=400, meanDegree=30, postsPerUser=0, accessRequestsPerUser=0, friendRequestsPerUser=0)["adjacency"]
+        holdersByCard = {}
+        for userId, cardId in db.session.query(UserCard.userId, UserCard.cardId):
+            holdersByCard.setdefault(cardId, set()).add(userId)
+        db.session.close()
+
+    userId = sorted(adjacency, key=lambda userId: len(adjacency[userId]))[len(adjacency) // 2]
+    friendIds = set(adjacency[userId])
+    secondDegreeIds = set(otherId for friendId in friendIds for otherId in adjacency[friendId]).difference(friendIds, [userId])
+    assert len(friendIds) + len(secondDegreeIds) > 200
+    cardId = max(holdersByCard, key=lambda cardId: len(holdersByCard[cardId].intersection(secondDegreeIds)))
+
+    counter = ParameterCounter()
+    event.listen(Engine, "before_cursor_execute", counter)
+    try:
+        response = client.get("/user/search/cardholders?cardId=" + str(cardId), headers=getAuthHeaders(app, userId))
+    finally:
+        event.remove(Engine, "before_cursor_execute", counter)
+    assert response.status_code == constants.STATUS_OK
+
+    result = response.get_json()
+    assert set(holder["id"] for holder in result["first"]) == holdersByCard[cardId].intersection(friendIds)
+    assert set(holder["id"] for holder in result["second"]) == holdersByCard[cardId].intersection(secondDegreeIds)
+    assert result["numSecond"] > 0
+    for holder in result["second"]:
+        assert holder["cardId"] == cardId
+        assert holder["numMutualFriends"] == len(friendIds.intersection(adjacency[holder["id"]]))
+
+    # Queries bind the holders found and their mutual friends, never the whole two hop circle
+    assert counter.largest <= len(result["first"]) + 2 * len(result["second"]) + 1
+
+
+def addFriendship(userId, friendId, startedOn):
+    db.session.add_all([Friend(userId=userId, friendId=friendId, startedOn=startedOn), \
+                        Friend(userId=friendId, friendId=userId, startedOn=startedOn)])
+
+
+def test_cardholders_of_a_tag_name_the_oldest_mutual_friend(app, client):
+    with app.app_context():
+        db.session.add_all([Card(id=1, name="Travel", objectType=constants.CARD_TYPE_TAG), \
+                            Card(id=2, name="Miles", objectType="Card", tagId=1), \
+                            Card(id=3, name="Lounge", objectType="Card", tagId=1), \
+                            Card(id=4, name="Grocery", objectType="Card")])
+        me, friend, newerMutual, olderMutual, second, stranger = [addUser(name) for name in ["0", "1", "2", "3", "4", "5"]]
+        addFriendship(me, friend, datetime.datetime(2019, 1, 1))
+        addFriendship(me, newerMutual, datetime.datetime(2019, 1, 1))
+        addFriendship(me, olderMutual, datetime.datetime(2018, 1, 1))
+        addFriendship(newerMutual, second, datetime.datetime(2019, 2, 1))
+        addFriendship(olderMutual, second, datetime.datetime(2018, 6, 1))
+        db.session.add_all([UserCard(userId=friend, cardId=2), UserCard(userId=second, cardId=3), \
+                            UserCard(userId=second, cardId=4), UserCard(userId=stranger, cardId=2)])
+        db.session.commit()
+    headers = getAuthHeaders(app, me)
+
+    response = client.get("/user/search/cardholders?cardId=1", headers=headers)
+    assert response.status_code == constants.STATUS_OK
+    result = response.get_json()
+    assert [(holder["id"], holder["cardName"]) for holder in result["first"]] == [(friend, "Miles")]
+    assert result["second"] == [{"name": "4", "id": second, "cardId": 3, "cardName": "Lounge", \
+                                 "friendName": "3", "numMutualFriends": 2}]
+
+    # A card that is not a tag only matches its own holders
+    result = client.get("/user/search/cardholders?cardId=2", headers=headers).get_json()
+    assert (result["numFirst"], result["numSecond"]) == (1, 0)
+    assert client.get("/user/search/cardholders?cardId=99", headers=headers).status_code == constants.STATUS_BAD_REQUEST
@@ -0,0 +1,61 @@
+import pytest
+from cachetools import TTLCache
+from Circles import constants
+from Circles.APIs import users
+from Circles.models import db
+from tests.conftest import addUser, getAuthHeaders
+
+
+class CountingJwtGenerator(object):
+    """Mints a distinct token on every call and counts the generators built."""
+    built = 0
+
+    def __init__(self):
+        CountingJwtGenerator.built += 1
+        self.minted = 0
+
+    def generate_token(self, identity):
+        self.minted += 1
+        return Token(identity + "-" + str(self.minted))
+
+
+class Token(object):
+    def __init__(self, value):
+        self.value = value
+
+    def to_string(self):
+        return self.value
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    CountingJwtGenerator.built = 0
+    monkeypatch.setattr(users, "buildVirgilJwtGenerator", CountingJwtGenerator)
+    monkeypatch.setattr(users, "_virgilGenerator", None)
+    monkeypatch.setattr(users, "_virgilTokens", TTLCache(maxsize=constants.VIRGIL_TOKEN_CACHE_SIZE, \
+                                                         ttl=constants.VIRGIL_TOKEN_REUSE_SECONDS, timer=lambda: now[0]))
+    return now
+
+
+def test_tokens_are_reused_within_the_reuse_window(clock):
+    assert users.getVirgilToken(1) == "1-1"
+    assert users.getVirgilToken(2) == "2-2"
+    clock[0] += constants.VIRGIL_TOKEN_REUSE_SECONDS - 1
+    assert users.getVirgilToken(1) == "1-1"
+
+    clock[0] += 2
+    assert users.getVirgilToken(1) == "1-3"
+    assert CountingJwtGenerator.built == 1
+
+
+def test_virgil_jwt_endpoint(app, client, clock):
+    with app.app_context():
+        userId = addUser("0")
+        db.session.close()
+    headers = getAuthHeaders(app, userId)
+
+    first = client.get("/user/getVirgilJWT", headers=headers)
+    assert first.status_code == constants.STATUS_OK
+    assert client.get("/user/getVirgilJWT", headers=headers).get_json() == first.get_json() == {"token": str(userId) + "-1"}
+    assert CountingJwtGenerator.built == 1